@@ -1,64 +1,206 @@
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, Blueprint, current_app, request, jsonify, send_file, Response
 from flask_cors import CORS
 import requests
-import sqlite3
 import json
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
 import time
 from collections import defaultdict
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
 import io
-import firebase_admin
-from firebase_admin import credentials, auth
+import threading
 from functools import wraps
+import hmac
+import hashlib
+import queue
+import metrics
+import nutrients
+import profiling
+import servings
+from food_cache import FoodCache, SuggestionIndex
+from recommendations import MACROS, FoodMatrixCache
+from archive import Archiver
+from events import EventBroker
+from group_commit import GroupCommitWriter, WriteQueueFull, WriteTimeout
+from prefetch import Prefetcher
+from search_queries import SEARCH_QUERY_DIR, QueryCanonicalizer, QueryStats, parse_synonyms
+from profiling import phase
+from slow_query_log import slow_query_log
+from storage import ANONYMOUS_HISTORY_USER, INTAKE_COLUMNS, IdempotencyConflict, MemoryStorage, ShardedStorage, SQLiteStorage
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app, origins=['http://localhost:5175', 'http://192.168.200.109:5175', 'http://localhost:5176', 'http://192.168.200.109:5176'], 
-     methods=['GET', 'POST', 'PUT', 'DELETE'], 
-     allow_headers=['Content-Type', 'Authorization'])
+# All routes live on this blueprint; create_app() registers it on a configured app
+api = Blueprint('api', __name__)
 
 # Firebase Configuration
+# firebase_admin (and the google-auth/grpc stack behind it) is imported and initialized
+# on the first token verification rather than at startup, so workers boot faster and
+# routes that never authenticate don't pay for it.
 firebase_config_path = os.getenv('FIREBASE_CONFIG_PATH', 'firebase-service-account.json')
-if os.path.exists(firebase_config_path):
-    cred = credentials.Certificate(firebase_config_path)
-    firebase_admin.initialize_app(cred)
-    print("Firebase Admin SDK initialized successfully")
-else:
-    print("Warning: Firebase service account file not found. Some features may not work.")
-
-# USDA API Configuration
-USDA_API_KEY = os.getenv('USDA_API_KEY', 'DEMO_KEY')  # Replace with your actual API key
-USDA_BASE_URL = 'https://api.nal.usda.gov/fdc/v1'
-
-# Rate limiting configuration
-RATE_LIMIT_REQUESTS = 30  # Max requests per minute per IP
-RATE_LIMIT_WINDOW = 60   # Time window in seconds
-request_counts = defaultdict(list)
+_firebase_auth = None
+_firebase_lock = threading.Lock()
 
-def is_rate_limited(client_ip):
-    """Check if the client IP has exceeded rate limits"""
-    now = datetime.now()
-    minute_ago = now - timedelta(seconds=RATE_LIMIT_WINDOW)
-    
-    # Clean old requests
-    request_counts[client_ip] = [req_time for req_time in request_counts[client_ip] if req_time > minute_ago]
+def get_firebase_auth():
+    """Return firebase_admin.auth, initializing the Firebase app once (thread-safe)"""
+    global _firebase_auth
+    if _firebase_auth is None:
+        with _firebase_lock:
+            if _firebase_auth is None:
+                import firebase_admin
+                from firebase_admin import credentials, auth as firebase_auth
+                
+                if os.path.exists(firebase_config_path):
+                    if not firebase_admin._apps:
+                        firebase_admin.initialize_app(credentials.Certificate(firebase_config_path))
+                    print("Firebase Admin SDK initialized successfully")
+                else:
+                    print("Warning: Firebase service account file not found. Some features may not work.")
+                _firebase_auth = firebase_auth
+    return _firebase_auth
+
+class LazyFirebaseAuth:
+    """Stands in for firebase_admin.auth until first use"""
+    def __getattr__(self, name):
+        return getattr(get_firebase_auth(), name)
+
+auth = LazyFirebaseAuth()
+
+# Search history configuration (ring size per user: HISTORY_SLOTS in storage.py)
+HISTORY_PAGE_SIZE = 20  # Entries returned by GET /api/history
+
+# Daily intake limits that raise an alert when a logged meal crosses them (FDA daily values)
+INTAKE_LIMITS = {
+    'sodium': (2300, 'mg'),
+    'sugar': (50, 'g'),
+}
+CALORIE_ALERT_RATIO = 1.1  # Calories alert once a day passes the user's target by 10%
+
+# Trend analytics
+TREND_WINDOWS = (7, 30, 90)  # Rolling average windows in days
+ADHERENCE_TOLERANCE = 0.1  # A logged day adheres when calories are within 10% of the target
+STREAM_RETRY_MS = 3000  # EventSource reconnect delay sent to clients
+DASHBOARD_SECTIONS = ('profile', 'summary', 'meals', 'alerts', 'history')
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+MEAL_CHANGES_PAGE_SIZE = 500  # Default and maximum changes per GET /api/meals/changes page
+SAVED_MEAL_MAX_COMPONENTS = 20  # Foods per saved meal
+SEARCH_PAGE_SIZE = 10  # Default foods per /api/search page
+SEARCH_MAX_PAGE_SIZE = 200  # USDA's largest pageSize
+
+def default_config():
+    """App configuration from the environment; create_app(config) overrides individual keys"""
+    return {
+        # USDA API Configuration
+        'USDA_API_KEY': os.getenv('USDA_API_KEY', 'DEMO_KEY'),  # Replace with your actual API key
+        'USDA_BASE_URL': os.getenv('USDA_BASE_URL', 'https://api.nal.usda.gov/fdc/v1'),  # Overridable for local stubs
+        # Database Configuration ('memory' keeps everything in process, for tests and benchmarks;
+        # 'sharded' keeps users in DATABASE_PATH and per-user data in SHARD_COUNT files next to it)
+        'STORAGE_BACKEND': os.getenv('STORAGE_BACKEND', 'sqlite'),
+        'DATABASE_PATH': os.getenv('DATABASE_PATH', 'nutrivault.db'),
+        'SHARD_COUNT': int(os.getenv('SHARD_COUNT', 4)),
+        # Admin token for operational endpoints and request profiling (disabled when unset)
+        'ADMIN_TOKEN': os.getenv('ADMIN_TOKEN'),
+        # Rate limiting configuration
+        'RATE_LIMIT_REQUESTS': int(os.getenv('RATE_LIMIT_REQUESTS', 30)),  # Max requests per minute per IP
+        'RATE_LIMIT_WINDOW': 60,  # Time window in seconds
+        # USDA response caches and the suggestion index (see food_cache.py)
+        'FOOD_CACHE_SIZE': int(os.getenv('FOOD_CACHE_SIZE', 5000)),
+        'FOOD_CACHE_TTL': int(os.getenv('FOOD_CACHE_TTL', 24 * 3600)),
+        'SEARCH_CACHE_SIZE': int(os.getenv('SEARCH_CACHE_SIZE', 2000)),
+        'SEARCH_CACHE_TTL': int(os.getenv('SEARCH_CACHE_TTL', 6 * 3600)),
+        'SEARCH_PREFETCH_PAGES': int(os.getenv('SEARCH_PREFETCH_PAGES', 1)),  # Pages fetched ahead of /api/search (0 disables)
+        # Extra /api/search synonyms on top of search_queries.DEFAULT_SYNONYMS, as
+        # 'phrase=replacement,...' (or a dict when passed to create_app)
+        'SEARCH_SYNONYMS': os.getenv('SEARCH_SYNONYMS', ''),
+        'SEARCH_QUERY_DIR': SEARCH_QUERY_DIR,  # Per-worker /api/admin/search-queries counts (see search_queries.py)
+        'WARM_FOOD_COUNT': int(os.getenv('WARM_FOOD_COUNT', 500)),  # Popular foods preloaded by warm_caches()
+        'SUGGEST_WARM_ROWS': int(os.getenv('SUGGEST_WARM_ROWS', 200000)),  # Recent meal_logs rows indexed
+        'FOOD_MATRIX_MAX_AGE': int(os.getenv('FOOD_MATRIX_MAX_AGE', 300)),  # Seconds before the recommendation matrix reloads
+        'TRENDS_CACHE_SIZE': int(os.getenv('TRENDS_CACHE_SIZE', 10000)),  # Cached /api/analytics/trends results
+        # /api/stream: seconds between keepalive comments, and before the server ends a stream
+        # (the client reconnects, which re-checks its token)
+        'STREAM_KEEPALIVE': int(os.getenv('STREAM_KEEPALIVE', 15)),
+        'STREAM_MAX_AGE': int(os.getenv('STREAM_MAX_AGE', 600)),
+        # Open streams per worker before /api/stream returns 503; each holds one of the worker's
+        # gunicorn threads (GUNICORN_THREADS), so keep it well below that
+        'STREAM_MAX_PER_WORKER': int(os.getenv('STREAM_MAX_PER_WORKER', 8)),
+        # POST /api/meals group commit (see group_commit.py): meals per transaction, milliseconds
+        # the writer waits for more after the first, and pending meals before requests get 503
+        'GROUP_COMMIT_MAX_BATCH': int(os.getenv('GROUP_COMMIT_MAX_BATCH', 64)),
+        'GROUP_COMMIT_DELAY_MS': float(os.getenv('GROUP_COMMIT_DELAY_MS', 2)),
+        'GROUP_COMMIT_QUEUE_SIZE': int(os.getenv('GROUP_COMMIT_QUEUE_SIZE', 1000)),
+        # Seconds a POST /api/meals Idempotency-Key is remembered
+        'IDEMPOTENCY_TTL': int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600)),
+        # Background refresh of popular foods/searches (see prefetch.py): seconds between runs,
+        # USDA calls per interval shared by all workers (0 disables), hot-set sizes, and the
+        # request rate above which a worker counts as busy and skips prefetching
+        'PREFETCH_INTERVAL': int(os.getenv('PREFETCH_INTERVAL', 300)),
+        'PREFETCH_BUDGET': int(os.getenv('PREFETCH_BUDGET', 50)),
+        'PREFETCH_FOODS': int(os.getenv('PREFETCH_FOODS', 300)),
+        'PREFETCH_QUERIES': int(os.getenv('PREFETCH_QUERIES', 50)),
+        'PREFETCH_QUIET_RPS': float(os.getenv('PREFETCH_QUIET_RPS', 5)),
+        # Archival of old meals (see archive.py): age in days before a meal moves to its month's
+        # archive table (0 disables), seconds between runs, rows per transaction, and free pages
+        # returned to the filesystem per run
+        'ARCHIVE_AFTER_DAYS': int(os.getenv('ARCHIVE_AFTER_DAYS', 180)),
+        'ARCHIVE_INTERVAL': int(os.getenv('ARCHIVE_INTERVAL', 3600)),
+        'ARCHIVE_BATCH': int(os.getenv('ARCHIVE_BATCH', 5000)),
+        'VACUUM_PAGES': int(os.getenv('VACUUM_PAGES', 2000)),
+    }
+
+class RateLimiter:
+    """Sliding-window request counter per client IP (per process)"""
+    def __init__(self, max_requests, window):
+        self.max_requests = max_requests
+        self.window = window
+        self.request_counts = defaultdict(list)
     
-    # Check if limit exceeded
-    if len(request_counts[client_ip]) >= RATE_LIMIT_REQUESTS:
-        return True
+    def is_rate_limited(self, client_ip):
+        """Check if the client IP has exceeded rate limits"""
+        now = datetime.now()
+        minute_ago = now - timedelta(seconds=self.window)
+        
+        # Clean old requests
+        self.request_counts[client_ip] = [req_time for req_time in self.request_counts[client_ip] if req_time > minute_ago]
+        
+        # Check if limit exceeded
+        if len(self.request_counts[client_ip]) >= self.max_requests:
+            return True
+        
+        # Add current request
+        self.request_counts[client_ip].append(now)
+        return False
+
+def is_rate_limited(client_ip):
+    return current_app.extensions['rate_limiter'].is_rate_limited(client_ip)
+
+def usda_get(endpoint, path, params):
+    """GET from the USDA API, recording latency and status per endpoint label"""
+    start = time.perf_counter()
+    try:
+        with phase('usda'):
+            response = requests.get(f"{current_app.config['USDA_BASE_URL']}{path}", params=params)
+    except requests.exceptions.RequestException:
+        metrics.observe_usda(endpoint, time.perf_counter() - start, 'error')
+        raise
+    metrics.observe_usda(endpoint, time.perf_counter() - start, response.status_code)
+    return response
+
+def is_admin_request():
+    """True if the request carries the configured admin token"""
+    admin_token = current_app.config['ADMIN_TOKEN']
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(admin_token) and hmac.compare_digest(supplied.encode(), admin_token.encode())
+
+def admin_token_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({'error': 'Admin token required'}), 403
+        return f(*args, **kwargs)
     
-    # Add current request
-    request_counts[client_ip].append(now)
-    return False
+    return decorated_function
 
 # Firebase Authentication Decorator
 def firebase_auth_required(f):
@@ -70,7 +212,8 @@ def firebase_auth_required(f):
         
         try:
             token = auth_header.split('Bearer ')[1]
-            decoded_token = auth.verify_id_token(token)
+            with phase('auth'):
+                decoded_token = auth.verify_id_token(token)
             request.user = decoded_token
             return f(*args, **kwargs)
         except Exception as e:
@@ -78,83 +221,210 @@ def firebase_auth_required(f):
     
     return decorated_function
 
-# Initialize SQLite database for history and user data
-def init_db():
-    conn = sqlite3.connect('nutrivault.db')
-    cursor = conn.cursor()
-    
-    # Existing search history table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS search_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            fdc_id TEXT NOT NULL,
-            food_name TEXT NOT NULL,
-            searched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            nutrition_data TEXT
-        )
-    ''')
-    
-    # User profiles table with additional columns
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            firebase_uid TEXT UNIQUE NOT NULL,
-            email TEXT NOT NULL,
-            age INTEGER,
-            weight REAL,
-            height REAL,
-            activity_level TEXT,
-            dietary_goal TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # User dietary goals table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS dietary_goals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            goal_type TEXT NOT NULL, -- 'weight_loss', 'muscle_gain', 'maintenance'
-            target_calories INTEGER,
-            target_protein REAL,
-            target_carbs REAL,
-            target_fat REAL,
-            current_weight REAL,
-            target_weight REAL,
-            activity_level TEXT, -- 'sedentary', 'light', 'moderate', 'active', 'very_active'
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # User meals/food log table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS meal_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            fdc_id TEXT NOT NULL,
-            food_name TEXT NOT NULL,
-            serving_size REAL NOT NULL,
-            serving_unit TEXT NOT NULL,
-            calories REAL NOT NULL,
-            protein REAL,
-            carbs REAL,
-            fat REAL,
-            meal_type TEXT, -- 'breakfast', 'lunch', 'dinner', 'snack'
-            logged_date DATE NOT NULL,
-            logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
+def firebase_auth_optional(f):
+    """Like firebase_auth_required, but lets anonymous requests through with request.user = None"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            request.user = None
+            return f(*args, **kwargs)
+        if not auth_header.startswith('Bearer '):
+            return jsonify({'error': 'Authorization header must be a Bearer token'}), 401
+        
+        try:
+            token = auth_header.split('Bearer ')[1]
+            with phase('auth'):
+                decoded_token = auth.verify_id_token(token)
+            request.user = decoded_token
+        except Exception as e:
+            return jsonify({'error': 'Invalid token'}), 401
+        return f(*args, **kwargs)
+    
+    return decorated_function
+
+def get_storage():
+    """The current app's storage (see storage.py); open a session on it for each request"""
+    return current_app.extensions['storage']
+
+def record_intake_alerts(db, user_id, logged_date, meal, totals):
+    """Record every limit the just-logged meal pushes its day over (totals already
+    include the meal). Constant work per meal; returns the new alerts."""
+    amounts = {key: float(meal.get(key) or 0) for key in ('calories', 'sodium', 'sugar')}
+    
+    limits = dict(INTAKE_LIMITS)
+    if amounts['calories'] > 0:
+        goals = db.goals.latest(user_id)
+        if goals and goals['target_calories']:
+            limits['calories'] = (round(goals['target_calories'] * CALORIE_ALERT_RATIO), 'kcal')
+    
+    alerts = []
+    for nutrient, (threshold, unit) in limits.items():
+        total = totals[nutrient]
+        # Only the meal that crosses the line raises the alert
+        if amounts[nutrient] > 0 and total - amounts[nutrient] < threshold <= total:
+            if db.alerts.add(user_id, logged_date, nutrient, total, threshold, unit):
+                alerts.append({
+                    'date': str(logged_date),
+                    'nutrient': nutrient,
+                    'amount': round(total, 1),
+                    'threshold': threshold,
+                    'unit': unit
+                })
+    return alerts
+
+def record_meal_change(db, user_id, old, new=None):
+    """Bring alerts, stats_version and /api/stream up to date after meal `old` was edited
+    into `new` (or deleted, when new is None); returns the alerts the edit raised"""
+    days = [old['logged_date']] + ([new['logged_date']] if new and new['logged_date'] != old['logged_date'] else [])
+    alerts = []
+    for day in days:
+        totals = db.meals.day_totals(user_id, day)
+        db.alerts.clear_resolved(user_id, day)
+        if new and day == new['logged_date']:
+            # Only what the edit added can cross a limit
+            before = old if day == old['logged_date'] else {}
+            added = {key: float(new.get(key) or 0) - float(before.get(key) or 0) for key in ('calories', 'sodium', 'sugar')}
+            alerts = record_intake_alerts(db, user_id, day, added, totals)
+        db.events.publish(user_id, 'summary', {
+            'date': str(day),
+            'totals': rounded_totals(totals),
+            'alerts': alerts if new and day == new['logged_date'] else []
+        })
+    db.users.bump_stats_version(user_id)
+    return alerts
+
+def notify_events():
+    """Deliver committed events to this worker's streams now; other workers pick them up on their next poll"""
+    current_app.extensions['events'].wake()
+
+def rounded_totals(totals):
+    """A day's totals rounded like /api/nutrition-summary"""
+    return {
+        'calories': round(totals['calories']),
+        'protein': round(totals['protein'], 1),
+        'carbs': round(totals['carbs']),
+        'fat': round(totals['fat']),
+        'meal_count': totals['meal_count']
+    }
+
+def idempotency_request(data):
+    """(Idempotency-Key header or None, hash of this path and body); ValueError for a malformed key"""
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValueError(f'Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+    # The path is hashed too, so a key reused on another endpoint gets 422 instead of a foreign response
+    request_hash = hashlib.sha256(json.dumps([request.path, data], sort_keys=True).encode()).hexdigest()
+    return key, request_hash
+
+def submit_idempotent(user_id, key, request_hash, write, stored=None):
+    """Run write(db) -> response on the user's group-commit writer, once per Idempotency-Key (key may be None).
+    Returns {'request_hash', 'response', 'replayed'}; stored is a lookup the caller already made.
+    A None response isn't stored. Raises WriteQueueFull/WriteTimeout like GroupCommitWriter.submit."""
+    if stored is not None:
+        return {**stored, 'replayed': True}
+    ttl = current_app.config['IDEMPOTENCY_TTL']
     
-    conn.commit()
-    conn.close()
+    def idempotent_write(db):
+        if key:
+            # A retry that arrived while the first attempt was still queued
+            stored = db.idempotency.get(user_id, key, ttl)
+            if stored is not None:
+                return {**stored, 'replayed': True}
+        response = write(db)
+        if key and response is not None:
+            db.idempotency.add(user_id, key, request_hash, response, ttl)
+        return {'request_hash': request_hash, 'response': response, 'replayed': False}
+    
+    try:
+        return current_app.extensions['meal_writer'].submit(idempotent_write, get_storage().partition(user_id))
+    except IdempotencyConflict:
+        # Another worker stored the same key first; this attempt was rolled back
+        with get_storage().session() as db:
+            return {**db.idempotency.get(user_id, key, ttl), 'replayed': True}
+
+def user_profile(db, user):
+    """Profile response for a db.users.get() row, with the user's latest dietary goals"""
+    goals = db.goals.latest(user['id'])
+    profile = {key: user[key] for key in ('id', 'firebase_uid', 'email', 'age', 'weight', 'height',
+                                          'activity_level', 'dietary_goal', 'created_at', 'updated_at')}
+    profile['dietary_goals'] = None
+    if goals:
+        profile['dietary_goals'] = {key: goals[key] for key in (
+            'goal_type', 'target_calories', 'target_protein', 'target_carbs', 'target_fat',
+            'current_weight', 'target_weight', 'activity_level')}
+    return profile
+
+def nutrition_summary(db, user_id, date):
+    """One day's totals, goals and percentage progress, as returned by /api/nutrition-summary"""
+    totals = db.meals.day_totals(user_id, date)
+    latest_goals = db.goals.latest(user_id)
+    
+    summary = {
+        'date': str(date),
+        'totals': rounded_totals(totals),
+        'goals': None,
+        'progress': None
+    }
+    
+    if latest_goals:
+        totals = [totals[macro] for macro in MACROS]
+        goals = [latest_goals[f'target_{macro}'] for macro in MACROS]
+        summary['goals'] = {
+            'calories': round(goals[0] or 0),
+            'protein': round(goals[1] or 0, 1),
+            'carbs': round(goals[2] or 0),
+            'fat': round(goals[3] or 0)
+        }
+        summary['progress'] = {
+            'calories': round((totals[0] / goals[0]) * 100, 1) if goals[0] and goals[0] > 0 else 0,
+            'protein': round((totals[1] / goals[1]) * 100, 1) if goals[1] and goals[1] > 0 else 0,
+            'carbs': round((totals[2] / goals[2]) * 100, 1) if goals[2] and goals[2] > 0 else 0,
+            'fat': round((totals[3] / goals[3]) * 100, 1) if goals[3] and goals[3] > 0 else 0
+        }
+    else:
+        summary['goals'] = {
+            'calories': 0,
+            'protein': 0,
+            'carbs': 0,
+            'fat': 0
+        }
+        summary['progress'] = {
+            'calories': 0,
+            'protein': 0,
+            'carbs': 0,
+            'fat': 0
+        }
+    return summary
+
+def format_alert(alert):
+    return {
+        'date': alert['date'],
+        'nutrient': alert['nutrient'],
+        'amount': round(alert['amount'], 1),
+        'threshold': alert['threshold'],
+        'unit': alert['unit'],
+        'created_at': alert['created_at'],
+        'day_total': round(alert['day_total'] or 0, 1)
+    }
+
+def format_history(entry):
+    return {
+        'fdcId': entry['fdc_id'],
+        'foodName': entry['food_name'],
+        'searchedAt': entry['searched_at'],
+        'nutritionData': entry['nutrition_data']
+    }
+
+def history_owner(db):
+    """Resolve whose history ring this request uses; returns None if the user is unknown"""
+    if request.user is None:
+        return ANONYMOUS_HISTORY_USER
+    return db.users.get_id(request.user['uid'])
 
 # User Authentication and Profile Endpoints
 
-@app.route('/api/auth/verify', methods=['POST'])
+@api.route('/api/auth/verify', methods=['POST'])
 def verify_user():
     """Verify Firebase token and create/update user profile"""
     try:
@@ -165,28 +435,14 @@ def verify_user():
             return jsonify({'error': 'ID token required'}), 400
         
         # Verify the token
-        decoded_token = auth.verify_id_token(id_token)
+        with phase('auth'):
+            decoded_token = auth.verify_id_token(id_token)
         firebase_uid = decoded_token['uid']
         email = decoded_token.get('email', '')
         
         # Create or update user in database
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if user_row:
-            # User exists, update timestamp
-            cursor.execute('UPDATE users SET updated_at = CURRENT_TIMESTAMP, email = ? WHERE firebase_uid = ?', (email, firebase_uid))
-            user_id = user_row[0]
-        else:
-            # User does not exist, insert new
-            cursor.execute('INSERT INTO users (firebase_uid, email, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)', (firebase_uid, email))
-            user_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
+        with get_storage().session() as db:
+            user_id = db.users.login(firebase_uid, email)
         
         return jsonify({
             'success': True,
@@ -200,72 +456,29 @@ def verify_user():
     except Exception as e:
         return jsonify({'error': str(e)}), 401
 
-@app.route('/api/profile', methods=['GET'])
+@api.route('/api/profile', methods=['GET'])
 @firebase_auth_required
 def get_user_profile():
     """Get user profile and current dietary goals"""
     try:
         firebase_uid = request.user['uid']
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        
-        # Get user info
-        cursor.execute('SELECT * FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
-        
-        user_id = user_row[0]
-        
-        # Get current dietary goals
-        cursor.execute('''
-            SELECT * FROM dietary_goals 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (user_id,))
-        goals_row = cursor.fetchone()
-        
-        conn.close()
-        
-        user_profile = {
-            'id': user_row[0],
-            'firebase_uid': user_row[1],
-            'email': user_row[2],
-            'age': user_row[3],
-            'weight': user_row[4],
-            'height': user_row[5],
-            'activity_level': user_row[6],
-            'dietary_goal': user_row[7],
-            'created_at': user_row[8],
-            'updated_at': user_row[9],
-            'dietary_goals': None
-        }
-        
-        if goals_row:
-            user_profile['dietary_goals'] = {
-                'goal_type': goals_row[2],
-                'target_calories': goals_row[3],
-                'target_protein': goals_row[4],
-                'target_carbs': goals_row[5],
-                'target_fat': goals_row[6],
-                'current_weight': goals_row[7],
-                'target_weight': goals_row[8],
-                'activity_level': goals_row[9]
-            }
+        with get_storage().session() as db:
+            user = db.users.get(firebase_uid)
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            profile = user_profile(db, user)
         
         return jsonify({
             'success': True,
-            'profile': user_profile
+            'profile': profile
         })
         
     except Exception as e:
         print(f"Error getting user profile: {str(e)}")  # Add logging
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/dietary-goals', methods=['POST'])
+@api.route('/api/dietary-goals', methods=['POST'])
 @firebase_auth_required
 def set_dietary_goals():
     """Set or update user's dietary goals"""
@@ -273,17 +486,6 @@ def set_dietary_goals():
         firebase_uid = request.user['uid']
         data = request.get_json()
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
-        
-        user_id = user_row[0]
-        
         # Calculate nutritional targets based on goals
         goal_type = data.get('goal_type')
         current_weight = float(data.get('current_weight', 0) or 0)
@@ -318,16 +520,31 @@ def set_dietary_goals():
         target_fat = target_calories * 0.25 / 9  # 25% of calories from fat
         target_carbs = (target_calories - (target_protein * 4) - (target_fat * 9)) / 4
         
-        cursor.execute('''
-            INSERT INTO dietary_goals (
-                user_id, goal_type, target_calories, target_protein, 
-                target_carbs, target_fat, current_weight, target_weight, activity_level
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, goal_type, target_calories, target_protein, 
-              target_carbs, target_fat, current_weight, target_weight, activity_level))
-        
-        conn.commit()
-        conn.close()
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            db.goals.add(user_id, {
+                'goal_type': goal_type,
+                'target_calories': target_calories,
+                'target_protein': target_protein,
+                'target_carbs': target_carbs,
+                'target_fat': target_fat,
+                'current_weight': current_weight,
+                'target_weight': target_weight,
+                'activity_level': activity_level
+            })
+            db.users.bump_stats_version(user_id)
+            db.events.publish(user_id, 'goals', {
+                'goals': {
+                    'calories': round(target_calories),
+                    'protein': round(target_protein, 1),
+                    'carbs': round(target_carbs),
+                    'fat': round(target_fat)
+                }
+            })
+        notify_events()
         
         return jsonify({
             'success': True,
@@ -346,51 +563,95 @@ def set_dietary_goals():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/meals', methods=['POST'])
+@api.route('/api/meals', methods=['POST'])
 @firebase_auth_required
 def log_meal():
     """Log a meal/food item"""
     try:
         firebase_uid = request.user['uid']
         data = request.get_json()
+        logged_date = data.get('logged_date', datetime.now().date())
+        try:
+            idempotency_key, request_hash = idempotency_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            # Retries are normally answered here with one indexed lookup, without queuing a write
+            stored = (db.idempotency.get(user_id, idempotency_key, current_app.config['IDEMPOTENCY_TTL'])
+                      if user_id is not None and idempotency_key else None)
+        if user_id is None:
+            return jsonify({'error': 'User not found'}), 404
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
+        if stored is None and data.get('calories') is None:
+            if not data.get('fdc_id'):
+                return jsonify({'error': 'fdc_id is required when calories are not sent'}), 400
+            food = meal_food(data['fdc_id'])
+            if food is None:
+                return jsonify({'error': 'Food item not found'}), 404
+            try:
+                data = {
+                    **data,
+                    **servings.serving_nutrients(food, data.get('serving_size'), data.get('serving_unit')),
+                    'food_name': data.get('food_name') or food['description'],
+                    'serving_unit': data.get('serving_unit') or 'g'
+                }
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
+        # Runs on the group-commit writer thread of the user's partition, batched with other requests' meals
+        def write(db):
+            meal_id = db.meals.add(user_id, {**data, 'logged_date': logged_date})
+            
+            # Same transaction, so totals and alerts never disagree with meal_logs
+            totals = db.meals.day_totals(user_id, logged_date)
+            alerts = record_intake_alerts(db, user_id, logged_date, data, totals)
+            db.users.bump_stats_version(user_id)
+            db.events.publish(user_id, 'summary', {
+                'date': str(logged_date),
+                'totals': rounded_totals(totals),
+                'meal': {
+                    'id': meal_id,
+                    'fdc_id': data.get('fdc_id'),
+                    'food_name': data.get('food_name'),
+                    'meal_type': data.get('meal_type'),
+                    'calories': data.get('calories')
+                },
+                'alerts': alerts
+            })
+            return {
+                'meal_id': meal_id,
+                'alerts': alerts,
+                'nutrients': {key: data.get(key) for key in INTAKE_COLUMNS}
+            }
         
-        user_id = user_row[0]
+        try:
+            written = submit_idempotent(user_id, idempotency_key, request_hash, write, stored)
+        except (WriteQueueFull, WriteTimeout):
+            return jsonify({'error': 'Too many meals are being logged right now. Please try again.'}), 503, {'Retry-After': '1'}
+        if written['request_hash'] != request_hash:
+            return jsonify({'error': 'Idempotency-Key was already used for a different meal'}), 422
         
-        cursor.execute('''
-            INSERT INTO meal_logs (
-                user_id, fdc_id, food_name, serving_size, serving_unit,
-                calories, protein, carbs, fat, meal_type, logged_date
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id, data.get('fdc_id'), data.get('food_name'),
-            data.get('serving_size'), data.get('serving_unit'),
-            data.get('calories'), data.get('protein'), data.get('carbs'),
-            data.get('fat'), data.get('meal_type'), data.get('logged_date', datetime.now().date())
-        ))
+        if written['replayed']:
+            return jsonify({
+                'success': True,
+                **written['response'],
+                'message': 'Meal logged successfully'
+            }), 200, {'Idempotent-Replayed': 'true'}
         
-        meal_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        notify_events()
         
         return jsonify({
             'success': True,
-            'meal_id': meal_id,
+            **written['response'],
             'message': 'Meal logged successfully'
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/meals', methods=['GET'])
+@api.route('/api/meals', methods=['GET'])
 @firebase_auth_required
 def get_meals():
     """Get user's meal history"""
@@ -399,190 +660,601 @@ def get_meals():
         date_filter = request.args.get('date')  # Optional date filter
         days = int(request.args.get('days', 7))  # Default to 7 days
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            meals = db.meals.list(user_id, date_filter, days)
         
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
+        return jsonify({
+            'success': True,
+            'meals': meals
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/meals/changes', methods=['GET'])
+@firebase_auth_required
+def get_meal_changes():
+    """Meals logged or edited, and ids deleted, since the client's cursor"""
+    try:
+        firebase_uid = request.user['uid']
+        since = max(0, request.args.get('since', default=0, type=int))
+        limit = max(1, min(request.args.get('limit', default=MEAL_CHANGES_PAGE_SIZE, type=int), MEAL_CHANGES_PAGE_SIZE))
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            meals, deleted, cursor, has_more = db.meals.changes(user_id, since, limit)
+        
+        return jsonify({
+            'success': True,
+            'meals': meals,
+            'deleted': deleted,
+            'cursor': cursor,
+            'has_more': has_more
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/meals/<int:meal_id>', methods=['PUT'])
+@firebase_auth_required
+def update_meal(meal_id):
+    """Edit a logged meal; fields left out of the body keep their values"""
+    try:
+        firebase_uid = request.user['uid']
+        data = request.get_json()
+        
+        # Reads the meal, then writes it: take the write lock first, so a concurrent edit can't apply twice
+        with get_storage().session(immediate=True) as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            updated = db.meals.update(user_id, meal_id, data)
+            if updated is None:
+                return jsonify({'error': 'Meal not found'}), 404
+            old, new = updated
+            alerts = record_meal_change(db, user_id, old, new)
+        notify_events()
+        
+        return jsonify({
+            'success': True,
+            'meal': new,
+            'alerts': alerts,
+            'message': 'Meal updated successfully'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/meals/<int:meal_id>', methods=['DELETE'])
+@firebase_auth_required
+def delete_meal(meal_id):
+    """Delete a logged meal"""
+    try:
+        firebase_uid = request.user['uid']
+        
+        # Read-then-write, like update_meal
+        with get_storage().session(immediate=True) as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            old = db.meals.delete(user_id, meal_id)
+            if old is None:
+                return jsonify({'error': 'Meal not found'}), 404
+            record_meal_change(db, user_id, old)
+        notify_events()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Meal deleted successfully'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/saved-meals', methods=['POST'])
+@firebase_auth_required
+def save_meal():
+    """Save a meal made of several foods, with its nutrients computed once (see servings.py)"""
+    try:
+        firebase_uid = request.user['uid']
+        data = request.get_json()
+        name = (data.get('name') or '').strip()
+        components = data.get('components') or []
+        if not name:
+            return jsonify({'error': 'name is required'}), 400
+        if not isinstance(components, list) or not 0 < len(components) <= SAVED_MEAL_MAX_COMPONENTS:
+            return jsonify({'error': f'components must list 1 to {SAVED_MEAL_MAX_COMPONENTS} foods'}), 400
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+        if user_id is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_id = user_row[0]
+        # Foods not stored yet are fetched from USDA, so this happens outside any session
+        saved_components = []
+        for component in components:
+            if not component.get('fdc_id'):
+                return jsonify({'error': 'Each component needs an fdc_id'}), 400
+            food = meal_food(component['fdc_id'])
+            if food is None:
+                return jsonify({'error': f"Food item {component.get('fdc_id')} not found"}), 404
+            try:
+                nutrients = servings.serving_nutrients(food, component.get('serving_size'), component.get('serving_unit'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            saved_components.append({
+                'fdc_id': food['fdc_id'],
+                'food_name': component.get('food_name') or food['description'],
+                'serving_size': float(component['serving_size']),
+                'serving_unit': component.get('serving_unit') or 'g',
+                **nutrients
+            })
         
-        if date_filter:
-            # Get meals for specific date
-            cursor.execute('''
-                SELECT * FROM meal_logs 
-                WHERE user_id = ? AND logged_date = ?
-                ORDER BY logged_at DESC
-            ''', (user_id, date_filter))
-        else:
-            # Get meals for last N days
-            cursor.execute('''
-                SELECT * FROM meal_logs 
-                WHERE user_id = ? AND logged_date >= date('now', '-{} days')
-                ORDER BY logged_date DESC, logged_at DESC
-            '''.format(days), (user_id,))
-        
-        meals = []
-        for row in cursor.fetchall():
-            meals.append({
-                'id': row[0],
-                'fdc_id': row[2],
-                'food_name': row[3],
-                'serving_size': row[4],
-                'serving_unit': row[5],
-                'calories': row[6],
-                'protein': row[7],
-                'carbs': row[8],
-                'fat': row[9],
-                'meal_type': row[10],
-                'logged_date': row[11],
-                'logged_at': row[12]
+        totals = {}
+        for key in INTAKE_COLUMNS:
+            amounts = [component[key] for component in saved_components if component[key] is not None]
+            totals[key] = round(sum(amounts), 2) if amounts else None
+        
+        with get_storage().session() as db:
+            saved_meal_id = db.saved_meals.add(user_id, name, saved_components, totals)
+            saved_meal = db.saved_meals.get(user_id, saved_meal_id)
+        
+        return jsonify({
+            'success': True,
+            'saved_meal': saved_meal,
+            'message': 'Meal saved successfully'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/saved-meals', methods=['GET'])
+@firebase_auth_required
+def get_saved_meals():
+    """The user's saved meals with their components and total nutrients, newest first"""
+    try:
+        firebase_uid = request.user['uid']
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            saved_meals = db.saved_meals.list(user_id)
+        
+        return jsonify({
+            'success': True,
+            'saved_meals': saved_meals
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/saved-meals/<int:saved_meal_id>', methods=['DELETE'])
+@firebase_auth_required
+def delete_saved_meal(saved_meal_id):
+    """Delete a saved meal; meals already logged from it are kept"""
+    try:
+        firebase_uid = request.user['uid']
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            if not db.saved_meals.delete(user_id, saved_meal_id):
+                return jsonify({'error': 'Saved meal not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'message': 'Saved meal deleted successfully'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/saved-meals/<int:saved_meal_id>/log', methods=['POST'])
+@firebase_auth_required
+def log_saved_meal(saved_meal_id):
+    """Log every component of a saved meal as a meal, in one transaction"""
+    try:
+        firebase_uid = request.user['uid']
+        data = request.get_json(silent=True) or {}
+        logged_date = data.get('logged_date', datetime.now().date())
+        meal_type = data.get('meal_type', 'other')
+        try:
+            idempotency_key, request_hash = idempotency_request(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            stored = (db.idempotency.get(user_id, idempotency_key, current_app.config['IDEMPOTENCY_TTL'])
+                      if user_id is not None and idempotency_key else None)
+        if user_id is None:
+            return jsonify({'error': 'User not found'}), 404
+        
+        # One group-commit write: all components, one totals read, one alert check and one event
+        def write(db):
+            saved_meal = db.saved_meals.get(user_id, saved_meal_id)
+            if saved_meal is None:
+                return None
+            meal_ids = [db.meals.add(user_id, {**component, 'meal_type': meal_type, 'logged_date': logged_date})
+                        for component in saved_meal['components']]
+            
+            totals = db.meals.day_totals(user_id, logged_date)
+            # The saved meal's summed nutrients are what this write added to the day
+            alerts = record_intake_alerts(db, user_id, logged_date, saved_meal, totals)
+            db.users.bump_stats_version(user_id)
+            db.events.publish(user_id, 'summary', {
+                'date': str(logged_date),
+                'totals': rounded_totals(totals),
+                'saved_meal': {
+                    'id': saved_meal_id,
+                    'name': saved_meal['name'],
+                    'meal_ids': meal_ids,
+                    'meal_type': meal_type,
+                    'calories': saved_meal['calories']
+                },
+                'alerts': alerts
             })
+            return {'meal_ids': meal_ids, 'alerts': alerts, 'nutrients': {key: saved_meal[key] for key in INTAKE_COLUMNS}}
+        
+        try:
+            written = submit_idempotent(user_id, idempotency_key, request_hash, write, stored)
+        except (WriteQueueFull, WriteTimeout):
+            return jsonify({'error': 'Too many meals are being logged right now. Please try again.'}), 503, {'Retry-After': '1'}
+        if written['request_hash'] != request_hash:
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if written['response'] is None:
+            return jsonify({'error': 'Saved meal not found'}), 404
+        
+        if written['replayed']:
+            return jsonify({
+                'success': True,
+                **written['response'],
+                'message': 'Saved meal logged successfully'
+            }), 200, {'Idempotent-Replayed': 'true'}
         
-        conn.close()
+        notify_events()
         
         return jsonify({
             'success': True,
-            'meals': meals
+            **written['response'],
+            'message': 'Saved meal logged successfully'
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/nutrition-summary', methods=['GET'])
+@api.route('/api/nutrition-summary', methods=['GET'])
 @firebase_auth_required
 def get_nutrition_summary():
     """Get daily nutrition summary with progress towards goals"""
     try:
         firebase_uid = request.user['uid']
         date_filter = request.args.get('date', datetime.now().date())
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            # Get daily totals and current goals (latest for user)
+            summary = nutrition_summary(db, user_id, date_filter)
+        
+        return jsonify({
+            'success': True,
+            'summary': summary
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
+@api.route('/api/alerts', methods=['GET'])
+@firebase_auth_required
+def get_alerts():
+    """Excessive-intake alerts recorded when meals were logged (no re-aggregation)"""
+    try:
+        firebase_uid = request.user['uid']
+        days = request.args.get('days', default=7, type=int)
+        
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            alerts = [format_alert(alert) for alert in db.alerts.recent(user_id, days)]
+        
+        return jsonify({
+            'success': True,
+            'alerts': alerts
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        user_id = user_row[0]
-
-        # Get daily totals
-        cursor.execute('''
-            SELECT 
-                COALESCE(SUM(calories), 0) as total_calories,
-                COALESCE(SUM(protein), 0) as total_protein,
-                COALESCE(SUM(carbs), 0) as total_carbs,
-                COALESCE(SUM(fat), 0) as total_fat,
-                COUNT(*) as meal_count
-            FROM meal_logs 
-            WHERE user_id = ? AND logged_date = ?
-        ''', (user_id, date_filter))
-
-        totals = cursor.fetchone()
-
-        # Get current goals (latest for user)
-        cursor.execute('''
-            SELECT target_calories, target_protein, target_carbs, target_fat
-            FROM dietary_goals 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (user_id,))
-
-        goals = cursor.fetchone()
-
-        conn.close()
-
-        summary = {
-            'date': str(date_filter),
-            'totals': {
-                'calories': round(totals[0]),
-                'protein': round(totals[1], 1),
-                'carbs': round(totals[2]),
-                'fat': round(totals[3]),
-                'meal_count': totals[4]
+@api.route('/api/analytics/trends', methods=['GET'])
+@firebase_auth_required
+def get_trends():
+    """Rolling 7/30/90-day averages, goal adherence and streaks over daily_totals"""
+    try:
+        firebase_uid = request.user['uid']
+        days = max(1, min(request.args.get('days', default=30, type=int), 365))
+        today = str(datetime.now().date())
+        
+        with get_storage().session() as db:
+            # Get user ID and the version that keys the cache
+            user = db.users.get(firebase_uid)
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            
+            user_id, stats_version = user['id'], user['stats_version']
+            trends_cache = current_app.extensions['trends_cache']
+            cache_key = (user_id, days, today)
+            cached = trends_cache.get(cache_key)
+            if cached is not None and cached[0] == stats_version:
+                return jsonify(cached[1])
+            
+            # One pass: calendar days -> daily totals and the goal in effect -> windows
+            history_days = days + max(TREND_WINDOWS) - 1
+            rows = db.meals.trend_rows(user_id, today, history_days, TREND_WINDOWS, ADHERENCE_TOLERANCE)
+        
+        def rounded(value, digits=1):
+            return round(value, digits) if value is not None else None
+        
+        series = []
+        for row in rows[-days:]:
+            series.append({
+                'date': row['day'],
+                'meal_count': row['meal_count'],
+                'calories': rounded(row['calories'], 0),
+                'protein': rounded(row['protein']),
+                'carbs': rounded(row['carbs']),
+                'fat': rounded(row['fat']),
+                'target_calories': row['target_calories'],
+                'adherent': bool(row['adherent']),
+                'averages': {
+                    f'{n}d': {macro: rounded(row[f'{macro}_{n}d']) for macro in ('calories', 'protein', 'carbs', 'fat')}
+                    for n in TREND_WINDOWS
+                }
+            })
+        
+        # Today may not be logged yet; a streak only breaks once a whole day is missed
+        latest = rows[-1] if rows[-1]['logged'] or len(rows) < 2 else rows[-2]
+        result = {
+            'success': True,
+            'days': days,
+            'today': today,
+            'summary': {
+                'averages': {
+                    f'{n}d': {macro: rounded(latest[f'{macro}_{n}d']) for macro in ('calories', 'protein', 'carbs', 'fat')}
+                    for n in TREND_WINDOWS
+                },
+                'adherence': {
+                    f'{n}d': {
+                        'adherent_days': latest[f'adherent_{n}d'],
+                        'logged_days': latest[f'logged_{n}d'],
+                        'percent': round(latest[f'adherent_{n}d'] * 100.0 / latest[f'logged_{n}d'], 1) if latest[f'logged_{n}d'] else 0
+                    }
+                    for n in TREND_WINDOWS
+                },
+                'streaks': {
+                    'current_adherence': latest['adherence_streak'],
+                    'longest_adherence': max(row['adherence_streak'] for row in rows[-days:]),
+                    'current_logging': latest['logging_streak'],
+                    'longest_logging': max(row['logging_streak'] for row in rows[-days:])
+                }
             },
-            'goals': None,
-            'progress': None
+            'series': series
         }
+        trends_cache.put(cache_key, (stats_version, result))
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        if goals:
-            summary['goals'] = {
-                'calories': round(goals[0] or 0),
-                'protein': round(goals[1] or 0, 1),
-                'carbs': round(goals[2] or 0),
-                'fat': round(goals[3] or 0)
-            }
-            summary['progress'] = {
-                'calories': round((totals[0] / goals[0]) * 100, 1) if goals[0] and goals[0] > 0 else 0,
-                'protein': round((totals[1] / goals[1]) * 100, 1) if goals[1] and goals[1] > 0 else 0,
-                'carbs': round((totals[2] / goals[2]) * 100, 1) if goals[2] and goals[2] > 0 else 0,
-                'fat': round((totals[3] / goals[3]) * 100, 1) if goals[3] and goals[3] > 0 else 0
-            }
-        else:
-            summary['goals'] = {
-                'calories': 0,
-                'protein': 0,
-                'carbs': 0,
-                'fat': 0
-            }
-            summary['progress'] = {
-                'calories': 0,
-                'protein': 0,
-                'carbs': 0,
-                'fat': 0
-            }
-
+@api.route('/api/dashboard', methods=['GET'])
+@firebase_auth_required
+def get_dashboard():
+    """Profile, day summary, recent meals, alerts and history in one response"""
+    try:
+        firebase_uid = request.user['uid']
+        sections = request.args.get('sections')
+        sections = [section.strip() for section in sections.split(',') if section.strip()] if sections else DASHBOARD_SECTIONS
+        unknown = [section for section in sections if section not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({'error': f"Unknown sections: {', '.join(unknown)}; expected {', '.join(DASHBOARD_SECTIONS)}"}), 400
+        date_filter = request.args.get('date', datetime.now().date())
+        days = request.args.get('days', default=7, type=int)
+        
+        with get_storage().session() as db:
+            user = db.users.get(firebase_uid)
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            
+            user_id = user['id']
+            dashboard = {}
+            if 'profile' in sections:
+                dashboard['profile'] = user_profile(db, user)
+            if 'summary' in sections:
+                dashboard['summary'] = nutrition_summary(db, user_id, date_filter)
+            if 'meals' in sections:
+                dashboard['meals'] = db.meals.list(user_id, days=days)
+            if 'alerts' in sections:
+                dashboard['alerts'] = [format_alert(alert) for alert in db.alerts.recent(user_id, days)]
+            if 'history' in sections:
+                dashboard['history'] = [format_history(entry) for entry in db.history.recent(user_id, HISTORY_PAGE_SIZE)]
+        
         return jsonify({
             'success': True,
-            'summary': summary
+            **dashboard
         })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@api.route('/api/stream')
+def stream_events():
+    """Server-sent events with the user's dashboard changes ('summary', 'goals', 'profile')"""
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header.split('Bearer ')[1] if auth_header.startswith('Bearer ') else request.args.get('token')
+    if not token:
+        return jsonify({'error': 'Authorization header or token parameter required'}), 401
+    try:
+        with phase('auth'):
+            firebase_uid = auth.verify_id_token(token)['uid']
+    except Exception as e:
+        return jsonify({'error': 'Invalid token'}), 401
+    
+    try:
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    if user_id is None:
+        return jsonify({'error': 'User not found'}), 404
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    broker = current_app.extensions['events']
+    keepalive = current_app.config['STREAM_KEEPALIVE']
+    max_age = current_app.config['STREAM_MAX_AGE']
+    
+    def generate():
+        # Subscribing here rather than in the view means an unsent response never leaks a queue
+        events = broker.subscribe(user_id, last_event_id)
+        try:
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            deadline = time.time() + max_age
+            while time.time() < deadline:
+                try:
+                    event_id, event_type, data = events.get(timeout=keepalive)
+                except queue.Empty:
+                    # Comment line: keeps proxies from closing the connection and detects gone clients
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            broker.unsubscribe(user_id, events)
+    
+    if not broker.open_stream():
+        return jsonify({'error': 'Too many open streams. Please try again.'}), 503, {'Retry-After': '5'}
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response when the stream ends or the client goes away
+    response.call_on_close(broker.close_stream)
+    return response
 
-@app.route('/api/export/pdf', methods=['GET'])
+@api.route('/api/recommendations', methods=['GET'])
 @firebase_auth_required
-def export_pdf():
-    """Export nutrition report as PDF"""
+def get_recommendations():
+    """Foods (with serving sizes) that best fill the rest of today's macro budget"""
     try:
         firebase_uid = request.user['uid']
-        days = request.args.get('days', default=7, type=int)
+        date_filter = request.args.get('date', str(datetime.now().date()))
+        k = max(1, min(request.args.get('k', default=10, type=int), 50))
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            totals = db.meals.day_totals(user_id, date_filter)
+            latest_goals = db.goals.latest(user_id)
+            
+            # Don't suggest what was already eaten that day
+            eaten = db.meals.fdc_ids_on(user_id, date_filter)
         
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
+        if not latest_goals or not latest_goals['target_calories']:
+            return jsonify({'error': 'Set dietary goals first'}), 400
         
-        user_id = user_row[0]
+        goals = [latest_goals[f'target_{macro}'] or 0 for macro in MACROS]
+        remaining = [goal - totals[macro] for goal, macro in zip(goals, MACROS)]
+        matrix = current_app.extensions['food_matrix'].get(get_storage().food_rows)
         
-        # Get nutrition data for the specified period
-        cursor.execute('''
-            SELECT * FROM meal_logs 
-            WHERE user_id = ? 
-            AND logged_date >= datetime('now', ?)
-            ORDER BY logged_date DESC
-        ''', (user_id, f'-{days} days'))
+        return jsonify({
+            'success': True,
+            'date': date_filter,
+            'remaining': {
+                'calories': round(remaining[0]),
+                'protein': round(remaining[1], 1),
+                'carbs': round(remaining[2]),
+                'fat': round(remaining[3])
+            },
+            'candidates': len(matrix),
+            'recommendations': matrix.recommend(remaining, goals, k, exclude=eaten)
+        })
         
-        meals = cursor.fetchall()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def build_pdf_report(days, meals):
+    """Render meals (as returned by db.meals.list) as a PDF table; reportlab is imported here, on first export"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.6 * inch, bottomMargin=0.6 * inch)
+    styles = getSampleStyleSheet()
+    
+    rows = [['Date', 'Meal', 'Food', 'Serving', 'Calories', 'Protein', 'Carbs', 'Fat']]
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for meal in meals:
+        nutrients = [meal[macro] or 0 for macro in MACROS]
+        totals = [t + n for t, n in zip(totals, nutrients)]
+        rows.append([
+            meal['logged_date'], meal['meal_type'] or '', Paragraph(meal['food_name'], styles['BodyText']),
+            f"{meal['serving_size']} {meal['serving_unit']}",
+            f'{nutrients[0]:.0f}', f'{nutrients[1]:.1f}', f'{nutrients[2]:.1f}', f'{nutrients[3]:.1f}'
+        ])
+    rows.append(['Total', '', '', '', f'{totals[0]:.0f}', f'{totals[1]:.1f}', f'{totals[2]:.1f}', f'{totals[3]:.1f}'])
+    
+    table = Table(rows, repeatRows=1, colWidths=[0.9 * inch, 0.8 * inch, 2.2 * inch, 0.9 * inch] + [0.65 * inch] * 4)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#16a34a')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ALIGN', (4, 0), (-1, -1), 'RIGHT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+    
+    doc.build([
+        Paragraph(f'Nutrition Report for the last {days} days', styles['Title']),
+        Paragraph(f'Generated {datetime.now().strftime("%Y-%m-%d %H:%M")} - {len(meals)} items logged', styles['Normal']),
+        Spacer(1, 0.25 * inch),
+        table,
+    ])
+    return buffer.getvalue()
+
+@api.route('/api/export/pdf', methods=['GET'])
+@firebase_auth_required
+def export_pdf():
+    """Export nutrition report as PDF"""
+    try:
+        firebase_uid = request.user['uid']
+        days = request.args.get('days', default=7, type=int)
         
-        # Generate PDF report
-        # Note: You'll need to implement the actual PDF generation logic here
-        # This is a placeholder that returns a simple text file
-        report_content = f"Nutrition Report for the last {days} days\n\n"
-        for meal in meals:
-            report_content += f"Meal: {meal[3]} - {meal[4]}\n"
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            # Get nutrition data for the specified period
+            meals = db.meals.list(user_id, days=days)
         
-        conn.close()
+        report_content = build_pdf_report(days, meals)
         
         # Return the report as a PDF file
         return Response(
@@ -596,69 +1268,188 @@ def export_pdf():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/search/<query>')
+def search_cache_key(query_key, page=1, page_size=SEARCH_PAGE_SIZE):
+    """search_cache key of one result page; the first default-size page is keyed by the query alone"""
+    if page == 1 and page_size == SEARCH_PAGE_SIZE:
+        return query_key
+    return f'{query_key}|page={page}|size={page_size}'
+
+def fetch_search_results(query, cache_key, page=1, page_size=SEARCH_PAGE_SIZE):
+    """Search USDA for one result page and cache the simplified result under cache_key.
+    Returns (result, response); result is None when USDA answered with an error."""
+    params = {
+        'query': query,
+        'dataType': ['Foundation', 'SR Legacy'],
+        'pageSize': page_size,
+        'pageNumber': page,
+        'api_key': current_app.config['USDA_API_KEY']
+    }
+    
+    response = usda_get('foods_search', '/foods/search', params)
+    
+    current_app.logger.debug('USDA search %r page %d: status %d', query, page, response.status_code)
+    
+    if response.status_code != 200:
+        current_app.logger.warning('USDA search error: status %d, response %s', response.status_code, response.text[:200])
+        return None, response
+    
+    data = response.json()
+    
+    # Simplify the response for frontend
+    simplified_results = []
+    for food in data.get('foods', []):
+        simplified_food = {
+            'fdcId': food.get('fdcId'),
+            'description': food.get('description'),
+            'dataType': food.get('dataType'),
+            'brandOwner': food.get('brandOwner'),
+            'nutrients': []
+        }
+        
+        # Extract key nutrients for preview
+        for nutrient in food.get('foodNutrients', []):
+            nutrient_name = nutrient.get('nutrientName', '').lower()
+            if any(key in nutrient_name for key in ['energy', 'protein', 'carbohydrate', 'fat']):
+                simplified_food['nutrients'].append({
+                    'name': nutrient.get('nutrientName'),
+                    'amount': nutrient.get('value', 0),
+                    'unit': nutrient.get('unitName', '')
+                })
+        
+        simplified_results.append(simplified_food)
+    
+    total_hits = data.get('totalHits', 0)
+    result = {
+        'success': True,
+        'foods': simplified_results,
+        'totalHits': total_hits,
+        'page': page,
+        'pageSize': page_size,
+        'hasMore': page * page_size < total_hits
+    }
+    current_app.extensions['search_cache'].put(cache_key, result)
+    return result, response
+
+def prefetch_search_pages(query, query_key, result):
+    """Fetch the SEARCH_PREFETCH_PAGES pages after result in the background, unless cached,
+    so "load more" is answered from the cache"""
+    search_cache = current_app.extensions['search_cache']
+    prefetcher = current_app.extensions['prefetcher']
+    page, page_size = result['page'], result['pageSize']
+    for next_page in range(page + 1, page + 1 + current_app.config['SEARCH_PREFETCH_PAGES']):
+        if (next_page - 1) * page_size >= result['totalHits']:
+            break
+        key = search_cache_key(query_key, next_page, page_size)
+        if search_cache.expires_within(key, 0):
+            prefetcher.fetch_soon(key, lambda key=key, next_page=next_page:
+                                  fetch_search_results(query, key, next_page, page_size))
+
+def fetch_food_details(fdc_id):
+    """Fetch one food from USDA, organize its nutrients, cache it and save it to the foods table.
+    Returns None when USDA has no such food."""
+    params = {
+        'api_key': current_app.config['USDA_API_KEY']
+    }
+    
+    response = usda_get('food', f'/food/{fdc_id}', params)
+    
+    if response.status_code != 200:
+        return None
+    
+    data = response.json()
+    
+    # Organize nutrients into categories
+    macros = {}
+    micros = {}
+    other_nutrients = {}
+    
+    for nutrient in data.get('foodNutrients', []):
+        nutrient_name = nutrient.get('nutrient', {}).get('name', '')
+        entry = {
+            'name': nutrient_name,
+            'amount': nutrient.get('amount', 0),
+            'unit': nutrient.get('nutrient', {}).get('unitName', '')
+        }
+        
+        # Categorize nutrients (see nutrients.py)
+        category, key = nutrients.classify_nutrient(nutrient_name)
+        if category == 'macro':
+            macros[key] = entry
+        elif category == 'micro':
+            micros[key] = entry
+        else:
+            other_nutrients[key] = entry
+    
+    nutrition_data = {
+        'fdcId': data.get('fdcId'),
+        'description': data.get('description'),
+        'dataType': data.get('dataType'),
+        'brandOwner': data.get('brandOwner'),
+        'servingSize': data.get('servingSize'),
+        'servingSizeUnit': data.get('servingSizeUnit'),
+        'householdServingFullText': data.get('householdServingFullText'),
+        'portions': servings.portion_table(data),
+        'macronutrients': macros,
+        'micronutrients': micros,
+        'otherNutrients': other_nutrients
+    }
+    
+    current_app.extensions['food_cache'].put(str(fdc_id), nutrition_data)
+    
+    # Write-through to the foods table so the food becomes a recommendation candidate
+    if nutrition_data['fdcId']:
+        with get_storage().session() as db:
+            db.foods.save(nutrition_data)
+        current_app.extensions['food_matrix'].mark_stale()
+    return nutrition_data
+
+def meal_food(fdc_id):
+    """Nutrients per 100 g and portions of a food being logged by serving size (a foods.get() row).
+    Comes from the foods table; USDA is only asked for foods not stored yet, or stored before
+    portions were. None when neither has the food."""
+    with get_storage().session() as db:
+        food = db.foods.get(fdc_id)
+    if food is None or food['portions'] is None:
+        nutrition_data = fetch_food_details(fdc_id)
+        if nutrition_data is not None and nutrition_data['fdcId']:
+            with get_storage().session() as db:
+                food = db.foods.get(nutrition_data['fdcId'])
+    return food
+
+@api.route('/api/search/<query>')
 def search_foods(query):
-    """Search for foods using USDA API"""
+    """Search for foods using USDA API, one page at a time"""
     client_ip = request.remote_addr
     
     # Rate limiting check
     if is_rate_limited(client_ip):
+        metrics.record_rate_limited()
         return jsonify({
             'success': False,
             'error': 'Too many requests. Please try again later.'
         }), 429
     
     try:
-        params = {
-            'query': query,
-            'dataType': ['Foundation', 'SR Legacy'],
-            'pageSize': 10,
-            'api_key': USDA_API_KEY
-        }
+        page = max(1, request.args.get('page', default=1, type=int))
+        page_size = max(1, min(request.args.get('pageSize', default=SEARCH_PAGE_SIZE, type=int), SEARCH_MAX_PAGE_SIZE))
+        search_cache = current_app.extensions['search_cache']
+        query_key, usda_query = current_app.extensions['query_canonicalizer'].canonical(query)
+        current_app.extensions['query_stats'].record(query, query_key)
+        metrics.record_search_query(query_key != ' '.join(query.lower().split()))
+        cache_key = search_cache_key(query_key, page, page_size)
+        current_app.extensions['prefetcher'].record_search(query_key, usda_query)
+        result = search_cache.get(cache_key)
+        if result is None:
+            result, response = fetch_search_results(usda_query, cache_key, page, page_size)
+            if result is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'USDA API returned status {response.status_code}: {response.text[:200]}'
+                }), 500
+        
+        prefetch_search_pages(usda_query, query_key, result)
+        return jsonify(result)
         
-        response = requests.get(f'{USDA_BASE_URL}/foods/search', params=params)
-        
-        print(f"USDA API Response Status: {response.status_code}")
-        print(f"USDA API Response: {response.text[:500]}...")  # Log first 500 chars
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Simplify the response for frontend
-            simplified_results = []
-            for food in data.get('foods', []):
-                simplified_food = {
-                    'fdcId': food.get('fdcId'),
-                    'description': food.get('description'),
-                    'dataType': food.get('dataType'),
-                    'brandOwner': food.get('brandOwner'),
-                    'nutrients': []
-                }
-                
-                # Extract key nutrients for preview
-                for nutrient in food.get('foodNutrients', []):
-                    nutrient_name = nutrient.get('nutrientName', '').lower()
-                    if any(key in nutrient_name for key in ['energy', 'protein', 'carbohydrate', 'fat']):
-                        simplified_food['nutrients'].append({
-                            'name': nutrient.get('nutrientName'),
-                            'amount': nutrient.get('value', 0),
-                            'unit': nutrient.get('unitName', '')
-                        })
-                
-                simplified_results.append(simplified_food)
-            
-            return jsonify({
-                'success': True,
-                'foods': simplified_results,
-                'totalHits': data.get('totalHits', 0)
-            })
-        else:
-            print(f"USDA API Error: Status {response.status_code}, Response: {response.text}")
-            return jsonify({
-                'success': False,
-                'error': f'USDA API returned status {response.status_code}: {response.text[:200]}'
-            }), 500
-            
     except requests.exceptions.RequestException as e:
         print(f"Request Error: {e}")
         return jsonify({
@@ -672,105 +1463,40 @@ def search_foods(query):
             'error': str(e)
         }), 500
 
-@app.route('/api/food/<fdc_id>')
+@api.route('/api/food/<fdc_id>')
 def get_food_details(fdc_id):
     """Get detailed nutrition data for a specific food item"""
     client_ip = request.remote_addr
     
     # Rate limiting check
     if is_rate_limited(client_ip):
+        metrics.record_rate_limited()
         return jsonify({
             'success': False,
             'error': 'Too many requests. Please try again later.'
         }), 429
     
     try:
-        params = {
-            'api_key': USDA_API_KEY
-        }
-        
-        response = requests.get(f'{USDA_BASE_URL}/food/{fdc_id}', params=params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Organize nutrients into categories
-            macros = {}
-            micros = {}
-            other_nutrients = {}
-            
-            for nutrient in data.get('foodNutrients', []):
-                nutrient_name = nutrient.get('nutrient', {}).get('name', '')
-                nutrient_value = nutrient.get('amount', 0)
-                nutrient_unit = nutrient.get('nutrient', {}).get('unitName', '')
-                
-                # Categorize nutrients
-                if 'energy' in nutrient_name.lower() or 'calorie' in nutrient_name.lower():
-                    macros['calories'] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                elif 'protein' in nutrient_name.lower():
-                    macros['protein'] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                elif 'carbohydrate' in nutrient_name.lower() and 'by difference' in nutrient_name.lower():
-                    macros['carbohydrates'] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                elif 'total lipid' in nutrient_name.lower() or ('fat' in nutrient_name.lower() and 'total' in nutrient_name.lower()):
-                    macros['fat'] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                elif any(vitamin in nutrient_name.lower() for vitamin in ['vitamin', 'folate', 'niacin', 'riboflavin', 'thiamin']):
-                    micros[nutrient_name] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                elif any(mineral in nutrient_name.lower() for mineral in ['calcium', 'iron', 'magnesium', 'phosphorus', 'potassium', 'sodium', 'zinc']):
-                    micros[nutrient_name] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-                else:
-                    other_nutrients[nutrient_name] = {
-                        'name': nutrient_name,
-                        'amount': nutrient_value,
-                        'unit': nutrient_unit
-                    }
-            
-            nutrition_data = {
-                'fdcId': data.get('fdcId'),
-                'description': data.get('description'),
-                'dataType': data.get('dataType'),
-                'brandOwner': data.get('brandOwner'),
-                'servingSize': data.get('servingSize'),
-                'servingSizeUnit': data.get('servingSizeUnit'),
-                'householdServingFullText': data.get('householdServingFullText'),
-                'macronutrients': macros,
-                'micronutrients': micros,
-                'otherNutrients': other_nutrients
-            }
-            
+        food_cache = current_app.extensions['food_cache']
+        cached = food_cache.get(str(fdc_id))
+        if cached is not None:
             return jsonify({
                 'success': True,
-                'food': nutrition_data
+                'food': cached
             })
-        else:
+        
+        nutrition_data = fetch_food_details(fdc_id)
+        if nutrition_data is None:
             return jsonify({
                 'success': False,
                 'error': 'Food item not found'
             }), 404
-            
+        
+        return jsonify({
+            'success': True,
+            'food': nutrition_data
+        })
+        
     except requests.exceptions.RequestException as e:
         print(f"Request Error: {e}")
         return jsonify({
@@ -784,29 +1510,58 @@ def get_food_details(fdc_id):
             'error': str(e)
         }), 500
 
-@app.route('/api/history', methods=['GET'])
-def get_history():
-    """Get search history"""
+@api.route('/api/food/<fdc_id>/similar')
+def get_similar_foods(fdc_id):
+    """Nearest foods by per-100g macros; adjust=more_protein,less_fat shifts the search"""
     try:
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT fdc_id, food_name, searched_at, nutrition_data 
-            FROM search_history 
-            ORDER BY searched_at DESC 
-            LIMIT 20
-        ''')
-        
-        history = []
-        for row in cursor.fetchall():
-            history.append({
-                'fdcId': row[0],
-                'foodName': row[1],
-                'searchedAt': row[2],
-                'nutritionData': json.loads(row[3]) if row[3] else None
-            })
+        k = max(1, min(request.args.get('k', default=10, type=int), 50))
+        adjust = []
+        for item in filter(None, request.args.get('adjust', '').split(',')):
+            direction, _, macro = item.strip().partition('_')
+            if direction not in ('more', 'less') or macro not in MACROS:
+                return jsonify({'error': f"adjust entries must be more_<macro> or less_<macro> with macro in {', '.join(MACROS)}"}), 400
+            adjust.append((macro, 1 if direction == 'more' else -1))
+        
+        matrix = current_app.extensions['food_matrix'].get(get_storage().food_rows)
+        similar = matrix.similar(fdc_id, k, adjust)
+        if similar is None:
+            return jsonify({'error': 'Food not in the local food table; load its details first'}), 404
+        
+        i = matrix.index[str(fdc_id)]
+        return jsonify({
+            'success': True,
+            'food': {
+                'fdcId': matrix.fdc_ids[i],
+                'description': matrix.descriptions[i],
+                'per100g': matrix.per_100g(i)
+            },
+            'similar': similar
+        })
         
-        conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/suggest')
+def suggest_foods():
+    """Autocomplete food names from the suggestion index (no USDA call)"""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', default=10, type=int), 50)
+    
+    return jsonify({
+        'success': True,
+        'suggestions': current_app.extensions['suggestions'].search(query, limit)
+    })
+
+@api.route('/api/history', methods=['GET'])
+@firebase_auth_optional
+def get_history():
+    """Get search history for the current user (or the anonymous ring)"""
+    try:
+        with get_storage().session() as db:
+            user_id = history_owner(db)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            history = [format_history(entry) for entry in db.history.recent(user_id, HISTORY_PAGE_SIZE)]
         
         return jsonify({
             'success': True,
@@ -819,43 +1574,23 @@ def get_history():
             'error': str(e)
         }), 500
 
-@app.route('/api/history', methods=['POST'])
+@api.route('/api/history', methods=['POST'])
+@firebase_auth_optional
 def add_to_history():
-    """Add a food item to search history"""
+    """Add a food item to the current user's search history ring"""
     try:
         data = request.get_json()
         fdc_id = data.get('fdcId')
         food_name = data.get('foodName')
         nutrition_data = data.get('nutritionData')
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        
-        # Check if item already exists in recent history
-        cursor.execute('''
-            SELECT id FROM search_history 
-            WHERE fdc_id = ? AND datetime(searched_at) > datetime('now', '-1 day')
-        ''', (fdc_id,))
-        
-        if not cursor.fetchone():
-            # Add new entry
-            cursor.execute('''
-                INSERT INTO search_history (fdc_id, food_name, nutrition_data)
-                VALUES (?, ?, ?)
-            ''', (fdc_id, food_name, json.dumps(nutrition_data)))
+        with get_storage().session() as db:
+            user_id = history_owner(db)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
             
-            # Keep only last 50 entries
-            cursor.execute('''
-                DELETE FROM search_history 
-                WHERE id NOT IN (
-                    SELECT id FROM search_history 
-                    ORDER BY searched_at DESC 
-                    LIMIT 50
-                )
-            ''')
-        
-        conn.commit()
-        conn.close()
+            # Skips items already added in the last day
+            db.history.add(user_id, fdc_id, food_name, nutrition_data)
         
         return jsonify({
             'success': True,
@@ -868,7 +1603,50 @@ def add_to_history():
             'error': str(e)
         }), 500
 
-@app.route('/api/health')
+@api.route('/api/admin/slow-queries', methods=['GET'])
+@admin_token_required
+def get_slow_queries():
+    """Top slow SQL statements (aggregated across workers) with their query plans"""
+    limit = request.args.get('limit', default=20, type=int)
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in ('total_ms', 'max_ms', 'count'):
+        return jsonify({'error': 'sort must be total_ms, max_ms or count'}), 400
+    
+    return jsonify({
+        'success': True,
+        'threshold_ms': slow_query_log.threshold * 1000,
+        'queries': slow_query_log.top(limit, sort)
+    })
+
+@api.route('/api/admin/slow-queries', methods=['DELETE'])
+@admin_token_required
+def reset_slow_queries():
+    """Clear the slow-query aggregates"""
+    slow_query_log.reset()
+    return jsonify({'success': True})
+
+@api.route('/api/admin/search-queries', methods=['GET'])
+@admin_token_required
+def get_search_queries():
+    """Canonical search keys with the number of distinct raw queries behind each (aggregated across workers)"""
+    limit = request.args.get('limit', default=20, type=int)
+    sort = request.args.get('sort', 'variants')
+    if sort not in ('variants', 'requests'):
+        return jsonify({'error': 'sort must be variants or requests'}), 400
+    
+    return jsonify({
+        'success': True,
+        **current_app.extensions['query_stats'].top(limit, sort)
+    })
+
+@api.route('/api/admin/search-queries', methods=['DELETE'])
+@admin_token_required
+def reset_search_queries():
+    """Clear the search query counts of all workers"""
+    current_app.extensions['query_stats'].reset()
+    return jsonify({'success': True})
+
+@api.route('/api/health')
 def health_check():
     """Health check endpoint"""
     return jsonify({
@@ -877,7 +1655,7 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     })
 
-@app.route('/api/profile/update', methods=['POST'])
+@api.route('/api/profile/update', methods=['POST'])
 @firebase_auth_required
 def update_user_profile():
     """Update user profile information"""
@@ -885,38 +1663,17 @@ def update_user_profile():
         firebase_uid = request.user['uid']
         data = request.get_json()
         
-        conn = sqlite3.connect('nutrivault.db')
-        cursor = conn.cursor()
-        
-        # Get user ID
-        cursor.execute('SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            return jsonify({'error': 'User not found'}), 404
-        
-        user_id = user_row[0]
-        
-        # Update user profile
-        cursor.execute('''
-            UPDATE users 
-            SET age = ?, 
-                weight = ?, 
-                height = ?, 
-                activity_level = ?, 
-                dietary_goal = ?, 
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (
-            data.get('age'),
-            data.get('weight'),
-            data.get('height'),
-            data.get('activity_level'),
-            data.get('dietary_goal'),
-            user_id
-        ))
-        
-        conn.commit()
-        conn.close()
+        with get_storage().session() as db:
+            user_id = db.users.get_id(firebase_uid)
+            if user_id is None:
+                return jsonify({'error': 'User not found'}), 404
+            
+            # Update user profile
+            db.users.update_profile(user_id, data)
+            db.events.publish(user_id, 'profile', {
+                'profile': {key: data.get(key) for key in ('age', 'weight', 'height', 'activity_level', 'dietary_goal')}
+            })
+        notify_events()
         
         return jsonify({
             'success': True,
@@ -927,7 +1684,92 @@ def update_user_profile():
         print(f"Error updating profile: {str(e)}")  # Add logging
         return jsonify({'error': str(e)}), 500
 
+def warm_caches(app):
+    """Load read-only data (nutrient classification, popular foods, suggestion index,
+    recommendation matrix) from storage. wsgi.py calls this before gunicorn forks its workers."""
+    config = app.config
+    storage = app.extensions['storage']
+    
+    # Most used foods: the newest meal_logs rows plus the history rings
+    suggestions = SuggestionIndex(storage.popular_foods(config['SUGGEST_WARM_ROWS']))
+    
+    # History entries store the /api/food payload the frontend displayed; reuse it for the most used foods
+    food_cache = app.extensions['food_cache']
+    popular = [food[1] for food in suggestions.foods[:config['WARM_FOOD_COUNT']]]
+    nutrient_names = set()
+    for fdc_id, food in storage.history_payloads(popular):
+        if not isinstance(food, dict) or 'macronutrients' not in food:
+            continue
+        food_cache.put(str(fdc_id), food, record=False)
+        for group in ('macronutrients', 'micronutrients', 'otherNutrients'):
+            nutrient_names.update(n.get('name', '') for n in (food.get(group) or {}).values())
+    
+    app.extensions['suggestions'] = suggestions
+    classified = nutrients.warm(nutrient_names)
+    matrix = app.extensions['food_matrix'].get(storage.food_rows)
+    print(f"Warmed caches: {len(food_cache)} foods, {len(suggestions)} suggestions, {classified} nutrient names, "
+          f"{len(matrix)} recommendation candidates")
+
+def create_app(config=None):
+    """Application factory: a configured app with its own rate limiter and caches"""
+    app = Flask(__name__)
+    app.config.update(default_config())
+    if config:
+        app.config.update(config)
+    
+    CORS(app, origins=['http://localhost:5175', 'http://192.168.200.109:5175', 'http://localhost:5176', 'http://192.168.200.109:5176'],
+         methods=['GET', 'POST', 'PUT', 'DELETE'],
+         allow_headers=['Content-Type', 'Authorization', 'Last-Event-ID', 'Idempotency-Key'],
+         expose_headers=['Idempotent-Replayed'])
+    metrics.init_app(app)
+    profiling.init_app(app, is_authorized=is_admin_request)
+    app.register_blueprint(api)
+    
+    app.extensions['rate_limiter'] = RateLimiter(app.config['RATE_LIMIT_REQUESTS'], app.config['RATE_LIMIT_WINDOW'])
+    app.extensions['food_cache'] = FoodCache('food_details', app.config['FOOD_CACHE_SIZE'], app.config['FOOD_CACHE_TTL'])
+    app.extensions['search_cache'] = FoodCache('food_search', app.config['SEARCH_CACHE_SIZE'], app.config['SEARCH_CACHE_TTL'])
+    app.extensions['query_canonicalizer'] = QueryCanonicalizer(parse_synonyms(app.config['SEARCH_SYNONYMS']))
+    app.extensions['query_stats'] = QueryStats(storage_dir=app.config['SEARCH_QUERY_DIR'])
+    app.extensions['suggestions'] = SuggestionIndex()
+    app.extensions['food_matrix'] = FoodMatrixCache(app.config['FOOD_MATRIX_MAX_AGE'])
+    # Entries carry the user's stats_version and are ignored once it changes
+    app.extensions['trends_cache'] = FoodCache('trends', app.config['TRENDS_CACHE_SIZE'], 24 * 3600)
+    backend = app.config['STORAGE_BACKEND']
+    if backend == 'sqlite':
+        storage = SQLiteStorage(app.config['DATABASE_PATH'])
+    elif backend == 'sharded':
+        storage = ShardedStorage(app.config['DATABASE_PATH'], app.config['SHARD_COUNT'])
+    elif backend == 'memory':
+        storage = MemoryStorage()
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'sqlite', 'sharded' or 'memory'")
+    app.extensions['storage'] = storage
+    app.extensions['events'] = EventBroker(storage, max_streams=app.config['STREAM_MAX_PER_WORKER'])
+    app.extensions['meal_writer'] = GroupCommitWriter(storage, app.config['GROUP_COMMIT_MAX_BATCH'],
+                                                      app.config['GROUP_COMMIT_DELAY_MS'] / 1000.0,
+                                                      app.config['GROUP_COMMIT_QUEUE_SIZE'])
+    app.extensions['prefetcher'] = Prefetcher(app, fetch_food_details, fetch_search_results,
+                                              app.config['PREFETCH_INTERVAL'], app.config['PREFETCH_BUDGET'],
+                                              app.config['PREFETCH_FOODS'], app.config['PREFETCH_QUERIES'],
+                                              app.config['SUGGEST_WARM_ROWS'], app.config['PREFETCH_QUIET_RPS'])
+    app.extensions['prefetcher'].init_app(app)
+    app.extensions['archiver'] = Archiver(storage, app.config['ARCHIVE_AFTER_DAYS'], app.config['ARCHIVE_INTERVAL'],
+                                          app.config['ARCHIVE_BATCH'], app.config['VACUUM_PAGES'])
+    app.extensions['archiver'].init_app(app)
+    
+    # Create/migrate tables up front so every worker finds the current schema
+    storage.init()
+    return app
+
+def __getattr__(name):
+    # Keeps `gunicorn app:app` working: it resolves to the warmed app built in wsgi.py
+    if name == 'app':
+        from wsgi import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-    init_db()
     port = int(os.getenv('PORT', 5002))
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    app = create_app()
+    warm_caches(app)
+    app.run(debug=True, host='0.0.0.0', port=port)
@@ -0,0 +1,53 @@
+"""Background archival of old meal_logs rows, plus incremental VACUUM and ANALYZE"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+TASK = 'archive_meals'
+
+
+class Archiver:
+    def __init__(self, storage, after_days, interval, batch=5000, vacuum_pages=2000):
+        self.storage = storage
+        self.after_days = after_days
+        self.interval = interval
+        self.batch = batch
+        self.vacuum_pages = vacuum_pages
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def init_app(self, app):
+        @app.before_request
+        def start_archiver():
+            self._start()
+
+    def _start(self):
+        if self.thread is not None or self.after_days <= 0:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='archiver', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                result = self.run_once()
+                if result and result[0]:
+                    print(f"Archived {result[0]} meals; {result[1]} free pages left")
+            except Exception as e:
+                print(f"Archival failed: {e}")
+
+    def horizon(self):
+        """Meals logged before this date ('YYYY-MM-DD', UTC like SQLite's date('now')) get archived"""
+        return (datetime.now(timezone.utc).date() - timedelta(days=self.after_days)).isoformat()
+
+    def run_once(self):
+        """Archive, vacuum and analyze unless another worker did this interval;
+        returns (meals archived, free pages left), or None when skipped"""
+        # Slightly under the interval, so this worker's next run isn't skipped by its own claim
+        if not self.storage.claim_maintenance(TASK, self.interval * 0.9):
+            return None
+        moved = self.storage.archive_meals(self.horizon(), self.batch)
+        return moved, self.storage.optimize(self.vacuum_pages)
@@ -0,0 +1,227 @@
+"""Measure how the database-bound endpoints scale with data size.
+
+For each requested scale a synthetic database is generated with datagen.py
+(and cached for later runs), then `get_meals`, `get_nutrition_summary`,
+`export_pdf`, `get_trends` and `add_to_history` are called in-process through
+the Flask test client for random users. Every SQL statement those endpoints run is captured
+and checked with EXPLAIN QUERY PLAN, so full table scans show up even before
+they are slow.
+
+Run from the backend directory:
+    python -m benchmarks.bench_db_scaling --scales 1000,10000,50000
+    python -m benchmarks.bench_db_scaling --scales 500,5000 --strict   # exit 1 on scans or super-linear growth
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .bench_endpoints import RESULTS_DIR, git_commit, percentile
+from .datagen import generate
+from .harness import load_app
+import storage  # importable once harness has put backend/ on sys.path
+
+# Tables large enough in production that a full scan is a bug
+LARGE_TABLES = ('meal_logs', 'dietary_goals', 'users', 'history_slots', 'history_heads', 'daily_totals', 'intake_alerts',
+                'idempotency_keys', 'meal_change_heads', 'meal_tombstones', 'saved_meals')
+
+
+class TracingSqlite:
+    """Stands in for the sqlite3 module inside storage.py and records executed SQL"""
+
+    def __init__(self, real, statements):
+        self._real = real
+        self._statements = statements
+
+    def connect(self, *args, **kwargs):
+        conn = self._real.connect(*args, **kwargs)
+        conn.set_trace_callback(self._statements.append)
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+
+def explain(db_path, statement):
+    """Return the EXPLAIN QUERY PLAN detail lines for an (expanded) statement"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+    except sqlite3.Error as e:
+        return [f'(explain failed: {e})']
+    finally:
+        conn.close()
+
+
+def full_scans(plan):
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in LARGE_TABLES:
+            scans.append(detail)
+    return scans
+
+
+def database_for(data_dir, users, years, seed):
+    path = os.path.join(data_dir, f'nutrivault-u{users}-y{years}-s{seed}.db')
+    if not os.path.exists(path):
+        print(f'Generating {users} users x {years} years -> {path}')
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate(tmp_path, users, years, seed, progress=False)
+        os.replace(tmp_path, path)
+    return path
+
+
+def table_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {t: conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in ('users', 'meal_logs', 'dietary_goals', 'history_slots')}
+    finally:
+        conn.close()
+
+
+def endpoint_calls(rng, uids):
+    """(name, callable(client)) pairs; each call picks a random user"""
+    def headers():
+        return {'Authorization': f'Bearer {rng.choice(uids)}'}
+
+    return [
+        ('get_meals', lambda c: c.get('/api/meals?days=30', headers=headers())),
+        ('get_meal_changes', lambda c: c.get(f'/api/meals/changes?since={rng.randint(0, 2000)}&limit=100',
+                                             headers=headers())),
+        ('get_saved_meals', lambda c: c.get('/api/saved-meals', headers=headers())),
+        ('get_nutrition_summary', lambda c: c.get('/api/nutrition-summary', headers=headers())),
+        ('export_pdf', lambda c: c.get('/api/export/pdf?days=30', headers=headers())),
+        ('get_trends', lambda c: c.get('/api/analytics/trends?days=90', headers=headers())),
+        ('add_to_history', lambda c: c.post('/api/history', headers=headers(), json={
+            'fdcId': str(rng.randint(900000, 905000)), 'foodName': 'Benchmark food', 'nutritionData': None})),
+    ]
+
+
+def bench_scale(db_path, iterations, seed):
+    statements = []
+    module = load_app(db_path, 'http://127.0.0.1:9/fdc/v1')
+    # The app's per-thread connection is opened on the first request, so it is traced
+    storage.sqlite3 = TracingSqlite(sqlite3, statements)
+    client = module.app.test_client()
+
+    conn = sqlite3.connect(db_path)
+    uids = [row[0] for row in conn.execute("SELECT firebase_uid FROM users WHERE firebase_uid LIKE 'gen-user-%'")]
+    conn.close()
+
+    rng = random.Random(seed)
+    results = {}
+    for name, call in endpoint_calls(rng, uids):
+        # One traced warm-up call to collect the statements this endpoint runs
+        del statements[:]
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = call(client).status_code
+        captured = list(statements)
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                call(client)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+
+        plans = []
+        for statement in captured:
+            if statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+                plan = explain(db_path, statement)
+                plans.append({'sql': ' '.join(statement.split()), 'plan': plan, 'full_scans': full_scans(plan)})
+
+        results[name] = {
+            'status': status,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'queries': plans,
+        }
+    storage.sqlite3 = sqlite3
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DB-bound endpoints across data sizes')
+    parser.add_argument('--scales', default='200,2000,20000', help='Comma-separated user counts')
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--iterations', type=int, default=200, help='Calls per endpoint per scale')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'nutrivault-bench-data'),
+                        help='Where generated databases are cached between runs')
+    parser.add_argument('--max-growth', type=float, default=3.0,
+                        help='Flag endpoints whose p50 grows more than this factor from the smallest to largest scale')
+    parser.add_argument('--strict', action='store_true', help='Exit 1 if any full scan or excessive growth is found')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/db-scaling-<commit>-<time>.json)')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    scales = [int(s) for s in args.scales.split(',') if s.strip()]
+    runs = []
+    for users in scales:
+        db_path = database_for(args.data_dir, users, args.years, args.seed)
+        # Benchmark a copy so add_to_history writes don't change the cached database
+        work_path = db_path + '.work'
+        with open(db_path, 'rb') as src, open(work_path, 'wb') as dst:
+            dst.write(src.read())
+        try:
+            counts = table_counts(work_path)
+            print(f'\nScale {users} users: ' + ', '.join(f'{k}={v}' for k, v in counts.items()))
+            results = bench_scale(work_path, args.iterations, args.seed)
+        finally:
+            os.remove(work_path)
+        runs.append({'users': users, 'rows': counts, 'results': results})
+        for name, stats in results.items():
+            print(f"  {name:<24} p50 {stats['p50_ms']:>8.2f} ms  p95 {stats['p95_ms']:>8.2f} ms  status {stats['status']}")
+
+    problems = []
+    for run in runs:
+        for name, stats in run['results'].items():
+            for query in stats['queries']:
+                for scan in query['full_scans']:
+                    problems.append(f"{name} @ {run['users']} users: {scan} in: {query['sql'][:160]}")
+    if len(runs) > 1:
+        first, last = runs[0], runs[-1]
+        for name in last['results']:
+            before, after = first['results'][name]['p50_ms'], last['results'][name]['p50_ms']
+            if before and after / before > args.max_growth:
+                problems.append(f'{name}: p50 grew {after / before:.1f}x ({before:.2f} -> {after:.2f} ms) '
+                                f"while meal_logs grew {last['rows']['meal_logs'] / max(1, first['rows']['meal_logs']):.0f}x")
+
+    print('\nFull scans / scaling problems:' if problems else '\nNo full scans or super-linear growth found.')
+    for problem in problems:
+        print('  - ' + problem)
+
+    report = {
+        'benchmark': 'db_scaling',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {'scales': scales, 'years': args.years, 'iterations': args.iterations, 'seed': args.seed},
+        'runs': runs,
+        'problems': problems,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"db-scaling-{report['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.strict and problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""Throughput/latency benchmark for the Nutrivault API endpoints.
+
+Boots the app against the local USDA stub (see usda_stub.py), a temporary
+database and a stubbed Firebase verifier, drives each endpoint at the given
+concurrency and reports p50/p95/p99 latency and requests/sec.
+
+Run from the backend directory:
+    python -m benchmarks.bench_endpoints --concurrency 16 --requests 2000
+    python -m benchmarks.bench_endpoints --usda-latency-ms 120 --usda-error-rate 0.05
+    python -m benchmarks.bench_endpoints --no-cache   # every search/food request goes upstream
+    python -m benchmarks.bench_endpoints --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from .harness import AppServer, BenchmarkDatabase, load_app
+from .usda_stub import StubConfig, USDAStubServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SEARCH_QUERIES = ['chicken', 'rice', 'banana', 'apple raw', 'egg', 'salmon', 'oats', 'milk', 'bread', 'yogurt']
+MEAL_TYPES = ['breakfast', 'lunch', 'dinner', 'snack']
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, statuses, wall_seconds):
+    ordered = sorted(latencies)
+    to_ms = lambda v: round(v * 1000, 3) if v is not None else None
+    errors = sum(1 for status in statuses if status is None or status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / len(latencies), 4) if latencies else 0,
+        'wall_seconds': round(wall_seconds, 3),
+        'requests_per_sec': round(len(latencies) / wall_seconds, 1) if wall_seconds else None,
+        'mean_ms': to_ms(sum(ordered) / len(ordered)) if ordered else None,
+        'p50_ms': to_ms(percentile(ordered, 50)),
+        'p95_ms': to_ms(percentile(ordered, 95)),
+        'p99_ms': to_ms(percentile(ordered, 99)),
+        'max_ms': to_ms(ordered[-1]) if ordered else None,
+        'status_counts': {str(k): statuses.count(k) for k in sorted(set(statuses), key=str)},
+    }
+
+
+def user_token(n):
+    return f'bench-user-{n}'
+
+
+class Scenario:
+    """One endpoint under test: builds the n-th request as (method, path, kwargs)"""
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+
+
+def build_scenarios(fdc_ids, users):
+    def auth(n):
+        return {'Authorization': f'Bearer {user_token(n % users)}'}
+
+    def log_meal(n):
+        fdc_id = fdc_ids[n % len(fdc_ids)]
+        return ('POST', '/api/meals', {'headers': auth(n), 'json': {
+            'fdc_id': fdc_id, 'food_name': f'Food {fdc_id}', 'serving_size': 100, 'serving_unit': 'g',
+            'calories': 150 + n % 300, 'protein': 10.5, 'carbs': 20.0, 'fat': 5.0,
+            'meal_type': MEAL_TYPES[n % len(MEAL_TYPES)],
+        }})
+
+    return [
+        Scenario('search_foods', lambda n: ('GET', f'/api/search/{SEARCH_QUERIES[n % len(SEARCH_QUERIES)]}', {})),
+        Scenario('get_food_details', lambda n: ('GET', f'/api/food/{fdc_ids[n % len(fdc_ids)]}', {})),
+        Scenario('log_meal', log_meal),
+        Scenario('get_meals', lambda n: ('GET', '/api/meals', {'headers': auth(n), 'params': {'days': 7}})),
+        Scenario('get_nutrition_summary', lambda n: ('GET', '/api/nutrition-summary', {'headers': auth(n)})),
+        Scenario('get_history', lambda n: ('GET', '/api/history', {'headers': auth(n)})),
+        Scenario('get_recommendations', lambda n: ('GET', '/api/recommendations', {'headers': auth(n)})),
+        Scenario('get_trends', lambda n: ('GET', '/api/analytics/trends', {'headers': auth(n), 'params': {'days': 90}})),
+        Scenario('get_dashboard', lambda n: ('GET', '/api/dashboard', {'headers': auth(n)})),
+    ]
+
+
+def seed(base_url, fdc_ids, users, meals_per_user):
+    """Create users with goals, some logged meals and history through the API itself"""
+    session = requests.Session()
+    # Looking every food up once fills the foods table used by /api/recommendations
+    for fdc_id in fdc_ids:
+        session.get(f'{base_url}/api/food/{fdc_id}').raise_for_status()
+    for u in range(users):
+        token = user_token(u)
+        headers = {'Authorization': f'Bearer {token}'}
+        session.post(f'{base_url}/api/auth/verify', json={'idToken': token}).raise_for_status()
+        session.post(f'{base_url}/api/dietary-goals', headers=headers, json={
+            'goal_type': 'maintenance', 'current_weight': 70 + u % 20, 'target_weight': 70, 'activity_level': 'moderate',
+        }).raise_for_status()
+        for m in range(meals_per_user):
+            fdc_id = fdc_ids[(u + m) % len(fdc_ids)]
+            session.post(f'{base_url}/api/meals', headers=headers, json={
+                'fdc_id': fdc_id, 'food_name': f'Food {fdc_id}', 'serving_size': 100, 'serving_unit': 'g',
+                'calories': 200, 'protein': 12, 'carbs': 25, 'fat': 6, 'meal_type': MEAL_TYPES[m % len(MEAL_TYPES)],
+            }).raise_for_status()
+        for fdc_id in fdc_ids[:5]:
+            session.post(f'{base_url}/api/history', headers=headers,
+                         json={'fdcId': fdc_id, 'foodName': f'Food {fdc_id}', 'nutritionData': None}).raise_for_status()
+
+
+def run_scenario(base_url, scenario, total_requests, concurrency, timeout):
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, statuses = [], []
+    local = threading.local()
+
+    def worker():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        while True:
+            n = next(counter)
+            if n >= total_requests:
+                return
+            method, path, kwargs = scenario.build(n)
+            start = time.perf_counter()
+            try:
+                status = session.request(method, base_url + path, timeout=timeout, **kwargs).status_code
+            except requests.RequestException:
+                status = None
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report, baseline=None):
+    header = f"{'endpoint':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in report['results'].items():
+        line = (f"{name:<24}{stats['requests_per_sec'] or 0:>10.1f}{stats['p50_ms'] or 0:>10.2f}"
+                f"{stats['p95_ms'] or 0:>10.2f}{stats['p99_ms'] or 0:>10.2f}{stats['errors']:>8}")
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous and previous.get('p95_ms') and previous.get('requests_per_sec'):
+            p95_delta = (stats['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+            rps_delta = (stats['requests_per_sec'] - previous['requests_per_sec']) / previous['requests_per_sec'] * 100
+            line += f"   p95 {p95_delta:+.1f}%  req/s {rps_delta:+.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Nutrivault API endpoints against a local USDA stub')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint')
+    parser.add_argument('--endpoints', default='', help='Comma-separated subset of endpoints to run')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seed-meals', type=int, default=30, help='Meals pre-logged per user')
+    parser.add_argument('--database', help='Copy this SQLite file instead of starting from an empty one')
+    parser.add_argument('--usda-latency-ms', type=float, default=0.0)
+    parser.add_argument('--usda-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--usda-error-rate', type=float, default=0.0)
+    parser.add_argument('--usda-error-status', type=int, default=503)
+    parser.add_argument('--no-cache', action='store_true', help='Disable the USDA response caches')
+    parser.add_argument('--storage', choices=('sqlite', 'sharded', 'memory'), default='sqlite', help='STORAGE_BACKEND for the app')
+    parser.add_argument('--shards', type=int, default=4, help='SHARD_COUNT with --storage sharded')
+    parser.add_argument('--verify-ms', type=float, default=0.0, help='Simulated Firebase token verification time')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/endpoints-<commit>-<time>.json)')
+    parser.add_argument('--compare', help='Earlier result file to print deltas against')
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.usda_latency_ms, args.usda_jitter_ms, args.usda_error_rate, args.usda_error_status, seed=42)
+    with USDAStubServer(config=stub_config) as stub, BenchmarkDatabase(args.database) as db:
+        app_config = {'STORAGE_BACKEND': args.storage, 'SHARD_COUNT': args.shards}
+        if args.no_cache:
+            app_config.update({'FOOD_CACHE_SIZE': 0, 'SEARCH_CACHE_SIZE': 0})
+        module = load_app(db.path, stub.base_url, args.verify_ms, app_config)
+        fdc_ids = sorted(stub.foods)
+        # app.py prints every USDA response; keep that out of the report
+        with AppServer(module.app) as server, contextlib.redirect_stdout(io.StringIO()):
+            seed(server.base_url, fdc_ids, args.users, args.seed_meals)
+
+            selected = {name.strip() for name in args.endpoints.split(',') if name.strip()}
+            results = {}
+            for scenario in build_scenarios(fdc_ids, args.users):
+                if selected and scenario.name not in selected:
+                    continue
+                results[scenario.name] = run_scenario(server.base_url, scenario, args.requests, args.concurrency, args.timeout)
+
+    report = {
+        'benchmark': 'endpoints',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'concurrency': args.concurrency, 'requests': args.requests, 'users': args.users,
+            'seed_meals': args.seed_meals, 'usda_latency_ms': args.usda_latency_ms,
+            'usda_jitter_ms': args.usda_jitter_ms, 'usda_error_rate': args.usda_error_rate,
+            'verify_ms': args.verify_ms, 'usda_cache': not args.no_cache, 'storage': args.storage,
+            'shards': args.shards if args.storage == 'sharded' else None,
+        },
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"endpoints-{report['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nResults written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Startup cost of `import wsgi`, measured with `python -X importtime`.
+
+Imports the WSGI entrypoint (app factory plus cache warming) in fresh
+interpreters, as gunicorn does, reports the median total import time, peak
+RSS and the most expensive imported packages, and fails if:
+
+- a module that must stay lazy (LAZY_MODULES) is imported at startup, or
+- the median import time regresses more than --tolerance over a saved baseline.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup --save-baseline   # record this machine's baseline
+    python -m benchmarks.bench_startup                   # compare against it (exit 1 on regression)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .bench_endpoints import RESULTS_DIR, git_commit
+from .harness import BACKEND_DIR
+
+# Heavy dependencies that app.py only loads on first use (never in the gunicorn master)
+LAZY_MODULES = ('reportlab', 'firebase_admin', 'google.auth', 'google.cloud')
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, 'startup-baseline.json')
+
+# Print peak RSS from inside the child so only that interpreter is measured
+IMPORT_SNIPPET = 'import resource, wsgi; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us)} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_once(env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SNIPPET],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import wsgi failed:\n{result.stderr[-2000:]}')
+    modules = parse_importtime(result.stderr)
+    rss_kb = int(result.stdout.strip().splitlines()[-1])
+    return modules, rss_kb
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure and guard the startup cost of wsgi.py')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Packages to list by cumulative import time')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    totals, rss, runs = [], [], []
+    with tempfile.TemporaryDirectory(prefix='nutrivault-startup-') as tmpdir:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(tmpdir, 'nutrivault.db'))
+        for _ in range(args.runs):
+            modules, rss_kb = measure_once(env)
+            totals.append(modules['wsgi'][1])
+            rss.append(rss_kb)
+            runs.append(modules)
+
+    median_ms = statistics.median(totals) / 1000.0
+    median_rss_mb = statistics.median(rss) / 1024.0
+    last = runs[-1]
+    top_level = sorted(((name, cum) for name, (_, cum) in last.items() if name not in ('app', 'wsgi') and '.' not in name),
+                       key=lambda item: item[1], reverse=True)
+
+    print(f'import wsgi: median {median_ms:.1f} ms over {args.runs} runs, peak RSS {median_rss_mb:.1f} MB')
+    print(f'\n{"package":<32}{"cumulative ms":>14}')
+    for name, cumulative in top_level[:args.top]:
+        print(f'{name:<32}{cumulative / 1000.0:>14.1f}')
+
+    failures = []
+    eager = sorted(name for name in last for lazy in LAZY_MODULES if name == lazy or name.startswith(lazy + '.'))
+    if eager:
+        failures.append('modules that should be lazy were imported at startup: ' + ', '.join(eager[:10]))
+
+    report = {
+        'benchmark': 'startup',
+        'commit': git_commit(),
+        'import_ms_median': round(median_ms, 2),
+        'import_ms_runs': [round(t / 1000.0, 2) for t in totals],
+        'peak_rss_mb_median': round(median_rss_mb, 1),
+        'top_packages_ms': {name: round(cum / 1000.0, 2) for name, cum in top_level[:args.top]},
+    }
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        allowed = baseline['import_ms_median'] * (1 + args.tolerance)
+        change = (median_ms - baseline['import_ms_median']) / baseline['import_ms_median'] * 100
+        print(f"\nBaseline {baseline['import_ms_median']:.1f} ms (commit {baseline.get('commit')}): {change:+.1f}%")
+        if median_ms > allowed:
+            failures.append(f'import time {median_ms:.1f} ms exceeds baseline {baseline["import_ms_median"]:.1f} ms '
+                            f'by more than {args.tolerance:.0%}')
+    else:
+        print(f'\nNo baseline at {args.baseline}; run with --save-baseline to record one')
+
+    for failure in failures:
+        print('FAIL: ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""Synthetic data generator for the Nutrivault schema.
+
+Creates the schema with `create_app()` and fills it with realistic-looking
+data at a configurable scale:
+
+- users with skewed engagement (a few heavy loggers, a long tail of casual ones,
+  some who churn) and plausible profile values
+- multi-year meal logs, 1-6 items per logged day, with a Zipf-distributed food
+  popularity so a few hundred foods dominate like in production
+- several dietary_goals revisions per user over their lifetime
+- per-user search history rings (plus the anonymous ring)
+
+Run from the backend directory:
+    python -m benchmarks.datagen --db /tmp/nutrivault-large.db --users 100000 --years 3
+    python -m benchmarks.datagen --db /tmp/nutrivault-small.db --scale small
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+from .harness import load_app
+from .usda_stub import load_food_fixtures
+from storage import HISTORY_SLOTS  # importable once harness has put backend/ on sys.path
+
+SCALES = {
+    'tiny': {'users': 100, 'years': 1},
+    'small': {'users': 1000, 'years': 2},
+    'medium': {'users': 20000, 'years': 3},
+    'large': {'users': 200000, 'years': 3},
+}
+
+ACTIVITY_LEVELS = (['sedentary', 'light', 'moderate', 'active', 'very_active'], [0.3, 0.3, 0.25, 0.1, 0.05])
+GOAL_TYPES = (['weight_loss', 'maintenance', 'muscle_gain'], [0.5, 0.3, 0.2])
+# meal type, weight, typical hour
+MEAL_SLOTS = [('breakfast', 0.25, 8), ('lunch', 0.3, 13), ('dinner', 0.3, 19), ('snack', 0.15, 16)]
+ACTIVITY_MULTIPLIERS = {'sedentary': 1.2, 'light': 1.375, 'moderate': 1.55, 'active': 1.725, 'very_active': 1.9}
+BATCH_SIZE = 20000
+
+
+class FoodCatalog:
+    """Recorded fixture foods plus synthetic ones, sampled with Zipf-like popularity"""
+
+    def __init__(self, rng, size=5000, zipf_s=1.1):
+        self.foods = []
+        for food in load_food_fixtures().values():
+            per_100g = {n['nutrient']['name']: n.get('amount', 0) for n in food['foodNutrients']}
+            self.foods.append((str(food['fdcId']), food['description'], per_100g.get('Energy', 0),
+                               per_100g.get('Protein', 0), per_100g.get('Carbohydrate, by difference', 0),
+                               per_100g.get('Total lipid (fat)', 0)))
+        next_id = 900000
+        while len(self.foods) < size:
+            protein, carbs, fat = rng.uniform(0, 30), rng.uniform(0, 80), rng.uniform(0, 40)
+            kcal = protein * 4 + carbs * 4 + fat * 9
+            self.foods.append((str(next_id), f'Synthetic food {next_id}', round(kcal, 1),
+                               round(protein, 2), round(carbs, 2), round(fat, 2)))
+            next_id += 1
+        rng.shuffle(self.foods)
+
+        weights = [1.0 / math.pow(rank + 1, zipf_s) for rank in range(len(self.foods))]
+        total = sum(weights)
+        self.cumulative = []
+        running = 0.0
+        for w in weights:
+            running += w / total
+            self.cumulative.append(running)
+
+    def sample(self, rng):
+        return self.foods[min(bisect.bisect_left(self.cumulative, rng.random()), len(self.foods) - 1)]
+
+
+def weighted(rng, choices):
+    values, weights = choices
+    return rng.choices(values, weights)[0]
+
+
+def goal_row(rng, user_id, weight, created_at):
+    goal_type = weighted(rng, GOAL_TYPES)
+    activity_level = weighted(rng, ACTIVITY_LEVELS)
+    maintenance = weight * 22 * ACTIVITY_MULTIPLIERS[activity_level]
+    target_calories = int(maintenance - 500 if goal_type == 'weight_loss' else maintenance + 300 if goal_type == 'muscle_gain' else maintenance)
+    target_protein = weight * 2.2
+    target_fat = target_calories * 0.25 / 9
+    target_carbs = (target_calories - target_protein * 4 - target_fat * 9) / 4
+    target_weight = weight - 5 if goal_type == 'weight_loss' else weight + 3 if goal_type == 'muscle_gain' else weight
+    ts = created_at.strftime('%Y-%m-%d %H:%M:%S')
+    return (user_id, goal_type, target_calories, target_protein, target_carbs, target_fat,
+            weight, target_weight, activity_level, ts, ts)
+
+
+class Generator:
+    def __init__(self, conn, rng, users, years, catalog, history_slots, end_date=None):
+        self.conn = conn
+        self.rng = rng
+        self.users = users
+        self.years = years
+        self.catalog = catalog
+        self.history_slots = history_slots
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=int(365 * years))
+        self.counts = {'users': 0, 'dietary_goals': 0, 'meal_logs': 0, 'history_slots': 0}
+        self.pending = {'users': [], 'dietary_goals': [], 'meal_logs': [], 'history_slots': [], 'history_heads': []}
+
+    SQL = {
+        'users': 'INSERT INTO users (id, firebase_uid, email, age, weight, height, activity_level, dietary_goal, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'dietary_goals': 'INSERT INTO dietary_goals (user_id, goal_type, target_calories, target_protein, target_carbs, target_fat, current_weight, target_weight, activity_level, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'meal_logs': 'INSERT INTO meal_logs (user_id, fdc_id, food_name, serving_size, serving_unit, calories, protein, carbs, fat, meal_type, logged_date, logged_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'history_slots': 'INSERT OR REPLACE INTO history_slots (user_id, slot, seq, fdc_id, food_name, searched_at, nutrition_data) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        'history_heads': 'INSERT OR REPLACE INTO history_heads (user_id, seq) VALUES (?, ?)',
+    }
+
+    def add(self, table, row):
+        self.pending[table].append(row)
+        if len(self.pending[table]) >= BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table=None):
+        for name in ([table] if table else list(self.pending)):
+            rows = self.pending[name]
+            if rows:
+                self.conn.executemany(self.SQL[name], rows)
+                if name in self.counts:
+                    self.counts[name] += len(rows)
+                rows.clear()
+
+    def run(self, progress=True):
+        started = time.time()
+        first_id = (self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]) + 1
+        for n in range(self.users):
+            self.generate_user(first_id + n)
+            if progress and (n + 1) % max(1, self.users // 20) == 0:
+                self.flush()
+                self.conn.commit()
+                print(f'  {n + 1}/{self.users} users, {self.counts["meal_logs"]} meals ({time.time() - started:.0f}s)')
+        self.generate_history(0, self.rng.randint(self.history_slots, self.history_slots * 3))  # anonymous ring
+        self.flush()
+        self.conn.commit()
+        return self.counts
+
+    def generate_user(self, user_id):
+        rng = self.rng
+        span_days = (self.end_date - self.start_date).days
+        joined = self.start_date + timedelta(days=int(rng.random() ** 1.5 * span_days))
+        # 30% of users churn at some point after joining
+        left = self.end_date if rng.random() > 0.3 else joined + timedelta(days=int(rng.expovariate(1 / 60.0)))
+        left = min(left, self.end_date)
+        # Engagement: probability of logging on a given active day (long-tailed)
+        engagement = min(0.95, rng.betavariate(0.8, 2.5))
+
+        weight = round(max(45.0, rng.gauss(75, 15)), 1)
+        joined_ts = datetime.combine(joined, datetime.min.time()) + timedelta(seconds=rng.randint(0, 86399))
+        self.add('users', (
+            user_id, f'gen-user-{user_id}', f'gen-user-{user_id}@example.com',
+            max(16, min(80, int(rng.gauss(35, 12)))), weight, round(rng.gauss(170, 10), 1),
+            weighted(rng, ACTIVITY_LEVELS), weighted(rng, GOAL_TYPES),
+            joined_ts.strftime('%Y-%m-%d %H:%M:%S'), joined_ts.strftime('%Y-%m-%d %H:%M:%S'),
+        ))
+
+        # Goal revisions: one at signup, then roughly every few months while active
+        active_days = max(1, (left - joined).days)
+        revisions = 1 + min(20, int(rng.expovariate(1.0) * active_days / 120))
+        for r in range(revisions):
+            at = joined_ts + timedelta(days=0 if r == 0 else rng.randint(0, active_days))
+            self.add('dietary_goals', goal_row(rng, user_id, round(weight + rng.gauss(0, 2), 1), at))
+
+        day = joined
+        while day <= left:
+            if rng.random() < engagement:
+                self.generate_day(user_id, day)
+            day += timedelta(days=1)
+
+        if rng.random() < 0.6:
+            self.generate_history(user_id, int(rng.expovariate(1 / 40.0)) + 1)
+
+    def generate_day(self, user_id, day):
+        rng = self.rng
+        for _ in range(max(1, min(6, int(rng.gauss(3.5, 1.3))))):
+            meal_type, _, hour = rng.choices(MEAL_SLOTS, [s[1] for s in MEAL_SLOTS])[0]
+            fdc_id, name, kcal, protein, carbs, fat = self.catalog.sample(rng)
+            grams = round(max(10.0, rng.lognormvariate(math.log(150), 0.5)), 1)
+            factor = grams / 100.0
+            logged_at = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=rng.randint(-90, 90))
+            self.add('meal_logs', (
+                user_id, fdc_id, name, grams, 'g', round(kcal * factor, 1), round(protein * factor, 2),
+                round(carbs * factor, 2), round(fat * factor, 2), meal_type, day.isoformat(),
+                logged_at.strftime('%Y-%m-%d %H:%M:%S'),
+            ))
+
+    def generate_history(self, user_id, entries):
+        rng = self.rng
+        start = max(0, entries - self.history_slots)
+        base = datetime.combine(self.end_date, datetime.min.time()) - timedelta(days=entries)
+        for seq in range(start, entries):
+            fdc_id, name, kcal, protein, carbs, fat = self.catalog.sample(rng)
+            nutrition = json.dumps({'fdcId': fdc_id, 'description': name,
+                                    'macronutrients': {'calories': {'amount': kcal}, 'protein': {'amount': protein},
+                                                       'carbohydrates': {'amount': carbs}, 'fat': {'amount': fat}}})
+            searched_at = (base + timedelta(days=seq, seconds=rng.randint(0, 86399))).strftime('%Y-%m-%d %H:%M:%S')
+            self.add('history_slots', (user_id, seq % self.history_slots, seq, fdc_id, name, searched_at, nutrition))
+        self.add('history_heads', (user_id, entries))
+
+
+def generate(db_path, users, years, seed=1, catalog_size=5000, progress=True):
+    """Create (or extend) a database at db_path; returns per-table row counts"""
+    load_app(db_path, 'http://127.0.0.1:9/fdc/v1')  # create_app() creates the schema
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    try:
+        generator = Generator(conn, rng, users, years, FoodCatalog(rng, catalog_size), HISTORY_SLOTS)
+        counts = generator.run(progress)
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a Nutrivault database with synthetic data')
+    parser.add_argument('--db', required=True, help='Target SQLite file (created if missing)')
+    parser.add_argument('--scale', choices=sorted(SCALES), help='Preset for --users/--years')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--years', type=float)
+    parser.add_argument('--catalog-size', type=int, default=5000, help='Distinct foods to draw from')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help='Delete an existing --db first')
+    args = parser.parse_args()
+
+    preset = SCALES[args.scale or 'small']
+    users = args.users if args.users is not None else preset['users']
+    years = args.years if args.years is not None else preset['years']
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f'{args.db} exists; pass --force to replace it')
+        os.remove(args.db)
+
+    print(f'Generating {users} users over {years} years into {args.db}')
+    started = time.time()
+    counts = generate(args.db, users, years, args.seed, args.catalog_size)
+    print(f'Done in {time.time() - started:.1f}s: ' + ', '.join(f'{k}={v}' for k, v in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Boot the Flask app against the local USDA stub, a throwaway database and a
+stubbed Firebase verifier, for benchmarking.
+
+Each call builds a fresh app with `create_app()`; the module-level `auth`
+proxy is replaced so no Firebase credentials are needed.
+"""
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+class StubFirebaseAuth:
+    """Drop-in for `firebase_admin.auth`: the bearer token *is* the uid"""
+
+    def __init__(self, verify_ms=0.0):
+        self.verify_ms = verify_ms
+
+    def verify_id_token(self, id_token):
+        if self.verify_ms:
+            time.sleep(self.verify_ms / 1000.0)
+        if not id_token:
+            raise ValueError('Empty ID token')
+        return {'uid': id_token, 'email': f'{id_token}@bench.local'}
+
+
+def load_app(database_path, usda_base_url, verify_ms=0.0, config=None):
+    """Import app.py and build an app (module.app) wired to the given database and USDA URL"""
+    os.environ.setdefault('USDA_API_KEY', 'BENCHMARK_KEY')
+    # Skip the real Firebase init
+    os.environ['FIREBASE_CONFIG_PATH'] = os.path.join(tempfile.gettempdir(), 'nutrivault-bench-no-firebase.json')
+
+    module = importlib.import_module('app')
+    module.auth = StubFirebaseAuth(verify_ms)
+    module.app = module.create_app({
+        'DATABASE_PATH': database_path,
+        'USDA_BASE_URL': usda_base_url,
+        # Keep the rate limiter out of the measurements
+        'RATE_LIMIT_REQUESTS': 10 ** 9,
+        **(config or {}),
+    })
+    return module
+
+
+class AppServer:
+    """Serve a WSGI app with werkzeug's threaded server on a background thread"""
+
+    def __init__(self, wsgi_app, host='127.0.0.1', port=0):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietRequestHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.httpd = make_server(host, port, wsgi_app, threaded=True, request_handler=QuietRequestHandler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.httpd.host}:{self.httpd.port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='app-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class BenchmarkDatabase:
+    """Temporary copy (or fresh file) of the SQLite database, removed on exit"""
+
+    def __init__(self, source=None):
+        self.source = source
+        self.tmpdir = None
+        self.path = None
+
+    def __enter__(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='nutrivault-bench-')
+        self.path = os.path.join(self.tmpdir, 'nutrivault.db')
+        if self.source:
+            shutil.copyfile(self.source, self.path)
+        return self
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -0,0 +1,185 @@
+"""Local stand-in for the USDA FoodData Central API used by the benchmarks.
+
+Serves `/foods/search` and `/food/<fdc_id>` from the recorded fixtures in
+`fixtures/food_details.json`, with optional latency and error injection so
+benchmarks never touch the real API.
+
+Run standalone:
+    python -m benchmarks.usda_stub --port 8765 --latency-ms 80 --error-rate 0.02
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_food_fixtures(path=None):
+    """Load recorded /food/{id} responses keyed by fdcId (as a string)"""
+    with open(path or os.path.join(FIXTURES_DIR, 'food_details.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def to_search_result(food):
+    """Reshape a /food/{id} document into a /foods/search hit"""
+    return {
+        'fdcId': food['fdcId'],
+        'description': food['description'],
+        'dataType': food.get('dataType'),
+        'publishedDate': food.get('publicationDate'),
+        'foodNutrients': [
+            {
+                'nutrientId': n['nutrient']['id'],
+                'nutrientName': n['nutrient']['name'],
+                'nutrientNumber': n['nutrient']['number'],
+                'unitName': n['nutrient']['unitName'].upper(),
+                'value': n.get('amount', 0),
+            }
+            for n in food.get('foodNutrients', [])
+        ],
+    }
+
+
+class StubConfig:
+    """Mutable knobs shared by all handler threads"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def next_delay_and_fault(self):
+        with self.lock:
+            self.request_count += 1
+            delay = self.latency_ms + (self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+            fault = self.random.random() < self.error_rate
+        return max(delay, 0) / 1000.0, fault
+
+
+def make_handler(foods, config):
+    search_index = [(food['description'].lower(), to_search_result(food)) for food in foods.values()]
+
+    class USDAStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass  # Keep benchmark output clean
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            delay, fault = config.next_delay_and_fault()
+            if delay:
+                time.sleep(delay)
+            if fault:
+                self._send_json(config.error_status, {'error': {'code': 'INJECTED_FAULT', 'message': 'Injected by usda_stub'}})
+                return
+
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            path = url.path.rstrip('/')
+
+            if path.endswith('/foods/search'):
+                self._search(params)
+            elif '/food/' in path:
+                fdc_id = path.rsplit('/', 1)[-1]
+                food = foods.get(fdc_id)
+                if food is None:
+                    self._send_json(404, {'error': 'Not Found'})
+                else:
+                    self._send_json(200, food)
+            else:
+                self._send_json(404, {'error': 'Not Found'})
+
+        def _search(self, params):
+            query = params.get('query', [''])[0].lower()
+            page_size = int(params.get('pageSize', ['50'])[0])
+            page_number = int(params.get('pageNumber', ['1'])[0])
+
+            tokens = [t for t in query.split() if t]
+            hits = [result for description, result in search_index if all(t in description for t in tokens)]
+            if not hits:
+                # Unrecorded query: answer with every fixture so throughput stays comparable
+                hits = [result for _, result in search_index]
+
+            start = (page_number - 1) * page_size
+            self._send_json(200, {
+                'totalHits': len(hits),
+                'currentPage': page_number,
+                'totalPages': max(1, -(-len(hits) // page_size)),
+                'foodSearchCriteria': {'query': query, 'pageSize': page_size, 'pageNumber': page_number},
+                'foods': hits[start:start + page_size],
+            })
+
+    return USDAStubHandler
+
+
+class USDAStubServer:
+    """Run the stub on a background thread; use as a context manager"""
+
+    def __init__(self, host='127.0.0.1', port=0, config=None, foods=None):
+        self.config = config or StubConfig()
+        self.foods = foods if foods is not None else load_food_fixtures()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.foods, self.config))
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/fdc/v1'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='usda-stub', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local USDA FoodData Central stub')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform +/- jitter around the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    server = USDAStubServer(args.host, args.port, config)
+    print(f'USDA stub serving {len(server.foods)} foods at {server.base_url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
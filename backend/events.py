@@ -0,0 +1,100 @@
+"""Per-user change events for `GET /api/stream`, fanned out to every worker through the event outbox"""
+import queue
+import threading
+from collections import defaultdict
+
+POLL_INTERVAL = 0.5  # Seconds; upper bound on cross-worker delivery delay
+RETENTION_SECONDS = 300  # Outbox rows are kept this long so reconnecting clients can catch up
+PRUNE_EVERY = 500  # Outbox inserts between deletions of expired rows
+POLL_BATCH = 1000
+MAX_STREAMS = 8  # Open streams per worker; each holds a gunicorn thread
+
+
+class EventBroker:
+    """In-process pub/sub of outbox events, keyed by user id"""
+
+    def __init__(self, storage, poll_interval=POLL_INTERVAL, max_streams=MAX_STREAMS):
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        self.streams = 0
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.last_id = 0  # Poll cursor from the storage (per-shard ids for ShardedStorage)
+
+    def open_stream(self):
+        """Reserve one of this worker's max_streams stream slots; False when all are taken"""
+        with self.lock:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self.lock:
+            self.streams -= 1
+
+    def subscribe(self, user_id, last_event_id=None):
+        """A queue that receives (id, event_type, data) for user_id. Events after
+        last_event_id that this worker has already dispatched are replayed first."""
+        events = queue.SimpleQueue()
+        with self.lock:
+            self._start()
+            if last_event_id is not None:
+                # The poller dispatches under this lock, so nothing is missed or sent twice
+                for event in self.storage.user_events(user_id, last_event_id, self.last_id):
+                    events.put(event)
+            self.subscribers[user_id].add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self.lock:
+            queues = self.subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(events)
+                if not queues:
+                    del self.subscribers[user_id]
+
+    def wake(self):
+        """Poll now rather than at the next interval (call after committing an event)"""
+        if self.thread is not None:
+            self.wakeup.set()
+
+    def _start(self):
+        if self.thread is not None:
+            return
+        self.last_id = self.storage.last_event_id()
+        self.thread = threading.Thread(target=self._poll, name='event-broker', daemon=True)
+        self.thread.start()
+
+    def _poll(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            with self.lock:
+                if not self.subscribers:
+                    # The next subscribe() starts a new poller from the then-current outbox position
+                    self.thread = None
+                    return
+            try:
+                self.dispatch()
+            except Exception as e:
+                print(f"Event poll failed: {e}")
+
+    def dispatch(self):
+        """Hand events newer than the last poll to this worker's subscribers"""
+        while True:
+            rows, cursor = self.storage.events_after(self.last_id, POLL_BATCH)
+            if not rows:
+                return
+            with self.lock:
+                for event_id, user_id, event_type, data in rows:
+                    queues = self.subscribers.get(user_id)
+                    if queues:
+                        for events in queues:
+                            events.put((event_id, event_type, data))
+                self.last_id = cursor
+            if len(rows) < POLL_BATCH:
+                return
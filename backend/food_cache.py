@@ -0,0 +1,117 @@
+"""Read-mostly caches for USDA data and food-name suggestions.
+
+`FoodCache` holds simplified USDA responses (food details, search results)
+for a TTL with LRU eviction. `SuggestionIndex` is an immutable prefix index
+over food names users have logged or looked up, used by `/api/suggest`.
+
+Both are created by `create_app()` and filled by `warm_caches()` (app.py).
+Under `gunicorn --preload` that happens once in the master, so workers start
+with warm caches that share the master's pages copy-on-write.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def normalize_name(text):
+    return ' '.join(TOKEN_PATTERN.findall(text.lower()))
+
+
+class FoodCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, name, max_size, ttl):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                metrics.record_cache(self.name, 'miss')
+                return None
+            self.entries.move_to_end(key)
+        metrics.record_cache(self.name, 'hit')
+        return entry[1]
+
+    def put(self, key, value, record=True):
+        """Store value; record=False skips metrics (used while warming in the gunicorn master)"""
+        evicted = 0
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                evicted += 1
+        if record and evicted:
+            metrics.record_cache(self.name, 'eviction')
+
+    def expires_within(self, key, seconds):
+        """True when key is missing or expires in the next `seconds` (no metrics, no LRU update)"""
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry is None or entry[0] < time.time() + seconds
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SuggestionIndex:
+    """Prefix search over food names, ranked by how often each food was used.
+
+    Built once from (food_name, fdc_id, count) rows and never mutated, so a
+    copy built before forking stays shared between workers.
+    """
+
+    def __init__(self, rows=()):
+        foods = {}
+        for food_name, fdc_id, count in rows:
+            name = normalize_name(food_name or '')
+            if not name:
+                continue
+            key = str(fdc_id)
+            if key in foods:
+                foods[key][2] += count
+            else:
+                foods[key] = [food_name, key, count, name]
+        self.foods = sorted((tuple(food) for food in foods.values()), key=lambda food: -food[2])
+        # (token, rank) pairs sorted by token; rank is the position in self.foods
+        self.tokens = sorted((token, rank) for rank, food in enumerate(self.foods) for token in set(food[3].split()))
+
+    def search(self, query, limit=10):
+        """Foods with a word starting with every word of query, most used first"""
+        words = normalize_name(query).split()
+        if not words:
+            return []
+        first = words[0]
+        start = bisect.bisect_left(self.tokens, (first,))
+        ranks = set()
+        for token, rank in self.tokens[start:]:
+            if not token.startswith(first):
+                break
+            ranks.add(rank)
+
+        results = []
+        for rank in sorted(ranks):
+            food_name, fdc_id, count, name = self.foods[rank]
+            tokens = name.split()
+            if all(any(token.startswith(word) for token in tokens) for word in words[1:]):
+                results.append({'fdcId': fdc_id, 'description': food_name, 'count': count})
+                if len(results) >= limit:
+                    break
+        return results
+
+    def __len__(self):
+        return len(self.foods)
@@ -0,0 +1,115 @@
+"""Group commit: meal writes from many request threads share one transaction and one fsync"""
+import queue
+import threading
+import time
+
+import metrics
+
+MAX_BATCH = 64
+MAX_DELAY = 0.002  # Seconds the writer waits for more writes after the first one
+QUEUE_SIZE = 1000
+TIMEOUT = 10.0  # Seconds a write may wait to start before it is dropped
+
+
+class WriteQueueFull(Exception):
+    """Too many writes are pending; the client should retry later"""
+
+
+class WriteTimeout(Exception):
+    """The write was still queued after the timeout and has been dropped, so nothing was written"""
+
+
+class PendingWrite:
+    def __init__(self, write):
+        self.write = write
+        self.done = threading.Event()
+        self.started = False  # Set by the writer thread, under GroupCommitWriter.state_lock
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+
+class GroupCommitWriter:
+    """Runs write(db) callables from many request threads in shared transactions on one writer thread"""
+
+    def __init__(self, storage, max_batch=MAX_BATCH, max_delay=MAX_DELAY, queue_size=QUEUE_SIZE, timeout=TIMEOUT):
+        self.storage = storage
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.pending = [queue.Queue(queue_size) for _ in range(storage.partitions)]
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.threads = {}
+
+    def submit(self, write, partition=0):
+        """Run write(db) in the next batch of `partition` and return its result once that batch
+        has committed. Raises WriteQueueFull when the queue is full, WriteTimeout when the write
+        didn't start within the timeout (it is then never run), or whatever write (or the commit) raised."""
+        self._start(partition)
+        item = PendingWrite(write)
+        try:
+            self.pending[partition].put_nowait(item)
+        except queue.Full:
+            raise WriteQueueFull(f'{self.pending[partition].maxsize} writes pending')
+        if not item.done.wait(self.timeout):
+            with self.state_lock:
+                item.cancelled = not item.started
+            if item.cancelled:
+                raise WriteTimeout(f'Write not started within {self.timeout}s')
+            # Its batch is already running; the busy timeout bounds how long it can take
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _start(self, partition):
+        if partition in self.threads:
+            return
+        with self.lock:
+            if partition not in self.threads:
+                thread = threading.Thread(target=self._run, args=(self.pending[partition],),
+                                          name=f'group-commit-{partition}', daemon=True)
+                thread.start()
+                self.threads[partition] = thread
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Writes already queued join the batch even once the delay has passed
+                    batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+                except queue.Empty:
+                    break
+            self.commit(batch)
+
+    def commit(self, batch):
+        """Run a batch of pending writes in one transaction and wake their requests"""
+        with self.state_lock:
+            batch = [item for item in batch if not item.cancelled]
+            for item in batch:
+                item.started = True
+        if not batch:
+            return
+        try:
+            # Writes read before they write (e.g. idempotency keys), so take the write lock up front:
+            # a deferred transaction would fail at once with SQLITE_BUSY when another process
+            # upgrades its lock at the same time
+            with self.storage.session(immediate=True) as db:
+                for item in batch:
+                    try:
+                        with db.savepoint():
+                            item.result = item.write(db)
+                    except Exception as e:
+                        item.error = e
+        except Exception as e:
+            # The commit itself failed, so nothing in the batch was written
+            print(f"Group commit of {len(batch)} writes failed: {e}")
+            for item in batch:
+                item.error = e
+        metrics.observe_write_batch(len(batch))
+        for item in batch:
+            item.done.set()
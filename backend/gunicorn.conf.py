@@ -0,0 +1,45 @@
+# Gunicorn configuration, picked up automatically by `gunicorn` in this directory
+import os
+import shutil
+import tempfile
+
+# Build and warm the app once in the master (see wsgi.py); workers inherit the
+# warmed caches copy-on-write instead of each loading them after the fork
+wsgi_app = 'wsgi:app'
+preload_app = True
+
+# /api/stream keeps a request open for minutes; with threaded workers an open stream
+# holds one thread instead of a whole worker (and isn't killed by the sync worker timeout)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+# Each open stream holds one of those threads for up to STREAM_MAX_AGE seconds, so streams are
+# capped at STREAM_MAX_PER_WORKER (default 8) per worker and further ones get 503; raise both
+# together for more concurrent dashboards per worker
+
+# The default format logs the request line with its query string, and /api/stream takes the
+# Firebase ID token as ?token= (EventSource can't set headers): log the path only (%(U)s)
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+
+# Metrics are written per worker into this directory and aggregated on scrape
+# (see metrics.py). It must be set before prometheus_client is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'nutrivault-metrics'))
+
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be added to the new totals
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    # Same for the per-worker slow-query aggregates and search query counts
+    # (see slow_query_log.py and search_queries.py)
+    from search_queries import SEARCH_QUERY_DIR
+    from slow_query_log import SLOW_QUERY_DIR
+    shutil.rmtree(SLOW_QUERY_DIR, ignore_errors=True)
+    shutil.rmtree(SEARCH_QUERY_DIR, ignore_errors=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
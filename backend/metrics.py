@@ -0,0 +1,115 @@
+"""Prometheus metrics for the Nutrivault API.
+
+Exposes `/metrics` in the Prometheus text format. Under gunicorn every worker
+is a separate process, so metrics use prometheus_client's multiprocess mode:
+when PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py does this), each worker
+writes its samples to files in that directory and `/metrics` aggregates all of
+them, whichever worker serves the scrape.
+"""
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+# Buckets tuned for an API whose fast paths are ~1ms and USDA calls are 100ms-seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+HTTP_REQUEST_DURATION = Histogram(
+    'nutrivault_http_request_duration_seconds', 'Time spent handling a request, by route',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+HTTP_REQUESTS = Counter(
+    'nutrivault_http_requests_total', 'Handled requests, by route and status code',
+    ['method', 'route', 'status'])
+USDA_REQUEST_DURATION = Histogram(
+    'nutrivault_usda_request_duration_seconds', 'Latency of calls to the USDA FoodData Central API',
+    ['endpoint'], buckets=LATENCY_BUCKETS)
+USDA_RESPONSES = Counter(
+    'nutrivault_usda_responses_total', "USDA API responses by endpoint and status ('error' for network failures)",
+    ['endpoint', 'status'])
+RATE_LIMITED_REQUESTS = Counter(
+    'nutrivault_rate_limited_requests_total', 'Requests rejected by the per-IP rate limiter',
+    ['route'])
+DB_QUERY_DURATION = Histogram(
+    'nutrivault_db_query_duration_seconds', 'SQLite statement execution time, by statement label',
+    ['statement'], buckets=QUERY_BUCKETS)
+WRITE_BATCH_SIZE = Histogram(
+    'nutrivault_write_batch_size', 'Writes committed together by the group-commit writer',
+    buckets=BATCH_BUCKETS)
+SEARCH_QUERIES = Counter(
+    'nutrivault_search_queries_total',
+    "/api/search requests by whether canonicalization changed the query's cache key ('rewritten' or 'unchanged')",
+    ['form'])
+CACHE_EVENTS = Counter(
+    'nutrivault_cache_events_total', 'Cache lookups and evictions, by cache and event (hit, miss, eviction)',
+    ['cache', 'event'])
+
+UNMATCHED_ROUTE = 'unmatched'
+
+
+def route_label():
+    """Use the URL rule (e.g. /api/food/<fdc_id>) so label cardinality stays bounded"""
+    rule = request.url_rule
+    return rule.rule if rule is not None else UNMATCHED_ROUTE
+
+
+def observe_usda(endpoint, seconds, status):
+    USDA_REQUEST_DURATION.labels(endpoint=endpoint).observe(seconds)
+    USDA_RESPONSES.labels(endpoint=endpoint, status=str(status)).inc()
+
+
+def observe_query(statement, seconds):
+    DB_QUERY_DURATION.labels(statement=statement).observe(seconds)
+
+
+def observe_write_batch(size):
+    WRITE_BATCH_SIZE.observe(size)
+
+
+def record_rate_limited():
+    RATE_LIMITED_REQUESTS.labels(route=route_label()).inc()
+
+
+def record_search_query(rewritten):
+    SEARCH_QUERIES.labels(form='rewritten' if rewritten else 'unchanged').inc()
+
+
+def record_cache(cache, event):
+    """event is 'hit', 'miss' or 'eviction'"""
+    CACHE_EVENTS.labels(cache=cache, event=event).inc()
+
+
+def collect():
+    """Render all metrics, aggregated across worker processes in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app, path='/metrics'):
+    """Register request instrumentation and the scrape endpoint on app"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None and request.path != path:
+            route = route_label()
+            HTTP_REQUEST_DURATION.labels(method=request.method, route=route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method=request.method, route=route, status=str(response.status_code)).inc()
+        return response
+
+    @app.route(path)
+    def metrics():
+        return Response(collect(), mimetype=CONTENT_TYPE_LATEST)
+
+    return app
@@ -0,0 +1,71 @@
+"""Classification of USDA nutrient names into the groups returned by /api/food.
+
+`classify_nutrient(name)` returns `('macro', key)`, `('micro', name)` or
+`('other', name)`. Results are kept in a lookup table that `warm()` fills
+with the nutrient names FoodData Central uses, so the substring rules only
+run for names seen for the first time.
+"""
+import threading
+
+VITAMIN_WORDS = ('vitamin', 'folate', 'niacin', 'riboflavin', 'thiamin')
+MINERAL_WORDS = ('calcium', 'iron', 'magnesium', 'phosphorus', 'potassium', 'sodium', 'zinc')
+
+# Nutrient names found in FoodData Central Foundation / SR Legacy foods
+KNOWN_NUTRIENT_NAMES = (
+    'Energy', 'Energy (Atwater General Factors)', 'Energy (Atwater Specific Factors)', 'Protein',
+    'Total lipid (fat)', 'Total fat (NLEA)', 'Carbohydrate, by difference', 'Carbohydrate, by summation',
+    'Water', 'Ash', 'Nitrogen', 'Alcohol, ethyl', 'Caffeine', 'Theobromine', 'Cholesterol',
+    'Fiber, total dietary', 'Sugars, total including NLEA', 'Sugars, Total', 'Sucrose', 'Glucose',
+    'Fructose', 'Lactose', 'Maltose', 'Galactose', 'Starch',
+    'Calcium, Ca', 'Iron, Fe', 'Magnesium, Mg', 'Phosphorus, P', 'Potassium, K', 'Sodium, Na', 'Zinc, Zn',
+    'Copper, Cu', 'Manganese, Mn', 'Selenium, Se', 'Fluoride, F',
+    'Vitamin C, total ascorbic acid', 'Thiamin', 'Riboflavin', 'Niacin', 'Pantothenic acid', 'Vitamin B-6',
+    'Folate, total', 'Folic acid', 'Folate, food', 'Folate, DFE', 'Choline, total', 'Betaine', 'Vitamin B-12',
+    'Vitamin B-12, added', 'Vitamin A, RAE', 'Vitamin A, IU', 'Retinol', 'Carotene, beta', 'Carotene, alpha',
+    'Cryptoxanthin, beta', 'Lycopene', 'Lutein + zeaxanthin', 'Vitamin E (alpha-tocopherol)', 'Vitamin E, added',
+    'Vitamin D (D2 + D3)', 'Vitamin D (D2 + D3), International Units', 'Vitamin D3 (cholecalciferol)',
+    'Vitamin K (phylloquinone)', 'Vitamin K (Dihydrophylloquinone)', 'Vitamin K (Menaquinone-4)',
+    'Fatty acids, total saturated', 'Fatty acids, total monounsaturated', 'Fatty acids, total polyunsaturated',
+    'Fatty acids, total trans', 'Tryptophan', 'Threonine', 'Isoleucine', 'Leucine', 'Lysine', 'Methionine',
+    'Cystine', 'Phenylalanine', 'Tyrosine', 'Valine', 'Arginine', 'Histidine', 'Alanine', 'Aspartic acid',
+    'Glutamic acid', 'Glycine', 'Proline', 'Serine',
+)
+
+_table = {}
+_lock = threading.Lock()
+
+
+def _classify(name):
+    lowered = name.lower()
+    if 'energy' in lowered or 'calorie' in lowered:
+        return ('macro', 'calories')
+    if 'protein' in lowered:
+        return ('macro', 'protein')
+    if 'carbohydrate' in lowered and 'by difference' in lowered:
+        return ('macro', 'carbohydrates')
+    if 'fatty acids' in lowered:
+        # "Fatty acids, total saturated" would otherwise match the fat rule below and replace total fat
+        return ('other', name)
+    if 'total lipid' in lowered or ('fat' in lowered and 'total' in lowered):
+        return ('macro', 'fat')
+    if any(word in lowered for word in VITAMIN_WORDS) or any(word in lowered for word in MINERAL_WORDS):
+        return ('micro', name)
+    return ('other', name)
+
+
+def classify_nutrient(name):
+    result = _table.get(name)
+    if result is None:
+        result = _classify(name)
+        with _lock:
+            _table[name] = result
+    return result
+
+
+def warm(names=()):
+    """Pre-compute classifications for the known USDA names plus any extra names"""
+    with _lock:
+        for name in KNOWN_NUTRIENT_NAMES + tuple(names):
+            if name not in _table:
+                _table[name] = _classify(name)
+    return len(_table)
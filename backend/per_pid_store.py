@@ -0,0 +1,97 @@
+"""Per-process JSON files in one directory, for stats each gunicorn worker collects on its own.
+
+Each process writes its data to `<storage_dir>/<pid>.json` at most every
+FLUSH_INTERVAL; readers merge the files of all processes. `reset()` deletes
+the files and touches a RESET marker, which the other processes notice on
+their next `check_reset()`. Used by slow_query_log.py and search_queries.py.
+"""
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('nutrivault.per_pid_store')
+
+FLUSH_INTERVAL = 1.0  # seconds between writes of this process' data
+
+
+class PerPidStore:
+    """Not thread-safe: the owner calls it while holding its own lock"""
+
+    def __init__(self, storage_dir):
+        self.storage_dir = storage_dir
+        self.last_flush = 0.0
+        self.dirty = False
+        self.reset_seen = self._reset_marker_time()
+
+    def _reset_marker(self):
+        return os.path.join(self.storage_dir, 'RESET')
+
+    def _reset_marker_time(self):
+        try:
+            return os.path.getmtime(self._reset_marker())
+        except OSError:
+            return 0.0
+
+    def _path(self):
+        return os.path.join(self.storage_dir, f'{os.getpid()}.json')
+
+    def check_reset(self):
+        """True when another process called reset() since the last check; the owner then drops its data"""
+        marker_time = self._reset_marker_time()
+        if marker_time > self.reset_seen:
+            self.reset_seen = marker_time
+            self.dirty = False
+            return True
+        return False
+
+    def changed(self, snapshot):
+        """Note that this process' data changed, and write snapshot() once FLUSH_INTERVAL has passed"""
+        self.dirty = True
+        if time.time() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush(snapshot)
+
+    def flush(self, snapshot):
+        """Write snapshot() (JSON-serializable) as this process' file, if anything changed"""
+        self.last_flush = time.time()
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(self.storage_dir, exist_ok=True)
+            tmp_path = self._path() + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot(), f)
+            os.replace(tmp_path, self._path())
+            self.dirty = False
+        except OSError as e:
+            logger.warning('Could not write %s: %s', self._path(), e)
+
+    def snapshots(self):
+        """The data last written by every process since the last reset"""
+        results = []
+        for name in os.listdir(self.storage_dir) if os.path.isdir(self.storage_dir) else []:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.storage_dir, name)
+            try:
+                if os.path.getmtime(path) < self.reset_seen:
+                    continue  # written before the last reset by a process that hasn't caught up yet
+                with open(path, encoding='utf-8') as f:
+                    results.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return results
+
+    def reset(self):
+        """Delete every process' file; the others notice the RESET marker in check_reset()"""
+        self.dirty = False
+        os.makedirs(self.storage_dir, exist_ok=True)
+        for name in os.listdir(self.storage_dir):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.storage_dir, name))
+                except OSError:
+                    pass
+        with open(self._reset_marker(), 'w', encoding='utf-8') as f:
+            f.write(str(time.time()))
+        self.reset_seen = self._reset_marker_time()
@@ -0,0 +1,139 @@
+"""Background refresh of the USDA caches for the foods and searches users hit most"""
+import threading
+import time
+from collections import Counter
+
+MAX_TRACKED_QUERIES = 5000  # Query counts kept between runs; the rest are dropped
+MAX_BACKGROUND_FETCHES = 4  # fetch_soon() calls running at once per worker
+BUDGET_TASK = 'prefetch_usda'  # storage.claim_budget() task: the budget is shared by all workers
+
+
+class Prefetcher:
+    def __init__(self, app, fetch_food, fetch_search, interval, budget, foods=300, queries=50,
+                 meal_rows=50000, quiet_rps=5.0):
+        self.app = app
+        self.fetch_food = fetch_food  # fetch_food(fdc_id); needs an app context
+        self.fetch_search = fetch_search  # fetch_search(query, cache_key)
+        self.interval = interval
+        self.budget = budget
+        self.foods = foods
+        self.queries = queries
+        self.meal_rows = meal_rows
+        self.quiet_rps = quiet_rps
+        self.lock = threading.Lock()
+        self.searches = Counter()
+        self.search_queries = {}  # cache key -> query sent to USDA for it
+        self.requests = 0
+        self.since = (time.monotonic(), 0)  # (time, self.requests) when the last run ended
+        self.thread = None
+        self.fetching = set()  # Keys of running fetch_soon() calls
+
+    def init_app(self, app):
+        @app.before_request
+        def count_request():
+            # Unlocked increments can drop a count now and then; only the rate matters
+            self.requests += 1
+            self._start()
+
+    def record_search(self, cache_key, query=None):
+        with self.lock:
+            self.searches[cache_key] += 1
+            self.search_queries.setdefault(cache_key, query or cache_key)
+            if len(self.searches) > 2 * MAX_TRACKED_QUERIES:
+                self.searches = Counter(dict(self.searches.most_common(MAX_TRACKED_QUERIES)))
+                self.search_queries = {key: self.search_queries[key] for key in self.searches}
+
+    def fetch_soon(self, key, fetch):
+        """Run fetch() on a background thread with an app context, unless key is already
+        being fetched or too many fetches are running; returns whether it started"""
+        with self.lock:
+            if key in self.fetching or len(self.fetching) >= MAX_BACKGROUND_FETCHES:
+                return False
+            self.fetching.add(key)
+
+        def run():
+            try:
+                with self.app.app_context():
+                    fetch()
+            except Exception as e:
+                print(f"Prefetch of {key} failed: {e}")
+            finally:
+                with self.lock:
+                    self.fetching.discard(key)
+
+        threading.Thread(target=run, name='prefetch-soon', daemon=True).start()
+        return True
+
+    def _start(self):
+        if self.thread is not None or self.budget <= 0:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.since = (time.monotonic(), self.requests)
+                self.thread = threading.Thread(target=self._run, name='prefetcher', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    foods, searches = self.run_once()
+                if foods or searches:
+                    print(f"Prefetched {foods} foods and {searches} searches")
+            except Exception as e:
+                print(f"Prefetch failed: {e}")
+
+    def hot_queries(self):
+        """(cache key, query) of the most served searches; counts halve every run so recent ones rank first"""
+        with self.lock:
+            hot = [(key, self.search_queries.get(key, key)) for key, _ in self.searches.most_common(self.queries)]
+            self.searches = Counter({key: count // 2 for key, count in self.searches.most_common(MAX_TRACKED_QUERIES)
+                                     if count > 1})
+            self.search_queries = {key: self.search_queries[key] for key in self.searches}
+        return hot
+
+    def hot_foods(self):
+        counts = Counter()
+        for _, fdc_id, count in self.app.extensions['storage'].popular_foods(self.meal_rows):
+            counts[str(fdc_id)] += count
+        return [fdc_id for fdc_id, _ in counts.most_common(self.foods)]
+
+    def request_rate(self, since):
+        started, requests = since
+        return (self.requests - requests) / max(time.monotonic() - started, 1.0)
+
+    def run_once(self):
+        """Refresh stale hot entries while the worker is quiet, within the budget of USDA
+        calls that all workers share per interval; returns (foods, searches) fetched"""
+        busy = self.request_rate(self.since) > self.quiet_rps
+        self.since = started = (time.monotonic(), self.requests)
+        if busy:
+            return 0, 0
+        refresh_before = 2 * self.interval  # Anything expiring before the next run
+        food_cache = self.app.extensions['food_cache']
+        search_cache = self.app.extensions['search_cache']
+
+        stale = [('food', fdc_id) for fdc_id in self.hot_foods() if food_cache.expires_within(fdc_id, refresh_before)]
+        stale += [('search', (key, query)) for key, query in self.hot_queries()
+                  if search_cache.expires_within(key, refresh_before)]
+
+        fetched = Counter()
+        storage = self.app.extensions['storage']
+        for kind, key in stale[:self.budget]:
+            if self.request_rate(started) > self.quiet_rps:
+                break
+            if not storage.claim_budget(BUDGET_TASK, self.interval, self.budget):
+                # Other workers used up this interval's calls; what is left is fetched on demand
+                break
+            if kind == 'food':
+                ok = self.fetch_food(key) is not None
+            else:
+                cache_key, query = key
+                ok = self.fetch_search(query, cache_key)[0] is not None
+            if not ok:
+                # USDA answered with an error; try again next run rather than keep calling it
+                break
+            fetched[kind] += 1
+        self.since = (time.monotonic(), self.requests)
+        return fetched['food'], fetched['search']
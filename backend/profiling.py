@@ -0,0 +1,233 @@
+"""On-demand profiling of single requests.
+
+An admin sends a normal API request with `X-Profile: 1` (plus the admin token,
+see `is_admin_request` in app.py) and that one request runs under a profiler:
+
+- `X-Profile-Format: text` (default), `html` or `pstats` use cProfile
+- `X-Profile-Format: collapsed` uses a sampling profiler and returns collapsed
+  stacks (one `frame;frame;frame count` line per stack, for flamegraph tools)
+
+By default the profile replaces the response body. With `X-Profile-Store: 1`
+the normal response is returned and the profile is written to PROFILE_DIR;
+its id comes back in `X-Profile-Id` and it can be fetched from
+`/api/admin/profiles/<id>`.
+
+Independently of the profiler, handlers wrap their expensive steps in
+`phase('auth' | 'sql' | 'usda' | 'serialize')`. Profiled requests report the
+accumulated phase times in a `Server-Timing` header and in the profile.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from html import escape
+
+from flask import Response, abort, g, has_request_context, jsonify, request, send_file
+from flask.json.provider import DefaultJSONProvider
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'nutrivault-profiles'))
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 1)) / 1000.0
+TEXT_STATS_LIMIT = 60
+
+FORMATS = {
+    'text': ('txt', 'text/plain; charset=utf-8'),
+    'html': ('html', 'text/html; charset=utf-8'),
+    'pstats': ('prof', 'application/octet-stream'),
+    'collapsed': ('collapsed', 'text/plain; charset=utf-8'),
+}
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$')
+
+
+@contextmanager
+def phase(name):
+    """Accumulate wall time spent in `name` for the current request"""
+    if not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault('phase_timings', {})
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start)
+
+
+class PhaseTimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that counts response serialization as the 'serialize' phase"""
+
+    def dumps(self, obj, **kwargs):
+        with phase('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval from a helper thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+
+def _phase_header(timings):
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in sorted(timings.items()))
+
+
+def _phase_lines(timings, total):
+    lines = [f'total: {total * 1000:.2f} ms']
+    lines += [f'{name}: {seconds * 1000:.2f} ms' for name, seconds in sorted(timings.items())]
+    return lines
+
+
+def _render(fmt, profiler, timings, total, description):
+    """Return the profile as bytes in the requested format"""
+    if fmt == 'collapsed':
+        header = ''.join(f'# {line}\n' for line in [description] + _phase_lines(timings, total))
+        return (header + profiler.collapsed()).encode('utf-8')
+
+    stats = pstats.Stats(profiler)
+    if fmt == 'pstats':
+        # Same format as cProfile's -o output; load with pstats.Stats(path)
+        fd, path = tempfile.mkstemp(suffix='.prof')
+        os.close(fd)
+        try:
+            stats.dump_stats(path)
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.sort_stats('cumulative').print_stats(TEXT_STATS_LIMIT)
+    text = '\n'.join([description] + _phase_lines(timings, total)) + '\n\n' + buffer.getvalue()
+    if fmt == 'html':
+        rows = ''.join(f'<tr><td>{escape(name)}</td><td>{seconds * 1000:.2f} ms</td></tr>'
+                       for name, seconds in sorted(timings.items()))
+        return (f'<!doctype html><html><head><meta charset="utf-8"><title>{escape(description)}</title></head><body>'
+                f'<h1>{escape(description)}</h1><p>Total {total * 1000:.2f} ms</p>'
+                f'<table border="1"><tr><th>Phase</th><th>Time</th></tr>{rows}</table>'
+                f'<pre>{escape(buffer.getvalue())}</pre></body></html>').encode('utf-8')
+    return text.encode('utf-8')
+
+
+def _store(fmt, body, description, timings, total):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    extension = FORMATS[fmt][0]
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.{extension}'), 'wb') as f:
+        f.write(body)
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'id': profile_id, 'format': fmt, 'request': description, 'total_ms': round(total * 1000, 3),
+                   'phases_ms': {k: round(v * 1000, 3) for k, v in timings.items()}}, f)
+    return profile_id
+
+
+def init_app(app, is_authorized):
+    """Enable per-request profiling; is_authorized() decides who may use it"""
+    app.json = PhaseTimedJSONProvider(app)
+
+    @app.before_request
+    def start_profiler():
+        if request.headers.get('X-Profile') != '1' or not is_authorized():
+            return None
+        fmt = request.headers.get('X-Profile-Format', 'text')
+        if fmt not in FORMATS:
+            return jsonify({'error': f"X-Profile-Format must be one of {', '.join(FORMATS)}"}), 400
+
+        if fmt == 'collapsed':
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        g.profile = {'format': fmt, 'profiler': profiler, 'start': time.perf_counter()}
+        return None
+
+    @app.after_request
+    def finish_profiler(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        profiler = profile['profiler']
+        if profile['format'] == 'collapsed':
+            profiler.stop()
+        else:
+            profiler.disable()
+        total = time.perf_counter() - profile['start']
+        timings = dict(g.get('phase_timings', {}))
+        # The path without the query string, which may carry a token (GET /api/stream?token=)
+        description = f'{request.method} {request.path} -> {response.status_code}'
+
+        body = _render(profile['format'], profiler, timings, total, description)
+        if request.headers.get('X-Profile-Store') == '1':
+            response.headers['X-Profile-Id'] = _store(profile['format'], body, description, timings, total)
+        else:
+            status = response.status_code
+            response = Response(body, status=status, mimetype=FORMATS[profile['format']][1])
+        response.headers['Server-Timing'] = _phase_header(dict(timings, total=total))
+        return response
+
+    @app.route('/api/admin/profiles', methods=['GET'])
+    def list_profiles():
+        if not is_authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        profiles = []
+        if os.path.isdir(PROFILE_DIR):
+            for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+                if name.endswith('.json'):
+                    with open(os.path.join(PROFILE_DIR, name), encoding='utf-8') as f:
+                        profiles.append(json.load(f))
+        return jsonify({'success': True, 'profiles': profiles})
+
+    @app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        if not is_authorized():
+            return jsonify({'error': 'Admin token required'}), 403
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            abort(404)
+        meta_path = os.path.join(PROFILE_DIR, f'{profile_id}.json')
+        if not os.path.exists(meta_path):
+            return jsonify({'error': 'Profile not found'}), 404
+        with open(meta_path, encoding='utf-8') as f:
+            fmt = json.load(f)['format']
+        extension, mimetype = FORMATS[fmt]
+        return send_file(os.path.join(PROFILE_DIR, f'{profile_id}.{extension}'), mimetype=mimetype,
+                         as_attachment=fmt == 'pstats', download_name=f'{profile_id}.{extension}')
+
+    return app
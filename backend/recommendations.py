@@ -0,0 +1,165 @@
+"""Food recommendations and similar-food lookups over the local food table.
+
+All known foods (the `foods` table, filled from /api/food lookups) are held
+in one float matrix of per-gram calories/protein/carbs/fat.
+
+- `recommend()`: for a remaining budget r, every food gets the serving s that
+  minimizes the weighted error ||W(s*v - r)||, clipped to a sensible range,
+  in a single vectorized pass; the k foods with the smallest error win.
+- `similar()`: nearest neighbours of one food by Euclidean distance between
+  standardized per-100g vectors, optionally shifted towards more/less of a
+  macro ("like this, but with more protein").
+"""
+import threading
+import time
+
+import numpy as np
+
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+MIN_SERVING_G = 20.0
+MAX_SERVING_G = 400.0
+ADJUST_STEP = 1.0  # Standard deviations the query moves per more_/less_ adjustment
+EXCLUDED = 1e30  # Distance penalty for foods filtered out of a similarity query
+
+
+class FoodMatrix:
+    """Per-gram macro matrix of every food in the `foods` table"""
+
+    def __init__(self, rows=()):
+        rows = [row for row in rows if row[2] is not None and row[2] > 0]
+        self.fdc_ids = [row[0] for row in rows]
+        self.descriptions = [row[1] for row in rows]
+        self.index = {fdc_id: i for i, fdc_id in enumerate(self.fdc_ids)}
+        # Columns follow MACROS; the foods table stores amounts per 100 g
+        self.per_gram = np.array([[value or 0.0 for value in row[2:6]] for row in rows],
+                                 dtype=np.float64).reshape(-1, len(MACROS)) / 100.0
+        # Standardized per-100g vectors for similarity; squared norms precomputed
+        # so each query's distances are one matrix-vector product
+        self.mean = self.per_gram.mean(axis=0) if len(rows) else np.zeros(len(MACROS))
+        self.std = np.maximum(self.per_gram.std(axis=0), 1e-9) if len(rows) else np.ones(len(MACROS))
+        self.features = (self.per_gram - self.mean) / self.std
+        self.feature_norms = np.einsum('ij,ij->i', self.features, self.features)
+        self.columns = np.ascontiguousarray(self.per_gram.T)  # per-macro columns for the adjust filters
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.fdc_ids)
+
+    def recommend(self, remaining, goals, k=10, exclude=()):
+        """Top-k foods for the remaining budget.
+
+        remaining and goals are (calories, protein, carbs, fat) sequences; goals
+        scale each macro so a gram of protein and a kcal are comparable.
+        """
+        if not len(self):
+            return []
+        target = np.maximum(np.asarray(remaining, dtype=np.float64), 0.0)
+        weights = 1.0 / np.maximum(np.asarray(goals, dtype=np.float64), 1.0)
+        foods = self.per_gram * weights  # (n, 4), weighted nutrients per gram
+        goal = target * weights
+
+        # Least-squares serving per food: s = <v, r> / <v, v>
+        norms = np.einsum('ij,ij->i', foods, foods)
+        servings = np.clip(foods @ goal / np.maximum(norms, 1e-12), MIN_SERVING_G, MAX_SERVING_G)
+        errors = np.linalg.norm(foods * servings[:, None] - goal, axis=1)
+
+        excluded = [self.index[fdc_id] for fdc_id in exclude if fdc_id in self.index]
+        errors[excluded] = np.inf
+        k = min(k, len(self))
+        top = np.argpartition(errors, k - 1)[:k]
+        top = top[np.argsort(errors[top])]
+
+        results = []
+        for i in top:
+            if not np.isfinite(errors[i]):
+                break
+            grams = float(round(servings[i] / 5.0) * 5.0)
+            amounts = self.per_gram[i] * grams
+            results.append({
+                'fdcId': self.fdc_ids[i],
+                'description': self.descriptions[i],
+                'servingGrams': grams,
+                'nutrients': {
+                    'calories': round(float(amounts[0])),
+                    'protein': round(float(amounts[1]), 1),
+                    'carbs': round(float(amounts[2]), 1),
+                    'fat': round(float(amounts[3]), 1)
+                },
+                'score': round(float(errors[i]), 4)
+            })
+        return results
+
+    def per_100g(self, i):
+        values = self.per_gram[i] * 100.0
+        return {
+            'calories': round(float(values[0])),
+            'protein': round(float(values[1]), 1),
+            'carbs': round(float(values[2]), 1),
+            'fat': round(float(values[3]), 1)
+        }
+
+    def similar(self, fdc_id, k=10, adjust=()):
+        """k foods nearest to fdc_id, or None if it isn't in the matrix.
+
+        adjust holds (macro, +1 | -1) pairs: the query point moves ADJUST_STEP
+        standard deviations in that direction, and only foods with more (or
+        less) of that macro per 100 g than the original are returned.
+        """
+        i = self.index.get(str(fdc_id))
+        if i is None:
+            return None
+        query = self.features[i].copy()
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2 for every food at once
+        for macro, direction in adjust:
+            query[MACROS.index(macro)] += direction * ADJUST_STEP
+        distances = self.feature_norms - 2.0 * (self.features @ query) + query @ query
+        distances[i] = EXCLUDED
+        for macro, direction in adjust:
+            # Adding a penalty is several times faster than boolean-index assignment at this size
+            column = self.columns[MACROS.index(macro)]
+            worse = column <= column[i] if direction > 0 else column >= column[i]
+            distances += worse * EXCLUDED
+
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [{
+            'fdcId': self.fdc_ids[j],
+            'description': self.descriptions[j],
+            'per100g': self.per_100g(j),
+            'distance': round(float(np.sqrt(max(distances[j], 0.0))), 4)
+        } for j in top if distances[j] < EXCLUDED]
+
+
+class FoodMatrixCache:
+    """Holds the current FoodMatrix; reloads it after max_age seconds, or sooner
+    (but at most every STALE_RELOAD_INTERVAL seconds) once marked stale"""
+
+    STALE_RELOAD_INTERVAL = 5.0
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.matrix = None
+        self.stale = False
+        self.lock = threading.Lock()
+
+    def _expired(self, matrix):
+        if matrix is None:
+            return True
+        age = time.time() - matrix.loaded_at
+        return age > self.max_age or (self.stale and age > self.STALE_RELOAD_INTERVAL)
+
+    def get(self, load_rows):
+        matrix = self.matrix
+        if self._expired(matrix):
+            with self.lock:
+                matrix = self.matrix
+                if self._expired(matrix):
+                    self.stale = False
+                    matrix = self.matrix = FoodMatrix(load_rows())
+        return matrix
+
+    def mark_stale(self):
+        self.stale = True
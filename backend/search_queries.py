@@ -0,0 +1,200 @@
+"""Canonical forms of food search queries, so spelling variants share one cache entry.
+
+"Chicken Breast", "chicken  breast " and "breast, chicken" are one search.
+`QueryCanonicalizer.canonical()` reduces a query to a key in five steps:
+
+1. case folding;
+2. splitting into word tokens, which drops punctuation and extra whitespace;
+3. stemming simple plurals ("berries" -> "berry", "eggs" -> "egg");
+4. replacing synonyms ("aubergine" -> "eggplant", "garbanzo beans" -> "chickpea");
+5. removing duplicate tokens and sorting the rest.
+
+`/api/search` caches results under that key. USDA is sent the same tokens
+unstemmed ("chicken eggs" for "Eggs, Chicken"), because stems such as
+"cooky" aren't words. FoodData Central matches terms in any order, so the
+sorting doesn't change its results.
+
+`QueryStats` counts the requests and the distinct raw queries behind each
+key. Like the slow-query log, each process writes its counts to
+`<SEARCH_QUERY_DIR>/<pid>.json` (see per_pid_store.py) and `top()` merges
+every worker's file for `/api/admin/search-queries`.
+"""
+import os
+import re
+import tempfile
+import threading
+
+from per_pid_store import PerPidStore
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+# Words whose trailing "s" is not a plural
+NOT_PLURAL = frozenset(('molasses', 'grits', 'series', 'species', 'hummus', 'asparagus', 'couscous', 'citrus'))
+
+DEFAULT_SYNONYMS = {
+    'aubergine': 'eggplant',
+    'courgette': 'zucchini',
+    'garbanzo': 'chickpea',
+    'garbanzo bean': 'chickpea',
+    'yoghurt': 'yogurt',
+    'prawn': 'shrimp',
+    'rocket': 'arugula',
+    'beetroot': 'beet',
+    'scallion': 'green onion',
+    'spring onion': 'green onion',
+    'capsicum': 'bell pepper',
+}
+
+MAX_TRACKED_KEYS = 5000  # Canonical keys QueryStats keeps; the least requested are dropped
+MAX_VARIANTS_PER_KEY = 100  # Raw queries remembered per key; later ones are only counted
+SEARCH_QUERY_DIR = os.getenv('SEARCH_QUERY_DIR', os.path.join(tempfile.gettempdir(), 'nutrivault-search-queries'))
+
+
+def stem(token):
+    """Strip a simple English plural ending. Only used in keys, so it can produce non-words:
+    "cookie" and "cookies" both become "cooky", as "berry" and "berries" become "berry"."""
+    if len(token) <= 3 or token in NOT_PLURAL or token.isdigit():
+        return token
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    if token.endswith('ie'):
+        return token[:-2] + 'y'
+    if token.endswith(('oes', 'ches', 'shes', 'xes', 'sses')):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us')):
+        return token[:-1]
+    return token
+
+
+def words(text):
+    """(stem, word) pairs of a text's casefolded word tokens"""
+    return [(stem(word), word) for word in TOKEN_PATTERN.findall(text.casefold())]
+
+
+def parse_synonyms(spec):
+    """{phrase: replacement} from a dict or from 'word=replacement,other word=replacement'"""
+    if isinstance(spec, dict):
+        return dict(spec)
+    synonyms = {}
+    for pair in (spec or '').split(','):
+        phrase, _, replacement = pair.partition('=')
+        if phrase.strip() and replacement.strip():
+            synonyms[phrase.strip()] = replacement.strip()
+    return synonyms
+
+
+class QueryCanonicalizer:
+    def __init__(self, synonyms=None):
+        table = {**DEFAULT_SYNONYMS, **(synonyms or {})}
+        # Matched on stems, so "garbanzo beans" hits the "garbanzo bean" entry
+        self.synonyms = {tuple(stem for stem, _ in words(phrase)): words(replacement)
+                         for phrase, replacement in table.items() if words(phrase)}
+        self.longest = max((len(phrase) for phrase in self.synonyms), default=0)
+
+    def canonical(self, query):
+        """(cache key, query to send USDA) for a raw search query"""
+        pairs = words(query)
+        stems = [stem for stem, _ in pairs]
+        result = {}
+        index = 0
+        while index < len(pairs):
+            # Longest synonym phrase starting here, if any
+            for length in range(min(self.longest, len(pairs) - index), 0, -1):
+                replacement = self.synonyms.get(tuple(stems[index:index + length]))
+                if replacement is not None:
+                    for stem, word in replacement:
+                        result.setdefault(stem, word)
+                    index += length
+                    break
+            else:
+                result.setdefault(*pairs[index])
+                index += 1
+        if not result:
+            # Punctuation only: keep the whitespace-collapsed query
+            key = ' '.join(query.lower().split())
+            return key, key
+        ordered = sorted(result)
+        return ' '.join(ordered), ' '.join(result[stem] for stem in ordered)
+
+
+class QueryStats:
+    """Thread-safe counts of requests and distinct raw queries per canonical key, merged across workers"""
+
+    def __init__(self, max_keys=MAX_TRACKED_KEYS, storage_dir=SEARCH_QUERY_DIR):
+        self.max_keys = max_keys
+        self.store = PerPidStore(storage_dir)
+        self.lock = threading.Lock()
+        self.keys = {}  # key -> {'requests': n, 'variants': set of raw queries, 'more_variants': n}
+
+    def record(self, raw, key):
+        with self.lock:
+            self._check_reset_locked()
+            entry = self.keys.get(key)
+            if entry is None:
+                entry = self.keys[key] = {'requests': 0, 'variants': set(), 'more_variants': 0}
+            entry['requests'] += 1
+            if raw not in entry['variants']:
+                if len(entry['variants']) < MAX_VARIANTS_PER_KEY:
+                    entry['variants'].add(raw)
+                else:
+                    entry['more_variants'] += 1  # May count a repeat; only the order of magnitude matters
+            if len(self.keys) > 2 * self.max_keys:
+                self.keys = self._most_requested(self.keys)
+            self.store.changed(self._snapshot)
+
+    def _most_requested(self, keys):
+        top = sorted(keys.items(), key=lambda item: item[1]['requests'], reverse=True)
+        return dict(top[:self.max_keys])
+
+    def _snapshot(self):
+        return {key: {**entry, 'variants': sorted(entry['variants'])} for key, entry in self.keys.items()}
+
+    def _check_reset_locked(self):
+        """Drop counts collected before another process called reset()"""
+        if self.store.check_reset():
+            self.keys = {}
+
+    def _merged(self):
+        """Every process' counts added up; raw queries seen by several workers count once"""
+        merged = {}
+        for keys in self.store.snapshots():
+            for key, entry in keys.items():
+                current = merged.setdefault(key, {'requests': 0, 'variants': set(), 'more_variants': 0})
+                current['requests'] += entry['requests']
+                current['more_variants'] += entry['more_variants']
+                for raw in entry['variants']:
+                    if raw in current['variants']:
+                        continue
+                    if len(current['variants']) < MAX_VARIANTS_PER_KEY:
+                        current['variants'].add(raw)
+                    else:
+                        current['more_variants'] += 1
+        return self._most_requested(merged)
+
+    def top(self, limit=20, sort='variants'):
+        """The keys with the most distinct raw queries (or requests) in all workers, and totals over all keys"""
+        with self.lock:
+            self._check_reset_locked()
+            self.store.flush(self._snapshot)
+        rows = [{
+            'key': key,
+            'requests': entry['requests'],
+            'variants': len(entry['variants']) + entry['more_variants'],
+            'examples': sorted(entry['variants'])[:5]
+        } for key, entry in self._merged().items()]
+        rows.sort(key=lambda row: (row[sort], row['requests']), reverse=True)
+        variants = sum(row['variants'] for row in rows)
+        return {
+            'keys': len(rows),
+            'raw_queries': variants,
+            'requests': sum(row['requests'] for row in rows),
+            # Distinct raw queries per key: how many cache entries and USDA calls one key now saves
+            'variants_per_key': round(variants / len(rows), 2) if rows else 0,
+            'top': rows[:limit]
+        }
+
+    def reset(self):
+        """Forget all counts; other processes notice the RESET marker on their next record"""
+        with self.lock:
+            self.keys = {}
+            self.store.reset()
@@ -0,0 +1,132 @@
+"""Per-serving nutrients computed from a food's per-100 g values.
+
+`POST /api/meals` can take just `fdc_id`, `serving_size` and `serving_unit`.
+The server then scales the food's per-100 g nutrients (the `foods` table,
+filled from `/api/food` payloads) by the serving's weight in grams. A serving
+unit is converted to grams in one of three ways:
+
+- a mass unit (g, kg, mg, oz, lb), which works for every food;
+- the food's own portions, e.g. "cup, chopped" or "slice" from USDA
+  `foodPortions`, or "serving" from a branded food's serving size;
+- a volume unit (ml, l, cup, tbsp, tsp, fl oz), derived from the density of
+  any volume portion the food has.
+
+`portion_table()` turns a USDA food into `{unit: grams per unit}` once, when
+the food is fetched. Mass units aren't stored there, since they never depend
+on the food.
+"""
+import re
+
+GRAMS_PER_UNIT = {'g': 1.0, 'kg': 1000.0, 'mg': 0.001, 'oz': 28.3495, 'lb': 453.592}
+ML_PER_UNIT = {'ml': 1.0, 'l': 1000.0, 'cup': 236.588, 'tbsp': 14.787, 'tsp': 4.929, 'fl oz': 29.574}
+
+UNIT_ALIASES = {
+    'gram': 'g', 'grams': 'g', 'gm': 'g', 'kilogram': 'kg', 'kilograms': 'kg', 'milligram': 'mg',
+    'milligrams': 'mg', 'ounce': 'oz', 'ounces': 'oz', 'pound': 'lb', 'pounds': 'lb', 'lbs': 'lb',
+    'milliliter': 'ml', 'milliliters': 'ml', 'millilitre': 'ml', 'millilitres': 'ml', 'liter': 'l',
+    'liters': 'l', 'litre': 'l', 'litres': 'l', 'cups': 'cup', 'tablespoon': 'tbsp', 'tablespoons': 'tbsp',
+    'tbs': 'tbsp', 'teaspoon': 'tsp', 'teaspoons': 'tsp', 'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz',
+    'floz': 'fl oz', 'servings': 'serving',
+}
+
+# Nutrients stored per 100 g besides the macros: (name prefix, unit), as in MealLogModal
+EXTRA_NUTRIENTS = {'sodium': ('sodium', 'mg'), 'sugar': ('sugars, total', 'g')}
+# Names of total fat in FoodData Central; payloads cached before nutrients.py stopped classifying
+# "Fatty acids, total saturated" as fat can hold saturated fat under 'fat'
+TOTAL_FAT_NAMES = ('total lipid (fat)', 'total fat (nlea)')
+
+
+def normalize_unit(unit):
+    """Lowercased unit with aliases and plurals resolved, e.g. 'Cups' -> 'cup'"""
+    unit = ' '.join(str(unit or '').lower().replace('.', ' ').split())
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def portion_table(food):
+    """{unit: grams per unit} from a USDA /food response (foodPortions and servingSize)"""
+    portions = {}
+    for portion in food.get('foodPortions') or []:
+        grams = portion.get('gramWeight')
+        amount = portion.get('amount') or portion.get('value') or 1
+        if not grams:
+            continue
+        measure = (portion.get('measureUnit') or {}).get('name') or ''
+        if measure and measure != 'undetermined':
+            names = [measure]
+        else:
+            # SR Legacy often keeps the unit in the modifier ("cup, chopped or diced") or the description ("1 cup")
+            names = [portion.get('modifier') or '', portion.get('portionDescription') or '']
+        for name in names:
+            name = re.sub(r'^[\d./\s]+', '', re.split(r'[,(]', name)[0])
+            unit = normalize_unit(name)
+            if unit and unit not in GRAMS_PER_UNIT:
+                portions.setdefault(unit, grams / amount)
+    serving_unit = normalize_unit(food.get('servingSizeUnit'))
+    if food.get('servingSize') and serving_unit in GRAMS_PER_UNIT:
+        portions.setdefault('serving', food['servingSize'] * GRAMS_PER_UNIT[serving_unit])
+
+    # Any volume portion gives the food's density, and with it every other volume unit
+    volume = next((unit for unit in portions if unit in ML_PER_UNIT), None)
+    if volume is None and food.get('servingSize') and serving_unit in ML_PER_UNIT:
+        portions.setdefault('ml', 1.0)  # Branded drinks: label values are per 100 ml
+        volume = 'ml'
+    if volume is not None:
+        grams_per_ml = portions[volume] / ML_PER_UNIT[volume]
+        for unit, ml in ML_PER_UNIT.items():
+            portions.setdefault(unit, round(grams_per_ml * ml, 3))
+    return portions
+
+
+def per_100g(nutrition_data):
+    """{calories, protein, carbs, fat, sodium, sugar} per 100 g from an /api/food payload;
+    a nutrient the food doesn't list is None"""
+    macros = nutrition_data.get('macronutrients') or {}
+    calories = (macros.get('calories') or {}).get('amount')
+    if calories is not None and (macros['calories'].get('unit') or '').lower() == 'kj':
+        calories = calories / 4.184
+    values = {'calories': calories}
+    for key, macro in (('protein', 'protein'), ('carbs', 'carbohydrates')):
+        values[key] = (macros.get(macro) or {}).get('amount')
+    fat = macros.get('fat') or {}
+    values['fat'] = fat.get('amount') if (fat.get('name') or '').lower() in TOTAL_FAT_NAMES else None
+    for key, (prefix, unit) in EXTRA_NUTRIENTS.items():
+        values[key] = None
+        for group in ('micronutrients', 'otherNutrients'):
+            match = next((n for n in (nutrition_data.get(group) or {}).values()
+                          if (n.get('name') or '').lower().startswith(prefix)), None)
+            if match is not None:
+                if (match.get('unit') or '').lower() == unit:
+                    values[key] = match.get('amount')
+                break
+    return values
+
+
+def serving_grams(portions, serving_size, serving_unit):
+    """Weight in grams of serving_size serving_units; ValueError for a unit the food has no conversion for"""
+    try:
+        size = float(serving_size)
+    except (TypeError, ValueError):
+        raise ValueError('serving_size must be a number')
+    if size <= 0:
+        raise ValueError('serving_size must be positive')
+    unit = normalize_unit(serving_unit or 'g')
+    if unit in GRAMS_PER_UNIT:
+        return size * GRAMS_PER_UNIT[unit]
+    portions = portions or {}
+    for other in (unit[:-1] if unit.endswith('s') else None, unit + 's'):
+        if unit not in portions and other in portions:
+            unit = other
+    if unit not in portions:
+        units = ', '.join(list(GRAMS_PER_UNIT) + sorted(portions))
+        raise ValueError(f"Unknown serving unit '{serving_unit}' for this food (use one of: {units})")
+    return size * portions[unit]
+
+
+def serving_nutrients(food, serving_size, serving_unit):
+    """calories/protein/carbs/fat/sodium/sugar for one serving of a food (a foods.get() row);
+    a nutrient the food doesn't list is None. ValueError when it has no calories to log."""
+    scale = serving_grams(food.get('portions'), serving_size, serving_unit) / 100
+    if food.get('calories') is None:
+        raise ValueError(f"No calorie data for food {food.get('fdc_id')}; send calories with the meal")
+    return {key: None if food.get(key) is None else round(food[key] * scale, 2) for key in
+            ('calories', 'protein', 'carbs', 'fat') + tuple(EXTRA_NUTRIENTS)}
@@ -0,0 +1,124 @@
+"""Slow-query log for the SQLite statements run through `db_execute`.
+
+Statements slower than SLOW_QUERY_MS are logged together with their
+`EXPLAIN QUERY PLAN` output and the shapes (types) of their bound parameters,
+and folded into per-statement aggregates (count, total/max time, last plan).
+
+Each process keeps its own aggregates and periodically writes them to
+`<SLOW_QUERY_DIR>/<pid>.json` (see per_pid_store.py); `top()` merges the files
+of all processes so the admin endpoint sees every gunicorn worker, not just the
+one serving it.
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from per_pid_store import PerPidStore
+
+logger = logging.getLogger('nutrivault.slow_queries')
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 25))
+SLOW_QUERY_DIR = os.getenv('SLOW_QUERY_DIR', os.path.join(tempfile.gettempdir(), 'nutrivault-slow-queries'))
+MAX_TRACKED_STATEMENTS = 500
+
+
+def normalize_sql(sql):
+    """Collapse whitespace and inline numbers so formatted variants share one entry"""
+    return re.sub(r'\b\d+\b', 'N', ' '.join(sql.split()))
+
+
+def param_shape(params):
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def explain(connection, sql, params):
+    try:
+        return [row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+    except Exception as e:  # the plan is diagnostic only; never fail the real query
+        return [f'(explain failed: {e})']
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, storage_dir=SLOW_QUERY_DIR):
+        self.threshold = threshold_ms / 1000.0
+        self.store = PerPidStore(storage_dir)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, label, sql, params, seconds, connection):
+        """Called for every statement; cheap unless the statement was slow"""
+        if seconds < self.threshold:
+            return
+        normalized = normalize_sql(sql)
+        key = f'{label}|{normalized}'
+        plan = explain(connection, sql, params)
+        shape = param_shape(params)
+        logger.warning('Slow query %s took %.1f ms: %s params=%s plan=%s',
+                       label, seconds * 1000, normalized, shape, ' | '.join(plan))
+
+        with self.lock:
+            self._check_reset_locked()
+            entry = self.stats.get(key)
+            if entry is None:
+                if len(self.stats) >= MAX_TRACKED_STATEMENTS:
+                    return
+                entry = self.stats[key] = {
+                    'label': label, 'sql': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                }
+            elapsed_ms = seconds * 1000
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['last_seen'] = time.time()
+            entry['param_shape'] = shape
+            entry['plan'] = plan
+            entry['full_scan'] = any(line.startswith('SCAN ') for line in plan)
+            self.store.changed(self._snapshot)
+
+    def _snapshot(self):
+        return list(self.stats.values())
+
+    def _check_reset_locked(self):
+        """Drop aggregates collected before another process called reset()"""
+        if self.store.check_reset():
+            self.stats.clear()
+
+    def top(self, limit=20, sort='total_ms'):
+        """Merged aggregates of all processes, highest `sort` first"""
+        with self.lock:
+            self._check_reset_locked()
+            self.store.flush(self._snapshot)
+        merged = {}
+        for entries in self.store.snapshots():
+            for entry in entries:
+                key = f"{entry['label']}|{entry['sql']}"
+                current = merged.get(key)
+                if current is None:
+                    merged[key] = dict(entry)
+                    continue
+                current['count'] += entry['count']
+                current['total_ms'] += entry['total_ms']
+                current['max_ms'] = max(current['max_ms'], entry['max_ms'])
+                if entry.get('last_seen', 0) > current.get('last_seen', 0):
+                    for field in ('last_seen', 'param_shape', 'plan', 'full_scan'):
+                        current[field] = entry.get(field)
+
+        results = sorted(merged.values(), key=lambda e: e.get(sort, 0), reverse=True)[:limit]
+        for entry in results:
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['max_ms'] = round(entry['max_ms'], 3)
+            entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 3) if entry['count'] else 0
+        return results
+
+    def reset(self):
+        """Forget all aggregates; other processes notice the RESET marker on their next write"""
+        with self.lock:
+            self.stats.clear()
+            self.store.reset()
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,1864 @@
+"""Storage layer: repositories for users, goals, meals, saved meals, alerts, history,
+foods, events and idempotency keys.
+
+Handlers in app.py open a session on the app's storage and only talk to its
+repositories; no SQL lives outside this module.
+
+    with current_app.extensions['storage'].session() as db:
+        user_id = db.users.get_id(firebase_uid)
+        meal_id = db.meals.add(user_id, meal)
+
+A session is one transaction: it commits when the block exits normally and
+rolls back when it raises. `session(immediate=True)` takes the write lock when
+it opens, for sessions that read and then write. `db.savepoint()` nests a block that can fail on
+its own without undoing the rest of the session. Rows come back as dicts keyed by column name.
+Don't open a session inside another one on the same thread.
+
+- `SQLiteStorage`: every statement names its columns and runs through
+  `db_execute` (metrics and slow-query log), the storage-level scans, outbox
+  polls and archive moves included; only schema DDL and BEGIN don't. Each thread keeps one connection,
+  so sqlite3's per-connection statement cache keeps statements prepared across
+  requests and the schema is parsed once per thread instead of per request.
+- `ShardedStorage`: the same SQLite repositories over a directory database
+  (users, foods) and N shard files holding everything per user, so writes for
+  different users mostly take different write locks.
+- `MemoryStorage`: plain dicts behind one lock, for tests and benchmarks that
+  shouldn't touch the disk. It returns the same results as SQLite, but writes
+  made before an exception are not undone.
+"""
+import bisect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone
+
+import metrics
+import servings
+from events import PRUNE_EVERY, RETENTION_SECONDS
+from profiling import phase
+from slow_query_log import slow_query_log
+
+HISTORY_SLOTS = 50  # Search history entries kept per user
+BUSY_TIMEOUT = 5.0  # Seconds a statement waits for another connection's lock before 'database is locked'
+INCREMENTAL_VACUUM = 2  # PRAGMA auto_vacuum value for INCREMENTAL
+ANONYMOUS_HISTORY_USER = 0  # History owner for requests without a token
+MACROS = ('calories', 'protein', 'carbs', 'fat')
+INTAKE_COLUMNS = MACROS + ('sodium', 'sugar')
+PROFILE_FIELDS = ('age', 'weight', 'height', 'activity_level', 'dietary_goal')
+GOAL_FIELDS = ('goal_type', 'target_calories', 'target_protein', 'target_carbs', 'target_fat',
+               'current_weight', 'target_weight', 'activity_level')
+MEAL_FIELDS = ('fdc_id', 'food_name', 'serving_size', 'serving_unit', 'calories', 'protein', 'carbs', 'fat',
+               'meal_type', 'logged_date', 'sodium', 'sugar')
+REQUIRED_MEAL_FIELDS = ('fdc_id', 'food_name', 'serving_size', 'serving_unit', 'calories', 'logged_date')
+MEAL_LIST_COLUMNS = ('id, fdc_id, food_name, serving_size, serving_unit, calories, protein, carbs, fat, '
+                     'meal_type, logged_date, logged_at')
+ARCHIVED_MEAL_COLUMNS = ('id, user_id, fdc_id, food_name, serving_size, serving_unit, calories, protein, carbs, fat, '
+                         'meal_type, logged_date, logged_at, sodium, sugar, change_seq')
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was stored by a concurrent request first"""
+
+
+def db_execute(cursor, label, sql, params=()):
+    """Execute one SQL statement, recording its duration under label in /metrics
+    and in the slow-query log when it exceeds SLOW_QUERY_MS"""
+    start = time.perf_counter()
+    try:
+        with phase('sql'):
+            return cursor.execute(sql, params)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe_query(label, elapsed)
+        slow_query_log.record(label, sql, params, elapsed, cursor.connection)
+
+
+def _loads(text):
+    return json.loads(text) if text else None
+
+
+def union_meals(tables, columns, where):
+    """SELECT columns ... WHERE where over meal_logs and archive tables, joined with UNION ALL
+    (the caller repeats the parameters once per table)"""
+    return '\nUNION ALL\n'.join(f'SELECT {columns} FROM {table} WHERE {where}' for table in tables)
+
+
+def page_changes(meals, deleted, since, limit):
+    """Merge meal and tombstone rows (each sorted by change_seq) into one page of at most
+    limit changes; returns (meals, deleted, cursor, has_more)"""
+    merged = sorted([(meal['change_seq'], 'meal', meal) for meal in meals] +
+                    [(tombstone['change_seq'], 'deleted', tombstone) for tombstone in deleted], key=lambda c: c[0])
+    page = merged[:limit]
+    return ([row for _, kind, row in page if kind == 'meal'],
+            [row for _, kind, row in page if kind == 'deleted'],
+            page[-1][0] if page else since,
+            len(merged) > limit)
+
+
+# --- SQLite ---------------------------------------------------------------
+
+class SQLiteRepository:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, label, sql, params=()):
+        return db_execute(self.cursor, label, sql, params)
+
+    def one(self, label, sql, params=()):
+        row = self.execute(label, sql, params).fetchone()
+        return dict(row) if row is not None else None
+
+    def all(self, label, sql, params=()):
+        return [dict(row) for row in self.execute(label, sql, params).fetchall()]
+
+
+class SQLiteUsers(SQLiteRepository):
+    def get(self, firebase_uid):
+        return self.one('select_user', '''
+            SELECT id, firebase_uid, email, age, weight, height, activity_level, dietary_goal,
+                   created_at, updated_at, stats_version
+            FROM users WHERE firebase_uid = ?
+        ''', (firebase_uid,))
+
+    def get_id(self, firebase_uid):
+        row = self.execute('select_user_id', 'SELECT id FROM users WHERE firebase_uid = ?', (firebase_uid,)).fetchone()
+        return row[0] if row else None
+
+    def login(self, firebase_uid, email):
+        """Create the user on first sign-in, otherwise refresh email and updated_at; returns the id"""
+        user_id = self.get_id(firebase_uid)
+        if user_id is not None:
+            self.execute('update_user_login', 'UPDATE users SET updated_at = CURRENT_TIMESTAMP, email = ? WHERE id = ?',
+                         (email, user_id))
+            return user_id
+        self.execute('insert_user', 'INSERT INTO users (firebase_uid, email, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
+                     (firebase_uid, email))
+        return self.cursor.lastrowid
+
+    def update_profile(self, user_id, profile):
+        self.execute('update_user_profile', '''
+            UPDATE users
+            SET age = ?,
+                weight = ?,
+                height = ?,
+                activity_level = ?,
+                dietary_goal = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', tuple(profile.get(field) for field in PROFILE_FIELDS) + (user_id,))
+
+    def bump_stats_version(self, user_id):
+        """Invalidate the user's cached analytics in every worker"""
+        self.execute('bump_stats_version', 'UPDATE users SET stats_version = stats_version + 1 WHERE id = ?', (user_id,))
+
+
+class SQLiteGoals(SQLiteRepository):
+    def latest(self, user_id):
+        return self.one('select_latest_goals', '''
+            SELECT goal_type, target_calories, target_protein, target_carbs, target_fat,
+                   current_weight, target_weight, activity_level, created_at
+            FROM dietary_goals
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (user_id,))
+
+    def add(self, user_id, goals):
+        self.execute('insert_goals', '''
+            INSERT INTO dietary_goals (
+                user_id, goal_type, target_calories, target_protein,
+                target_carbs, target_fat, current_weight, target_weight, activity_level
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id,) + tuple(goals.get(field) for field in GOAL_FIELDS))
+
+
+class SQLiteMeals(SQLiteRepository):
+    def add(self, user_id, meal):
+        """Insert a meal and add it to the user's running totals for its day; returns the meal id"""
+        self.execute('insert_meal', '''
+            INSERT INTO meal_logs (
+                user_id, fdc_id, food_name, serving_size, serving_unit,
+                calories, protein, carbs, fat, meal_type, logged_date, sodium, sugar, change_seq
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id,) + tuple(meal.get(field) for field in MEAL_FIELDS) + (self.next_change_seq(user_id),))
+        meal_id = self.cursor.lastrowid
+        self.add_to_totals(user_id, meal, 1)
+        return meal_id
+
+    def get(self, user_id, meal_id):
+        """One of the user's meals with every stored field, or None"""
+        return self.one('select_meal', '''
+            SELECT id, fdc_id, food_name, serving_size, serving_unit, calories, protein, carbs, fat,
+                   meal_type, logged_date, logged_at, sodium, sugar
+            FROM meal_logs
+            WHERE id = ? AND user_id = ?
+        ''', (meal_id, user_id))
+
+    def update(self, user_id, meal_id, changes):
+        """Apply changes (any MEAL_FIELDS) to a meal and move its amounts between the day
+        totals; returns (old, new) meal rows, or None if the user has no such meal.
+        Call it in a session(immediate=True), so no other writer changes the meal in between."""
+        old = self.get(user_id, meal_id)
+        if old is None and not self.restore(user_id, meal_id):
+            return None
+        old = old or self.get(user_id, meal_id)
+        new = {**old, **{field: changes[field] for field in MEAL_FIELDS if field in changes}}
+        self.execute('update_meal', '''
+            UPDATE meal_logs
+            SET fdc_id = ?, food_name = ?, serving_size = ?, serving_unit = ?, calories = ?, protein = ?,
+                carbs = ?, fat = ?, meal_type = ?, logged_date = ?, sodium = ?, sugar = ?
+            WHERE id = ? AND user_id = ?
+        ''', tuple(new[field] for field in MEAL_FIELDS) + (meal_id, user_id))
+        if self.cursor.rowcount != 1:
+            # Deleted since get(); only possible outside session(immediate=True)
+            return None
+        self.execute('update_meal_change_seq', 'UPDATE meal_logs SET change_seq = ? WHERE id = ?',
+                     (self.next_change_seq(user_id), meal_id))
+        self.add_to_totals(user_id, old, -1)
+        self.add_to_totals(user_id, new, 1)
+        return old, self.get(user_id, meal_id)
+
+    def delete(self, user_id, meal_id):
+        """Delete a meal, take it out of its day's totals and leave a tombstone for
+        /api/meals/changes; returns the deleted row, or None if the user has no such meal.
+        Call it in a session(immediate=True), like update()."""
+        old = self.get(user_id, meal_id)
+        if old is None and not self.restore(user_id, meal_id):
+            return None
+        old = old or self.get(user_id, meal_id)
+        self.execute('delete_meal', 'DELETE FROM meal_logs WHERE id = ? AND user_id = ?', (meal_id, user_id))
+        if self.cursor.rowcount != 1:
+            return None
+        self.execute('insert_meal_tombstone', '''
+            INSERT OR REPLACE INTO meal_tombstones (user_id, meal_id, change_seq) VALUES (?, ?, ?)
+        ''', (user_id, meal_id, self.next_change_seq(user_id)))
+        self.add_to_totals(user_id, old, -1)
+        return old
+
+    def restore(self, user_id, meal_id):
+        """Move an archived meal back into meal_logs, so it can be edited or deleted like any
+        other (the archiver moves it out again if it is still old); True if one was found"""
+        for table in self.archive_tables(''):
+            self.execute('restore_archived_meal', f'''
+                INSERT INTO meal_logs ({ARCHIVED_MEAL_COLUMNS})
+                SELECT {ARCHIVED_MEAL_COLUMNS} FROM {table} WHERE id = ? AND user_id = ?
+            ''', (meal_id, user_id))
+            if self.cursor.rowcount == 1:
+                self.execute('delete_archived_meal', f'DELETE FROM {table} WHERE id = ?', (meal_id,))
+                return True
+        return False
+
+    def next_change_seq(self, user_id):
+        """Advance the user's change sequence. Writers hold SQLite's write lock until they
+        commit, so sequence numbers become visible in order and a cursor never skips one."""
+        self.execute('advance_meal_change_head', '''
+            INSERT INTO meal_change_heads (user_id, seq) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1
+        ''', (user_id,))
+        return self.execute('select_meal_change_head', 'SELECT seq FROM meal_change_heads WHERE user_id = ?',
+                            (user_id,)).fetchone()[0]
+
+    def add_to_totals(self, user_id, meal, sign):
+        """Add (sign=1) or remove (sign=-1) a meal's amounts in its day's running totals"""
+        amounts = tuple(sign * float(meal.get(key) or 0) for key in INTAKE_COLUMNS)
+        self.execute('upsert_daily_totals', '''
+            INSERT INTO daily_totals (user_id, logged_date, calories, protein, carbs, fat, sodium, sugar, meal_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, logged_date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbs = carbs + excluded.carbs,
+                fat = fat + excluded.fat,
+                sodium = sodium + excluded.sodium,
+                sugar = sugar + excluded.sugar,
+                meal_count = meal_count + excluded.meal_count
+        ''', (user_id, meal.get('logged_date')) + amounts + (sign,))
+
+    def changes(self, user_id, since, limit):
+        """Meals written and ids deleted after change_seq `since`, in sequence order, at most
+        limit in all; returns (meals, deleted, cursor, has_more)"""
+        tables = ['meal_logs']
+        head = self.one('select_meal_archived_seq', 'SELECT archived_seq FROM meal_change_heads WHERE user_id = ?', (user_id,))
+        if head and since < head['archived_seq']:
+            # The cursor predates meals that have since been archived
+            tables += self.archive_tables('')
+        meals = self.all('select_meal_changes', union_meals(tables, MEAL_LIST_COLUMNS + ', change_seq',
+                                                            'user_id = ? AND change_seq > ?') + '''
+            ORDER BY change_seq
+            LIMIT ?
+        ''', (user_id, since) * len(tables) + (limit + 1,))
+        deleted = self.all('select_meal_tombstones', '''
+            SELECT meal_id AS id, change_seq FROM meal_tombstones
+            WHERE user_id = ? AND change_seq > ?
+            ORDER BY change_seq
+            LIMIT ?
+        ''', (user_id, since, limit + 1))
+        return page_changes(meals, deleted, since, limit)
+
+    def list(self, user_id, date_filter=None, days=7):
+        """Meals on date_filter, or over the last `days` days, newest first
+        (archive tables are only read when the range reaches into them)"""
+        if date_filter:
+            month = str(date_filter)[:7]
+            tables = ['meal_logs'] + self.archive_tables(month, month)
+            return self.all('select_meals_by_date', union_meals(tables, MEAL_LIST_COLUMNS, 'user_id = ? AND logged_date = ?') + '''
+                ORDER BY logged_at DESC, id DESC
+            ''', (user_id, date_filter) * len(tables))
+        tables = ['meal_logs'] + self.archive_tables(_days_ago(days)[:7])
+        return self.all('select_meals_recent', union_meals(tables, MEAL_LIST_COLUMNS, "user_id = ? AND logged_date >= date('now', ?)") + '''
+            ORDER BY logged_date DESC, logged_at DESC, id DESC
+        ''', (user_id, f'-{int(days)} days') * len(tables))
+
+    def archive_tables(self, first_month, last_month='9999-99'):
+        """Archive tables holding months first_month..last_month ('YYYY-MM'), oldest first"""
+        rows = self.execute('select_meal_archives', '''
+            SELECT table_name FROM meal_log_archives
+            WHERE month BETWEEN ? AND ?
+            ORDER BY month
+        ''', (first_month, last_month)).fetchall()
+        return [row[0] for row in rows]
+
+    def day_totals(self, user_id, logged_date):
+        """Running totals for one day (zeros when nothing was logged)"""
+        row = self.one('select_daily_totals', '''
+            SELECT calories, protein, carbs, fat, sodium, sugar, meal_count FROM daily_totals
+            WHERE user_id = ? AND logged_date = ?
+        ''', (user_id, logged_date))
+        return row or dict.fromkeys(INTAKE_COLUMNS + ('meal_count',), 0)
+
+    def fdc_ids_on(self, user_id, logged_date):
+        month = str(logged_date)[:7]
+        tables = ['meal_logs'] + self.archive_tables(month, month)
+        rows = self.execute('select_logged_fdc_ids', union_meals(tables, 'fdc_id', 'user_id = ? AND logged_date = ?'),
+                            (user_id, logged_date) * len(tables)).fetchall()
+        return list({row[0] for row in rows})
+
+    def trend_rows(self, user_id, today, days, windows, tolerance):
+        """One row per calendar day for the `days` days up to today: the day's totals
+        (None when nothing was logged), the calorie target in effect, whether the day
+        was logged/adherent, {macro}_{n}d averages and adherent_/logged_{n}d counts
+        over each trailing window n, and the adherence/logging streaks ending that day"""
+        window_columns = ',\n                '.join(
+            f'AVG({macro}) OVER w{n} AS {macro}_{n}d' for n in windows for macro in MACROS)
+        window_counts = ',\n                '.join(
+            f'SUM(adherent) OVER w{n} AS adherent_{n}d, SUM(logged) OVER w{n} AS logged_{n}d' for n in windows)
+        window_defs = ',\n                   '.join(
+            f'w{n} AS (ORDER BY day ROWS BETWEEN {n - 1} PRECEDING AND CURRENT ROW)' for n in windows)
+        return self.all('select_trends', f'''
+            WITH RECURSIVE days(day) AS (
+                SELECT date(:today, :history_start)
+                UNION ALL
+                SELECT date(day, '+1 day') FROM days WHERE day < :today
+            ),
+            daily AS (
+                SELECT d.day,
+                       COALESCE(t.meal_count, 0) AS meal_count,
+                       CASE WHEN t.meal_count > 0 THEN t.calories END AS calories,
+                       CASE WHEN t.meal_count > 0 THEN t.protein END AS protein,
+                       CASE WHEN t.meal_count > 0 THEN t.carbs END AS carbs,
+                       CASE WHEN t.meal_count > 0 THEN t.fat END AS fat,
+                       g.target_calories
+                FROM days d
+                LEFT JOIN daily_totals t ON t.user_id = :user_id AND t.logged_date = d.day
+                -- Goal in effect that day; days before the first goal use the first goal
+                LEFT JOIN dietary_goals g ON g.id = COALESCE((
+                    SELECT id FROM dietary_goals
+                    WHERE user_id = :user_id AND created_at < date(d.day, '+1 day')
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                ), (
+                    SELECT id FROM dietary_goals
+                    WHERE user_id = :user_id
+                    ORDER BY created_at
+                    LIMIT 1
+                ))
+            ),
+            scored AS (
+                SELECT *,
+                       meal_count > 0 AS logged,
+                       COALESCE(meal_count > 0 AND target_calories > 0
+                                AND ABS(calories - target_calories) <= target_calories * :tolerance, 0) AS adherent
+                FROM daily
+            ),
+            runs AS (
+                SELECT *,
+                {window_columns},
+                {window_counts},
+                ROW_NUMBER() OVER (ORDER BY day) - SUM(adherent) OVER (ORDER BY day ROWS UNBOUNDED PRECEDING) AS adherent_run,
+                ROW_NUMBER() OVER (ORDER BY day) - SUM(logged) OVER (ORDER BY day ROWS UNBOUNDED PRECEDING) AS logged_run
+                FROM scored
+                WINDOW {window_defs}
+            )
+            SELECT *,
+                   CASE WHEN adherent THEN ROW_NUMBER() OVER (PARTITION BY adherent, adherent_run ORDER BY day) ELSE 0 END AS adherence_streak,
+                   CASE WHEN logged THEN ROW_NUMBER() OVER (PARTITION BY logged, logged_run ORDER BY day) ELSE 0 END AS logging_streak
+            FROM runs
+            ORDER BY day
+        ''', {'today': today, 'history_start': f'-{days - 1} days', 'user_id': user_id, 'tolerance': tolerance})
+
+
+class SQLiteAlerts(SQLiteRepository):
+    def add(self, user_id, logged_date, nutrient, amount, threshold, unit):
+        """Record that a limit was crossed; False if that day already has this alert"""
+        self.execute('insert_intake_alert', '''
+            INSERT OR IGNORE INTO intake_alerts (user_id, logged_date, nutrient, amount, threshold, unit)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, logged_date, nutrient, amount, threshold, unit))
+        return self.cursor.rowcount == 1
+
+    def recent(self, user_id, days=7):
+        """Alerts from the last `days` days with the day's current total of the nutrient (day_total)"""
+        return self.all('select_intake_alerts', '''
+            SELECT a.logged_date AS date, a.nutrient, a.amount, a.threshold, a.unit, a.created_at,
+                   CASE a.nutrient WHEN 'calories' THEN t.calories WHEN 'sodium' THEN t.sodium ELSE t.sugar END AS day_total
+            FROM intake_alerts a
+            LEFT JOIN daily_totals t ON t.user_id = a.user_id AND t.logged_date = a.logged_date
+            WHERE a.user_id = ? AND a.logged_date >= date('now', ?)
+            ORDER BY a.logged_date DESC, a.created_at DESC, a.id DESC
+        ''', (user_id, f'-{int(days)} days'))
+
+    def clear_resolved(self, user_id, logged_date):
+        """Drop the day's alerts whose nutrient is back under its threshold (after a meal was edited or deleted)"""
+        self.execute('delete_resolved_intake_alerts', '''
+            DELETE FROM intake_alerts
+            WHERE user_id = ? AND logged_date = ? AND threshold > COALESCE((
+                SELECT CASE intake_alerts.nutrient WHEN 'calories' THEN t.calories WHEN 'sodium' THEN t.sodium ELSE t.sugar END
+                FROM daily_totals t
+                WHERE t.user_id = intake_alerts.user_id AND t.logged_date = intake_alerts.logged_date
+            ), 0)
+        ''', (user_id, logged_date))
+
+
+class SQLiteHistory(SQLiteRepository):
+    def recent(self, user_id, limit):
+        # Bounded by HISTORY_SLOTS rows via the (user_id, slot) primary key
+        rows = self.all('select_history', '''
+            SELECT fdc_id, food_name, searched_at, nutrition_data
+            FROM history_slots
+            WHERE user_id = ?
+            ORDER BY seq DESC
+            LIMIT ?
+        ''', (user_id, limit))
+        for row in rows:
+            row['nutrition_data'] = _loads(row['nutrition_data'])
+        return rows
+
+    def add(self, user_id, fdc_id, food_name, nutrition_data):
+        """Write an entry into the user's ring; False if the food was already added in the last day"""
+        # Only this user's slots are scanned
+        recent = self.execute('select_recent_history_item', '''
+            SELECT 1 FROM history_slots
+            WHERE user_id = ? AND fdc_id = ? AND searched_at > datetime('now', '-1 day')
+        ''', (user_id, str(fdc_id))).fetchone()
+        if recent:
+            return False
+
+        # Advance the ring head first so concurrent writers get distinct slots
+        self.execute('advance_history_head', '''
+            INSERT INTO history_heads (user_id, seq) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET seq = seq + 1
+        ''', (user_id,))
+        seq = self.execute('select_history_head', 'SELECT seq FROM history_heads WHERE user_id = ?',
+                           (user_id,)).fetchone()[0] - 1
+
+        # Overwrite the oldest slot in place
+        self.execute('upsert_history_slot', '''
+            INSERT INTO history_slots (user_id, slot, seq, fdc_id, food_name, nutrition_data)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, slot) DO UPDATE SET
+                seq = excluded.seq,
+                fdc_id = excluded.fdc_id,
+                food_name = excluded.food_name,
+                searched_at = CURRENT_TIMESTAMP,
+                nutrition_data = excluded.nutrition_data
+        ''', (user_id, seq % HISTORY_SLOTS, seq, str(fdc_id), food_name, json.dumps(nutrition_data)))
+        return True
+
+
+class SQLiteFoods(SQLiteRepository):
+    def save(self, nutrition_data):
+        """Insert or refresh one food (an /api/food payload) in the foods table"""
+        values = servings.per_100g(nutrition_data)
+        portions = nutrition_data.get('portions')
+        self.execute('upsert_food', '''
+            INSERT INTO foods (fdc_id, description, data_type, calories, protein, carbs, fat, sodium, sugar, portions)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(fdc_id) DO UPDATE SET
+                description = excluded.description,
+                data_type = excluded.data_type,
+                calories = excluded.calories,
+                protein = excluded.protein,
+                carbs = excluded.carbs,
+                fat = excluded.fat,
+                sodium = excluded.sodium,
+                sugar = excluded.sugar,
+                portions = COALESCE(excluded.portions, foods.portions),
+                updated_at = CURRENT_TIMESTAMP
+        ''', (str(nutrition_data['fdcId']), nutrition_data.get('description') or '', nutrition_data.get('dataType'))
+            + tuple(values[key] for key in INTAKE_COLUMNS) + (json.dumps(portions) if portions is not None else None,))
+
+    def get(self, fdc_id):
+        """One food's description and nutrients per 100 g, with portions as {unit: grams}
+        (None for rows saved before portions were stored)"""
+        food = self.one('get_food', '''
+            SELECT fdc_id, description, calories, protein, carbs, fat, sodium, sugar, portions
+            FROM foods WHERE fdc_id = ?
+        ''', (str(fdc_id),))
+        if food is not None:
+            food['portions'] = _loads(food['portions'])
+        return food
+
+
+class SQLiteEvents(SQLiteRepository):
+    def publish(self, user_id, event_type, data):
+        """Queue a /api/stream event; it becomes visible when the session commits"""
+        now = time.time()
+        self.execute('insert_event', '''
+            INSERT INTO event_outbox (user_id, event_type, payload, created_at) VALUES (?, ?, ?, ?)
+        ''', (user_id, event_type, json.dumps(data), now))
+        if self.cursor.lastrowid % PRUNE_EVERY == 0:
+            self.execute('prune_events', 'DELETE FROM event_outbox WHERE created_at < ?', (now - RETENTION_SECONDS,))
+
+
+class SQLiteIdempotency(SQLiteRepository):
+    def get(self, user_id, key, ttl):
+        """The stored request_hash and response for a key used in the last ttl seconds, or None"""
+        row = self.one('select_idempotency_key', '''
+            SELECT request_hash, response FROM idempotency_keys
+            WHERE user_id = ? AND idempotency_key = ? AND created_at >= ?
+        ''', (user_id, key, time.time() - ttl))
+        return {'request_hash': row['request_hash'], 'response': json.loads(row['response'])} if row else None
+
+    def add(self, user_id, key, request_hash, response, ttl):
+        """Remember the response for a key; raises IdempotencyConflict if the key is already in use"""
+        now = time.time()
+        # An expired row for the same key is taken over rather than conflicting
+        self.execute('upsert_idempotency_key', '''
+            INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash, response, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, idempotency_key) DO UPDATE SET
+                request_hash = excluded.request_hash,
+                response = excluded.response,
+                created_at = excluded.created_at
+            WHERE idempotency_keys.created_at < ?
+        ''', (user_id, key, request_hash, json.dumps(response), now, now - ttl))
+        if self.cursor.rowcount == 0:
+            raise IdempotencyConflict(key)
+        if self.cursor.lastrowid % PRUNE_EVERY == 0:
+            self.execute('prune_idempotency_keys', 'DELETE FROM idempotency_keys WHERE created_at < ?', (now - ttl,))
+
+
+class SQLiteSavedMeals(SQLiteRepository):
+    def add(self, user_id, name, components, totals):
+        """Store a saved meal: its components (meal fields each) and their summed nutrients; returns its id"""
+        self.execute('insert_saved_meal', '''
+            INSERT INTO saved_meals (user_id, name, components, calories, protein, carbs, fat, sodium, sugar)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, name, json.dumps(components)) + tuple(totals.get(key) for key in INTAKE_COLUMNS))
+        return self.cursor.lastrowid
+
+    def get(self, user_id, saved_meal_id):
+        saved = self.one('select_saved_meal', '''
+            SELECT id, name, components, calories, protein, carbs, fat, sodium, sugar, created_at
+            FROM saved_meals
+            WHERE id = ? AND user_id = ?
+        ''', (saved_meal_id, user_id))
+        if saved is not None:
+            saved['components'] = json.loads(saved['components'])
+        return saved
+
+    def list(self, user_id):
+        """The user's saved meals, newest first"""
+        saved_meals = self.all('select_saved_meals', '''
+            SELECT id, name, components, calories, protein, carbs, fat, sodium, sugar, created_at
+            FROM saved_meals
+            WHERE user_id = ?
+            ORDER BY id DESC
+        ''', (user_id,))
+        for saved in saved_meals:
+            saved['components'] = json.loads(saved['components'])
+        return saved_meals
+
+    def delete(self, user_id, saved_meal_id):
+        """Delete a saved meal; False if the user has no such saved meal. Meals logged from it stay."""
+        self.execute('delete_saved_meal', 'DELETE FROM saved_meals WHERE id = ? AND user_id = ?',
+                     (saved_meal_id, user_id))
+        return self.cursor.rowcount > 0
+
+
+class SQLiteSession:
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.users = SQLiteUsers(cursor)
+        self.goals = SQLiteGoals(cursor)
+        self.meals = SQLiteMeals(cursor)
+        self.saved_meals = SQLiteSavedMeals(cursor)
+        self.alerts = SQLiteAlerts(cursor)
+        self.history = SQLiteHistory(cursor)
+        self.foods = SQLiteFoods(cursor)
+        self.events = SQLiteEvents(cursor)
+        self.idempotency = SQLiteIdempotency(cursor)
+
+    @contextmanager
+    def savepoint(self):
+        """Nested transaction: an exception inside undoes only this block's writes"""
+        with sqlite_savepoint(self.cursor):
+            yield self
+
+
+@contextmanager
+def sqlite_savepoint(cursor):
+    if not cursor.connection.in_transaction:
+        # Otherwise the outermost RELEASE would commit
+        cursor.execute('BEGIN')
+    cursor.execute('SAVEPOINT session_write')
+    try:
+        yield
+    except BaseException:
+        cursor.execute('ROLLBACK TO session_write')
+        cursor.execute('RELEASE session_write')
+        raise
+    cursor.execute('RELEASE session_write')
+
+
+class SQLiteStorage:
+    """Repositories over the SQLite database at database_path"""
+
+    partitions = 1  # Independent write paths (see ShardedStorage)
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.local = threading.local()
+
+    def partition(self, user_id):
+        return 0
+
+    def connection(self):
+        # One connection per thread; a forked worker never reuses its parent's
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.database_path, timeout=BUSY_TIMEOUT)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def session(self, immediate=False):
+        conn = self.connection()
+        try:
+            if immediate:
+                # A deferred transaction that reads first fails with SQLITE_BUSY, without waiting,
+                # when another connection is upgrading to a write lock at the same time
+                conn.execute('BEGIN IMMEDIATE')
+            yield SQLiteSession(conn.cursor())
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def food_rows(self):
+        """All foods as (fdc_id, description, calories, protein, carbs, fat) rows"""
+        rows = db_execute(self.connection().cursor(), 'select_food_rows',
+                          'SELECT fdc_id, description, calories, protein, carbs, fat FROM foods').fetchall()
+        return [tuple(row) for row in rows]
+
+    def popular_foods(self, recent_meals):
+        """(food_name, fdc_id, count) for foods in the newest recent_meals meal_logs rows
+        (a rowid range, not a full scan) and in the history rings"""
+        rows = db_execute(self.connection().cursor(), 'select_popular_foods', '''
+            SELECT food_name, fdc_id, COUNT(*) FROM meal_logs
+            WHERE id > (SELECT COALESCE(MAX(id), 0) FROM meal_logs) - ?
+            GROUP BY fdc_id
+            UNION ALL
+            SELECT food_name, fdc_id, COUNT(*) FROM history_slots
+            GROUP BY fdc_id
+        ''', (recent_meals,)).fetchall()
+        return [tuple(row) for row in rows]
+
+    def history_payloads(self, fdc_ids):
+        """(fdc_id, /api/food payload) stored with history entries for these foods, oldest first"""
+        cursor = self.connection().cursor()
+        payloads = []
+        for i in range(0, len(fdc_ids), 500):
+            batch = fdc_ids[i:i + 500]
+            rows = db_execute(cursor, 'select_history_payloads', '''
+                SELECT fdc_id, nutrition_data FROM history_slots
+                WHERE fdc_id IN ({}) AND nutrition_data IS NOT NULL
+                ORDER BY seq
+            '''.format(','.join('?' * len(batch))), batch).fetchall()
+            for fdc_id, nutrition_data in rows:
+                try:
+                    payloads.append((fdc_id, json.loads(nutrition_data)))
+                except ValueError:
+                    continue
+        return payloads
+
+    def last_event_id(self):
+        return db_execute(self.connection().cursor(), 'select_last_event_id',
+                          'SELECT COALESCE(MAX(id), 0) FROM event_outbox').fetchone()[0]
+
+    def events_after(self, last_id, limit):
+        """Up to limit (id, user_id, event_type, data) outbox events after last_id,
+        and the cursor for the next call"""
+        rows = db_execute(self.connection().cursor(), 'select_events_after', '''
+            SELECT id, user_id, event_type, payload FROM event_outbox
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, limit)).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3])) for row in rows], rows[-1][0] if rows else last_id
+
+    def user_events(self, user_id, after, upto):
+        """(id, event_type, data) for one user's events with after < id <= upto"""
+        rows = db_execute(self.connection().cursor(), 'select_user_events', '''
+            SELECT id, event_type, payload FROM event_outbox
+            WHERE user_id = ? AND id > ? AND id <= ?
+            ORDER BY id
+        ''', (user_id, after, upto)).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def archive_meals(self, before, batch):
+        """Move meals logged before `before` ('YYYY-MM-DD') out of meal_logs into one
+        meal_logs_archive_YYYY_MM table per month, `batch` rows per transaction; returns
+        the number of rows moved"""
+        conn = self.connection()
+        cursor = conn.cursor()
+        moved = 0
+        last = ('', 0)  # (logged_date, id) of the last candidate, so rows left behind aren't read again
+        while True:
+            # Found through idx_meal_logs_date before taking the write lock, so each pass reads
+            # about `batch` index entries and the write lock is only held for the move.
+            # Only well-formed dates are archived.
+            candidates = db_execute(cursor, 'select_archive_candidates', '''
+                SELECT logged_date, id FROM meal_logs
+                WHERE logged_date < ? AND (logged_date, id) > (?, ?)
+                  AND logged_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-*'
+                ORDER BY logged_date, id
+                LIMIT ?
+            ''', (before,) + last + (batch,)).fetchall()
+            if not candidates:
+                return moved
+            last = tuple(candidates[-1])
+            ids = json.dumps([row[1] for row in candidates])
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                # A meal edited or deleted since it was found is only moved if it is still old enough
+                rows = db_execute(cursor, 'select_archive_batch', '''
+                    SELECT id, user_id, substr(logged_date, 1, 7), change_seq FROM meal_logs
+                    WHERE id IN (SELECT value FROM json_each(?)) AND logged_date < ?
+                ''', (ids, before)).fetchall()
+                for month in sorted({row[2] for row in rows}):
+                    table = create_meal_archive(cursor, month)
+                    params = (ids, before, month)
+                    db_execute(cursor, 'insert_archived_meals', f'''
+                        INSERT INTO {table} ({ARCHIVED_MEAL_COLUMNS})
+                        SELECT {ARCHIVED_MEAL_COLUMNS} FROM meal_logs
+                        WHERE id IN (SELECT value FROM json_each(?)) AND logged_date < ? AND substr(logged_date, 1, 7) = ?
+                    ''', params)
+                    db_execute(cursor, 'delete_archived_meals', '''
+                        DELETE FROM meal_logs
+                        WHERE id IN (SELECT value FROM json_each(?)) AND logged_date < ? AND substr(logged_date, 1, 7) = ?
+                    ''', params)
+                # Lets /api/meals/changes skip the archive tables for cursors past every archived meal
+                archived_seqs = defaultdict(int)
+                for _, user_id, _, change_seq in rows:
+                    archived_seqs[user_id] = max(archived_seqs[user_id], change_seq or 0)
+                for user_id, seq in archived_seqs.items():
+                    db_execute(cursor, 'update_meal_archived_seq', '''
+                        UPDATE meal_change_heads SET archived_seq = MAX(archived_seq, ?) WHERE user_id = ?
+                    ''', (seq, user_id))
+            moved += len(rows)
+
+    def claim_maintenance(self, task, interval):
+        """True for the one caller (across workers) that gets to run `task` this interval"""
+        now = time.time()
+        with self.connection() as conn:
+            cursor = db_execute(conn.cursor(), 'claim_maintenance', '''
+                INSERT INTO maintenance_runs (task, last_run) VALUES (?, ?)
+                ON CONFLICT(task) DO UPDATE SET last_run = excluded.last_run
+                WHERE maintenance_runs.last_run <= ?
+            ''', (task, now, now - interval))
+            return cursor.rowcount == 1
+
+    def claim_budget(self, task, interval, limit):
+        """Take one of the `limit` units (e.g. USDA calls) that all workers share for `task`
+        per `interval` seconds; False when this interval's are used up"""
+        now = time.time()
+        with self.connection() as conn:
+            cursor = db_execute(conn.cursor(), 'claim_budget', '''
+                INSERT INTO maintenance_runs (task, last_run, used) VALUES (?, ?, 1)
+                ON CONFLICT(task) DO UPDATE SET
+                    last_run = CASE WHEN last_run <= ? THEN excluded.last_run ELSE last_run END,
+                    used = CASE WHEN last_run <= ? THEN 1 ELSE used + 1 END
+                WHERE maintenance_runs.last_run <= ? OR maintenance_runs.used < ?
+            ''', (task, now) + (now - interval,) * 3 + (limit,))
+            return cursor.rowcount == 1
+
+    def optimize(self, vacuum_pages):
+        """Refresh planner statistics where they are stale and return up to vacuum_pages
+        free pages to the filesystem; returns the free pages left"""
+        cursor = self.connection().cursor()
+        # Bounds the rows ANALYZE samples per index, so this stays cheap on large tables
+        db_execute(cursor, 'pragma_analysis_limit', 'PRAGMA analysis_limit = 1000')
+        db_execute(cursor, 'pragma_optimize', 'PRAGMA optimize')
+        if db_execute(cursor, 'pragma_auto_vacuum', 'PRAGMA auto_vacuum').fetchone()[0] == INCREMENTAL_VACUUM:
+            db_execute(cursor, 'incremental_vacuum', f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+        return db_execute(cursor, 'pragma_freelist_count', 'PRAGMA freelist_count').fetchone()[0]
+
+    def init(self):
+        """Create and migrate the schema (on its own connection, so nothing is carried across fork)"""
+        conn = sqlite3.connect(self.database_path, timeout=BUSY_TIMEOUT)
+        try:
+            # Takes effect at once for a new database, and after the next VACUUM for an existing one
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor = conn.cursor()
+            create_schema(cursor)
+            claim_layout(cursor, 'sqlite', 1)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def create_schema(cursor):
+    """Create and migrate every table in one database (SQLiteStorage)"""
+    create_directory_schema(cursor)
+    create_user_schema(cursor)
+    migrate_legacy_history(cursor, cursor)
+    backfill_foods(cursor, [cursor])
+
+
+def create_directory_schema(cursor):
+    """Tables shared by all users: users, foods, maintenance_runs and storage_layout
+    (the directory database of ShardedStorage)"""
+    # User profiles table with additional columns
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            firebase_uid TEXT UNIQUE NOT NULL,
+            email TEXT NOT NULL,
+            age INTEGER,
+            weight REAL,
+            height REAL,
+            activity_level TEXT,
+            dietary_goal TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            stats_version INTEGER NOT NULL DEFAULT 0 -- bumped by meal/goal writes; keys cached analytics
+        )
+    ''')
+    add_missing_columns(cursor, 'users', {'stats_version': 'INTEGER NOT NULL DEFAULT 0'})
+
+    # Foods seen through /api/food, with nutrients per 100 g (candidates for /api/recommendations)
+    # and portions as JSON {unit: grams per unit} for meals logged by serving size
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS foods (
+            fdc_id TEXT PRIMARY KEY,
+            description TEXT NOT NULL,
+            data_type TEXT,
+            calories REAL,
+            protein REAL,
+            carbs REAL,
+            fat REAL,
+            sodium REAL,
+            sugar REAL,
+            portions TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    add_missing_columns(cursor, 'foods', {'sodium': 'REAL', 'sugar': 'REAL', 'portions': 'TEXT'})
+
+    # When each background maintenance task last ran, so one worker runs it per interval,
+    # and how much of a task's shared per-interval budget is used (see claim_budget)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            last_run REAL NOT NULL, -- unix time
+            used INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    add_missing_columns(cursor, 'maintenance_runs', {'used': 'INTEGER NOT NULL DEFAULT 0'})
+
+    # Which backend the data in this database belongs to (see claim_layout)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS storage_layout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            backend TEXT NOT NULL, -- 'sqlite' or 'sharded'
+            shards INTEGER NOT NULL
+        )
+    ''')
+
+
+def create_user_schema(cursor, shard=False):
+    """Tables of per-user data (a ShardedStorage shard holds only these, plus user_stats)"""
+    # Per-user search history ring: each user owns HISTORY_SLOTS fixed slots,
+    # written round-robin, so inserts and reads never touch other users' rows
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_slots (
+            user_id INTEGER NOT NULL, -- users.id, or ANONYMOUS_HISTORY_USER
+            slot INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            fdc_id TEXT NOT NULL,
+            food_name TEXT NOT NULL,
+            searched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            nutrition_data TEXT,
+            PRIMARY KEY (user_id, slot)
+        )
+    ''')
+
+    # Write position of each user's ring (seq keeps growing, slot = seq % HISTORY_SLOTS)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_heads (
+            user_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    ''')
+
+    # User dietary goals table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dietary_goals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            goal_type TEXT NOT NULL, -- 'weight_loss', 'muscle_gain', 'maintenance'
+            target_calories INTEGER,
+            target_protein REAL,
+            target_carbs REAL,
+            target_fat REAL,
+            current_weight REAL,
+            target_weight REAL,
+            activity_level TEXT, -- 'sedentary', 'light', 'moderate', 'active', 'very_active'
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # User meals/food log table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            fdc_id TEXT NOT NULL,
+            food_name TEXT NOT NULL,
+            serving_size REAL NOT NULL,
+            serving_unit TEXT NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL,
+            carbs REAL,
+            fat REAL,
+            meal_type TEXT, -- 'breakfast', 'lunch', 'dinner', 'snack'
+            logged_date DATE NOT NULL,
+            logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sodium REAL, -- mg, optional
+            sugar REAL, -- g, optional
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    # Databases created before sodium/sugar and change sequences were tracked
+    add_missing_columns(cursor, 'meal_logs', {'sodium': 'REAL', 'sugar': 'REAL', 'change_seq': 'INTEGER'})
+
+    # Per-user change sequence for /api/meals/changes: every meal insert, edit and delete takes the next seq
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_change_heads (
+            user_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            archived_seq INTEGER NOT NULL DEFAULT 0 -- highest change_seq moved to an archive table
+        )
+    ''')
+    add_missing_columns(cursor, 'meal_change_heads', {'archived_seq': 'INTEGER NOT NULL DEFAULT 0'})
+
+    # Months of meal_logs moved out by SQLiteStorage.archive_meals, and the table holding each
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_log_archives (
+            month TEXT PRIMARY KEY, -- 'YYYY-MM'
+            table_name TEXT NOT NULL
+        )
+    ''')
+
+    # Deleted meals, so clients syncing with a cursor learn about the deletion
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_tombstones (
+            user_id INTEGER NOT NULL,
+            meal_id INTEGER NOT NULL,
+            change_seq INTEGER NOT NULL,
+            deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, meal_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_tombstones_user_seq ON meal_tombstones (user_id, change_seq)')
+
+    # Running per-user per-day totals, updated by every meal write
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            logged_date DATE NOT NULL,
+            calories REAL NOT NULL DEFAULT 0,
+            protein REAL NOT NULL DEFAULT 0,
+            carbs REAL NOT NULL DEFAULT 0,
+            fat REAL NOT NULL DEFAULT 0,
+            sodium REAL NOT NULL DEFAULT 0,
+            sugar REAL NOT NULL DEFAULT 0,
+            meal_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, logged_date)
+        )
+    ''')
+
+    # One row per user, day and nutrient whose limit was crossed (the UNIQUE index serves per-user reads)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS intake_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            logged_date DATE NOT NULL,
+            nutrient TEXT NOT NULL, -- 'calories', 'sodium', 'sugar'
+            amount REAL NOT NULL, -- day total when the limit was crossed
+            threshold REAL NOT NULL,
+            unit TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, logged_date, nutrient)
+        )
+    ''')
+
+    # Change events for /api/stream, written in the same transaction as the change (see events.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS event_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL, -- 'summary', 'goals', 'profile'
+            payload TEXT NOT NULL, -- JSON
+            created_at REAL NOT NULL -- unix time
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_event_outbox_user ON event_outbox (user_id, id)')
+
+    # Idempotency-Key of each logged meal and the response it got, so a retry returns that response
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            request_hash TEXT NOT NULL, -- a retry must send the same body
+            response TEXT NOT NULL, -- JSON
+            created_at REAL NOT NULL -- unix time
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_idempotency_keys_user_key ON idempotency_keys (user_id, idempotency_key)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+
+    # Meals users log again and again (a usual breakfast), logged with one request. Nutrients are
+    # computed when the meal is saved: per component in components (JSON), summed in the columns.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS saved_meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            components TEXT NOT NULL, -- JSON list of meal fields
+            calories REAL NOT NULL,
+            protein REAL,
+            carbs REAL,
+            fat REAL,
+            sodium REAL,
+            sugar REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_saved_meals_user ON saved_meals (user_id)')
+
+    # Every per-user query filters on user_id first (and meal queries on date)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_logs_user_date ON meal_logs (user_id, logged_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_logs_user_seq ON meal_logs (user_id, change_seq)')
+    # Lets archive_meals find old meals without scanning the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_meal_logs_date ON meal_logs (logged_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_dietary_goals_user_created ON dietary_goals (user_id, created_at)')
+
+    if shard:
+        # users lives in the directory database; a shard keeps only what meal writes bump
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                stats_version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+    backfill_daily_totals(cursor)
+    backfill_meal_change_seq(cursor)
+
+
+def claim_layout(cursor, backend, shards):
+    """Record that this database holds `backend`'s data, or raise RuntimeError when it already
+    holds another layout's, which the requested one would silently hide"""
+    cursor.execute('SELECT backend, shards FROM storage_layout')
+    layout = cursor.fetchone()
+    if layout is None:
+        cursor.execute('INSERT INTO storage_layout (id, backend, shards) VALUES (1, ?, ?)', (backend, shards))
+    elif tuple(layout) != (backend, shards):
+        raise RuntimeError(f"{database_file(cursor)} holds data stored with STORAGE_BACKEND={layout[0]!r} "
+                           f"(SHARD_COUNT={layout[1]}), not {backend!r} with {shards}. Start with that "
+                           f"configuration, or point DATABASE_PATH at a new file.")
+
+
+def database_file(cursor):
+    return cursor.execute('PRAGMA database_list').fetchone()[2]
+
+
+def migrate_legacy_history(source, cursor):
+    """Copy the old global search_history table (in source's database) into the anonymous
+    ring (in cursor's; runs once)"""
+    source.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'search_history'")
+    if not source.fetchone():
+        return
+    cursor.execute('SELECT 1 FROM history_heads LIMIT 1')
+    if cursor.fetchone():
+        return
+
+    source.execute('''
+        SELECT fdc_id, food_name, searched_at, nutrition_data
+        FROM search_history
+        ORDER BY searched_at DESC, id DESC
+        LIMIT ?
+    ''', (HISTORY_SLOTS,))
+    rows = source.fetchall()
+    if not rows:
+        return
+
+    # Oldest entry gets seq 0 so the ring order matches the old ordering
+    for seq, row in enumerate(reversed(rows)):
+        cursor.execute('''
+            INSERT INTO history_slots (user_id, slot, seq, fdc_id, food_name, searched_at, nutrition_data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (ANONYMOUS_HISTORY_USER, seq % HISTORY_SLOTS, seq) + tuple(row))
+    cursor.execute('INSERT INTO history_heads (user_id, seq) VALUES (?, ?)',
+                   (ANONYMOUS_HISTORY_USER, len(rows)))
+
+
+def create_meal_archive(cursor, month):
+    """Create (if needed) and register the archive table for one 'YYYY-MM' month; returns its name"""
+    if not re.fullmatch(r'\d{4}-\d{2}', month):
+        raise ValueError(f'Not a YYYY-MM month: {month!r}')
+    table = f"meal_logs_archive_{month.replace('-', '_')}"
+    # Same columns as meal_logs; ids are kept, and AUTOINCREMENT never hands them out again
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            fdc_id TEXT NOT NULL,
+            food_name TEXT NOT NULL,
+            serving_size REAL NOT NULL,
+            serving_unit TEXT NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL,
+            carbs REAL,
+            fat REAL,
+            meal_type TEXT,
+            logged_date DATE NOT NULL,
+            logged_at TIMESTAMP,
+            sodium REAL,
+            sugar REAL,
+            change_seq INTEGER
+        )
+    ''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_date ON {table} (user_id, logged_date)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_seq ON {table} (user_id, change_seq)')
+    cursor.execute('INSERT OR IGNORE INTO meal_log_archives (month, table_name) VALUES (?, ?)', (month, table))
+    return table
+
+
+def add_missing_columns(cursor, table, columns):
+    """ALTER TABLE ADD COLUMN for each {name: type} the table doesn't have yet"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+
+def backfill_daily_totals(cursor):
+    """Build daily_totals from meal_logs when it is still empty (runs once)"""
+    cursor.execute('SELECT 1 FROM daily_totals LIMIT 1')
+    if cursor.fetchone():
+        return
+    cursor.execute('''
+        INSERT INTO daily_totals (user_id, logged_date, calories, protein, carbs, fat, sodium, sugar, meal_count)
+        SELECT user_id, logged_date,
+               COALESCE(SUM(calories), 0), COALESCE(SUM(protein), 0), COALESCE(SUM(carbs), 0),
+               COALESCE(SUM(fat), 0), COALESCE(SUM(sodium), 0), COALESCE(SUM(sugar), 0), COUNT(*)
+        FROM meal_logs
+        GROUP BY user_id, logged_date
+    ''')
+
+
+def backfill_meal_change_seq(cursor):
+    """Number meals logged before change sequences existed, oldest first per user (runs once)"""
+    cursor.execute('SELECT 1 FROM meal_logs WHERE change_seq IS NULL LIMIT 1')
+    if not cursor.fetchone():
+        return
+    cursor.execute('''
+        UPDATE meal_logs SET change_seq = numbered.seq
+        FROM (
+            SELECT m.id, COALESCE(h.seq, 0) + ROW_NUMBER() OVER (PARTITION BY m.user_id ORDER BY m.id) AS seq
+            FROM meal_logs m
+            LEFT JOIN meal_change_heads h ON h.user_id = m.user_id
+            WHERE m.change_seq IS NULL
+        ) AS numbered
+        WHERE meal_logs.id = numbered.id
+    ''')
+    cursor.execute('''
+        INSERT INTO meal_change_heads (user_id, seq)
+        SELECT user_id, MAX(change_seq) FROM meal_logs GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET seq = MAX(seq, excluded.seq)
+    ''')
+
+
+def backfill_foods(cursor, history_cursors):
+    """Fill an empty foods table from the /api/food payloads stored with history entries
+    in the databases of history_cursors (runs once)"""
+    cursor.execute('SELECT 1 FROM foods LIMIT 1')
+    if cursor.fetchone():
+        return
+    payloads = []
+    for history in history_cursors:
+        history.execute('SELECT nutrition_data FROM history_slots WHERE nutrition_data IS NOT NULL ORDER BY seq')
+        payloads += history.fetchall()
+    foods = SQLiteFoods(cursor)
+    for (nutrition_data,) in payloads:
+        try:
+            food = json.loads(nutrition_data)
+        except ValueError:
+            continue
+        if isinstance(food, dict) and food.get('fdcId') and 'macronutrients' in food:
+            foods.save(food)
+
+
+# --- In memory ------------------------------------------------------------
+
+def _timestamp(offset=timedelta()):
+    """UTC 'YYYY-MM-DD HH:MM:SS', like SQLite's CURRENT_TIMESTAMP / datetime('now')"""
+    return (datetime.now(timezone.utc) + offset).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _real(value):
+    """SQLite REAL affinity: numbers and numeric strings are stored as floats"""
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return value
+
+
+def _days_ago(days):
+    """date('now', '-N days')"""
+    return (datetime.now(timezone.utc).date() - timedelta(days=int(days))).isoformat()
+
+
+class MemoryRepository:
+    def __init__(self, store):
+        self.store = store
+
+
+class MemoryUsers(MemoryRepository):
+    def get(self, firebase_uid):
+        user_id = self.store.user_ids.get(firebase_uid)
+        return dict(self.store.users[user_id]) if user_id is not None else None
+
+    def get_id(self, firebase_uid):
+        return self.store.user_ids.get(firebase_uid)
+
+    def login(self, firebase_uid, email):
+        user_id = self.get_id(firebase_uid)
+        now = _timestamp()
+        if user_id is not None:
+            self.store.users[user_id].update(email=email, updated_at=now)
+            return user_id
+        user_id = self.store.next_id('users')
+        self.store.users[user_id] = {
+            'id': user_id, 'firebase_uid': firebase_uid, 'email': email,
+            **dict.fromkeys(PROFILE_FIELDS), 'created_at': now, 'updated_at': now, 'stats_version': 0
+        }
+        self.store.user_ids[firebase_uid] = user_id
+        return user_id
+
+    def update_profile(self, user_id, profile):
+        user = self.store.users.get(user_id)
+        if user is not None:
+            user.update({field: profile.get(field) for field in PROFILE_FIELDS}, updated_at=_timestamp())
+            user.update(weight=_real(user['weight']), height=_real(user['height']))
+
+    def bump_stats_version(self, user_id):
+        user = self.store.users.get(user_id)
+        if user is not None:
+            user['stats_version'] += 1
+
+
+class MemoryGoals(MemoryRepository):
+    def latest(self, user_id):
+        goals = self.store.goals.get(user_id)
+        return dict(goals[-1]) if goals else None
+
+    def add(self, user_id, goals):
+        if not goals.get('goal_type'):
+            raise ValueError('NOT NULL constraint failed: dietary_goals.goal_type')
+        row = {field: goals.get(field) for field in GOAL_FIELDS}
+        row.update({field: _real(row[field]) for field in GOAL_FIELDS[2:-1]})
+        self.store.goals[user_id].append({**row, 'created_at': _timestamp()})
+
+
+class MemoryMeals(MemoryRepository):
+    def add(self, user_id, meal):
+        for field in REQUIRED_MEAL_FIELDS:
+            if meal.get(field) is None:
+                raise ValueError(f'NOT NULL constraint failed: meal_logs.{field}')
+        meal_id = self.store.next_id('meal_logs')
+        row = {'id': meal_id, 'logged_at': _timestamp()}
+        self.store.meals[user_id].append(self._write(user_id, row, meal))
+        self.add_to_totals(user_id, row, 1)
+        return meal_id
+
+    def _write(self, user_id, row, meal):
+        """Store meal's fields in row with SQLite's column affinities and the next change_seq"""
+        row.update({field: meal.get(field) for field in MEAL_FIELDS})
+        row.update({field: _real(row[field]) for field in ('serving_size',) + INTAKE_COLUMNS})
+        row['fdc_id'] = str(row['fdc_id'])
+        row['logged_date'] = str(row['logged_date'])
+        row['change_seq'] = self.next_change_seq(user_id)
+        return row
+
+    def _find(self, user_id, meal_id):
+        for index, meal in enumerate(self.store.meals.get(user_id, ())):
+            if meal['id'] == meal_id:
+                return index, meal
+        return None, None
+
+    def get(self, user_id, meal_id):
+        meal = self._find(user_id, meal_id)[1]
+        return {key: value for key, value in meal.items() if key != 'change_seq'} if meal else None
+
+    def update(self, user_id, meal_id, changes):
+        old = self.get(user_id, meal_id)
+        if old is None:
+            return None
+        new = {**old, **{field: changes[field] for field in MEAL_FIELDS if field in changes}}
+        for field in REQUIRED_MEAL_FIELDS:
+            if new.get(field) is None:
+                raise ValueError(f'NOT NULL constraint failed: meal_logs.{field}')
+        row = self._find(user_id, meal_id)[1]
+        self._write(user_id, row, new)
+        self.add_to_totals(user_id, old, -1)
+        self.add_to_totals(user_id, row, 1)
+        return old, self.get(user_id, meal_id)
+
+    def delete(self, user_id, meal_id):
+        index, meal = self._find(user_id, meal_id)
+        if meal is None:
+            return None
+        old = self.get(user_id, meal_id)
+        del self.store.meals[user_id][index]
+        self.store.meal_tombstones[user_id][meal_id] = {'id': meal_id, 'change_seq': self.next_change_seq(user_id)}
+        self.add_to_totals(user_id, old, -1)
+        return old
+
+    def next_change_seq(self, user_id):
+        self.store.meal_change_heads[user_id] += 1
+        return self.store.meal_change_heads[user_id]
+
+    def add_to_totals(self, user_id, meal, sign):
+        key = (user_id, str(meal['logged_date']))
+        totals = self.store.daily_totals.get(key)
+        if totals is None:
+            totals = self.store.daily_totals[key] = dict.fromkeys(INTAKE_COLUMNS + ('meal_count',), 0)
+        for column in INTAKE_COLUMNS:
+            totals[column] += sign * float(meal.get(column) or 0)
+        totals['meal_count'] += sign
+
+    def changes(self, user_id, since, limit):
+        columns = ('id',) + MEAL_FIELDS[:-2] + ('logged_at', 'change_seq')
+        meals = sorted((meal for meal in self.store.meals.get(user_id, ()) if meal['change_seq'] > since),
+                       key=lambda meal: meal['change_seq'])
+        deleted = sorted((dict(tombstone) for tombstone in self.store.meal_tombstones.get(user_id, {}).values()
+                          if tombstone['change_seq'] > since), key=lambda tombstone: tombstone['change_seq'])
+        return page_changes([{column: meal[column] for column in columns} for meal in meals[:limit + 1]],
+                            deleted[:limit + 1], since, limit)
+
+    def list(self, user_id, date_filter=None, days=7):
+        columns = ('id',) + MEAL_FIELDS[:-2] + ('logged_at',)
+        if date_filter:
+            meals = [meal for meal in self.store.meals.get(user_id, ()) if meal['logged_date'] == str(date_filter)]
+            meals.sort(key=lambda meal: (meal['logged_at'], meal['id']), reverse=True)
+        else:
+            start = _days_ago(days)
+            meals = [meal for meal in self.store.meals.get(user_id, ()) if meal['logged_date'] >= start]
+            meals.sort(key=lambda meal: (meal['logged_date'], meal['logged_at'], meal['id']), reverse=True)
+        return [{column: meal[column] for column in columns} for meal in meals]
+
+    def day_totals(self, user_id, logged_date):
+        totals = self.store.daily_totals.get((user_id, str(logged_date)))
+        return dict(totals) if totals else dict.fromkeys(INTAKE_COLUMNS + ('meal_count',), 0)
+
+    def fdc_ids_on(self, user_id, logged_date):
+        return list({meal['fdc_id'] for meal in self.store.meals.get(user_id, ()) if meal['logged_date'] == str(logged_date)})
+
+    def trend_rows(self, user_id, today, days, windows, tolerance):
+        """Same rows as SQLiteMeals.trend_rows, computed with running sums"""
+        first_day = date.fromisoformat(today) - timedelta(days=days - 1)
+        goals = self.store.goals.get(user_id, [])
+        goal_times = [goal['created_at'] for goal in goals]
+        rows = []
+        for i in range(days):
+            day = first_day + timedelta(days=i)
+            totals = self.store.daily_totals.get((user_id, day.isoformat()))
+            meal_count = totals['meal_count'] if totals else 0
+            # Goal in effect that day; days before the first goal use the first goal
+            in_effect = bisect.bisect_left(goal_times, (day + timedelta(days=1)).isoformat())
+            goal = goals[in_effect - 1] if in_effect else (goals[0] if goals else None)
+            target = goal['target_calories'] if goal else None
+            row = {'day': day.isoformat(), 'meal_count': meal_count}
+            row.update({macro: totals[macro] if meal_count > 0 else None for macro in MACROS})
+            row['target_calories'] = target
+            row['logged'] = int(meal_count > 0)
+            row['adherent'] = int(bool(meal_count > 0 and target and target > 0
+                                       and abs(row['calories'] - target) <= target * tolerance))
+            rows.append(row)
+
+        # Prefix sums: index i holds the sum over rows[:i]
+        prefix = {key: [0.0] for key in MACROS}
+        prefix.update(logged=[0], adherent=[0])
+        for row in rows:
+            for macro in MACROS:
+                prefix[macro].append(prefix[macro][-1] + (row[macro] or 0.0))
+            prefix['logged'].append(prefix['logged'][-1] + row['logged'])
+            prefix['adherent'].append(prefix['adherent'][-1] + row['adherent'])
+        adherence_streak = logging_streak = 0
+        for i, row in enumerate(rows):
+            for n in windows:
+                start = max(0, i + 1 - n)
+                logged = prefix['logged'][i + 1] - prefix['logged'][start]
+                for macro in MACROS:
+                    # Unlogged days are NULL, so the average only counts logged days
+                    row[f'{macro}_{n}d'] = (prefix[macro][i + 1] - prefix[macro][start]) / logged if logged else None
+                row[f'adherent_{n}d'] = prefix['adherent'][i + 1] - prefix['adherent'][start]
+                row[f'logged_{n}d'] = logged
+            adherence_streak = adherence_streak + 1 if row['adherent'] else 0
+            logging_streak = logging_streak + 1 if row['logged'] else 0
+            row['adherence_streak'] = adherence_streak
+            row['logging_streak'] = logging_streak
+        return rows
+
+
+class MemoryAlerts(MemoryRepository):
+    def add(self, user_id, logged_date, nutrient, amount, threshold, unit):
+        key = (user_id, str(logged_date), nutrient)
+        if key in self.store.alerts:
+            return False
+        self.store.alerts[key] = {
+            'id': self.store.next_id('intake_alerts'), 'date': str(logged_date), 'nutrient': nutrient,
+            'amount': _real(amount), 'threshold': _real(threshold), 'unit': unit, 'created_at': _timestamp()
+        }
+        return True
+
+    def recent(self, user_id, days=7):
+        start = _days_ago(days)
+        alerts = []
+        for (owner, logged_date, nutrient), alert in self.store.alerts.items():
+            if owner == user_id and logged_date >= start:
+                totals = self.store.daily_totals.get((user_id, logged_date)) or {}
+                alerts.append((alert['id'], {**alert, 'day_total': totals.get(nutrient)}))
+        alerts.sort(key=lambda item: (item[1]['date'], item[1]['created_at'], item[0]), reverse=True)
+        return [{key: value for key, value in alert.items() if key != 'id'} for _, alert in alerts]
+
+    def clear_resolved(self, user_id, logged_date):
+        totals = self.store.daily_totals.get((user_id, str(logged_date))) or {}
+        for key, alert in list(self.store.alerts.items()):
+            if key[:2] == (user_id, str(logged_date)) and alert['threshold'] > (totals.get(key[2]) or 0):
+                del self.store.alerts[key]
+
+
+class MemoryHistory(MemoryRepository):
+    def recent(self, user_id, limit):
+        entries = sorted(self.store.history.get(user_id, {}).values(), key=lambda entry: entry['seq'], reverse=True)
+        return [{'fdc_id': entry['fdc_id'], 'food_name': entry['food_name'], 'searched_at': entry['searched_at'],
+                 'nutrition_data': _loads(entry['nutrition_data'])} for entry in entries[:limit]]
+
+    def add(self, user_id, fdc_id, food_name, nutrition_data):
+        if food_name is None:
+            raise ValueError('NOT NULL constraint failed: history_slots.food_name')
+        slots = self.store.history[user_id]
+        day_ago = _timestamp(-timedelta(days=1))
+        if any(entry['fdc_id'] == str(fdc_id) and entry['searched_at'] > day_ago for entry in slots.values()):
+            return False
+        seq = self.store.history_heads[user_id]
+        self.store.history_heads[user_id] = seq + 1
+        # Stored serialized, as in SQLite, so callers never share the payload object
+        slots[seq % HISTORY_SLOTS] = {'seq': seq, 'fdc_id': str(fdc_id), 'food_name': food_name,
+                                      'searched_at': _timestamp(), 'nutrition_data': json.dumps(nutrition_data)}
+        return True
+
+
+class MemoryFoods(MemoryRepository):
+    def save(self, nutrition_data):
+        fdc_id = str(nutrition_data['fdcId'])
+        portions = nutrition_data.get('portions')
+        if portions is None:
+            portions = (self.store.foods.get(fdc_id) or {}).get('portions')
+        self.store.foods[fdc_id] = {'fdc_id': fdc_id, 'description': nutrition_data.get('description') or '',
+                                    **servings.per_100g(nutrition_data), 'portions': portions}
+
+    def get(self, fdc_id):
+        food = self.store.foods.get(str(fdc_id))
+        return json.loads(json.dumps(food)) if food is not None else None
+
+
+class MemoryEvents(MemoryRepository):
+    def publish(self, user_id, event_type, data):
+        now = time.time()
+        event_id = self.store.next_id('event_outbox')
+        self.store.events.append((event_id, user_id, event_type, json.dumps(data), now))
+        if event_id % PRUNE_EVERY == 0:
+            self.store.events = [event for event in self.store.events if event[4] >= now - RETENTION_SECONDS]
+
+
+class MemoryIdempotency(MemoryRepository):
+    def get(self, user_id, key, ttl):
+        entry = self.store.idempotency_keys.get((user_id, key))
+        if entry is None or entry['created_at'] < time.time() - ttl:
+            return None
+        return {'request_hash': entry['request_hash'], 'response': json.loads(entry['response'])}
+
+    def add(self, user_id, key, request_hash, response, ttl):
+        now = time.time()
+        entry = self.store.idempotency_keys.get((user_id, key))
+        if entry is not None and entry['created_at'] >= now - ttl:
+            raise IdempotencyConflict(key)
+        self.store.idempotency_keys[(user_id, key)] = {
+            'request_hash': request_hash, 'response': json.dumps(response), 'created_at': now
+        }
+        if self.store.next_id('idempotency_keys') % PRUNE_EVERY == 0:
+            self.store.idempotency_keys = {k: v for k, v in self.store.idempotency_keys.items()
+                                           if v['created_at'] >= now - ttl}
+
+
+class MemorySavedMeals(MemoryRepository):
+    def add(self, user_id, name, components, totals):
+        saved_meal_id = self.store.next_id('saved_meals')
+        self.store.saved_meals[user_id][saved_meal_id] = {
+            'id': saved_meal_id, 'name': name, 'components': json.dumps(components),
+            **{key: _real(totals.get(key)) for key in INTAKE_COLUMNS}, 'created_at': _timestamp()
+        }
+        return saved_meal_id
+
+    def get(self, user_id, saved_meal_id):
+        saved = self.store.saved_meals.get(user_id, {}).get(saved_meal_id)
+        return {**saved, 'components': json.loads(saved['components'])} if saved else None
+
+    def list(self, user_id):
+        return [self.get(user_id, saved_meal_id)
+                for saved_meal_id in sorted(self.store.saved_meals.get(user_id, {}), reverse=True)]
+
+    def delete(self, user_id, saved_meal_id):
+        return self.store.saved_meals.get(user_id, {}).pop(saved_meal_id, None) is not None
+
+
+class MemorySession:
+    def __init__(self, store):
+        self.users = MemoryUsers(store)
+        self.goals = MemoryGoals(store)
+        self.meals = MemoryMeals(store)
+        self.saved_meals = MemorySavedMeals(store)
+        self.alerts = MemoryAlerts(store)
+        self.history = MemoryHistory(store)
+        self.foods = MemoryFoods(store)
+        self.events = MemoryEvents(store)
+        self.idempotency = MemoryIdempotency(store)
+
+    @contextmanager
+    def savepoint(self):
+        # Nothing to roll back to; repositories validate before they write
+        yield self
+
+
+class MemoryStorage:
+    """Repositories over in-process dicts; sessions are serialized by one lock"""
+
+    partitions = 1
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.last_ids = defaultdict(int)
+        self.users = {}
+        self.user_ids = {}
+        self.goals = defaultdict(list)
+        self.meals = defaultdict(list)
+        self.meal_change_heads = defaultdict(int)
+        self.meal_tombstones = defaultdict(dict)
+        self.saved_meals = defaultdict(dict)
+        self.daily_totals = {}
+        self.alerts = {}
+        self.history = defaultdict(dict)
+        self.history_heads = defaultdict(int)
+        self.foods = {}
+        self.events = []
+        self.idempotency_keys = {}
+
+    def next_id(self, table):
+        self.last_ids[table] += 1
+        return self.last_ids[table]
+
+    def partition(self, user_id):
+        return 0
+
+    @contextmanager
+    def session(self, immediate=False):
+        with self.lock:
+            yield MemorySession(self)
+
+    def init(self):
+        pass
+
+    def archive_meals(self, before, batch):
+        # Nothing to gain from moving rows between dicts
+        return 0
+
+    def claim_maintenance(self, task, interval):
+        return True
+
+    def claim_budget(self, task, interval, limit):
+        return True
+
+    def optimize(self, vacuum_pages):
+        return 0
+
+    def food_rows(self):
+        with self.lock:
+            return [(food['fdc_id'], food['description']) + tuple(food[key] for key in MACROS)
+                    for food in self.foods.values()]
+
+    def popular_foods(self, recent_meals):
+        with self.lock:
+            meals = sorted((meal for meals in self.meals.values() for meal in meals), key=lambda meal: meal['id'])
+            counts = defaultdict(int)
+            names = {}
+            for meal in meals[-recent_meals:] if recent_meals > 0 else []:
+                counts[meal['fdc_id']] += 1
+                names[meal['fdc_id']] = meal['food_name']
+            rows = [(names[fdc_id], fdc_id, count) for fdc_id, count in counts.items()]
+            counts = defaultdict(int)
+            names = {}
+            for slots in self.history.values():
+                for entry in slots.values():
+                    counts[entry['fdc_id']] += 1
+                    names[entry['fdc_id']] = entry['food_name']
+            return rows + [(names[fdc_id], fdc_id, count) for fdc_id, count in counts.items()]
+
+    def history_payloads(self, fdc_ids):
+        wanted = set(fdc_ids)
+        with self.lock:
+            entries = sorted((entry for slots in self.history.values() for entry in slots.values()
+                              if entry['fdc_id'] in wanted and entry['nutrition_data'] not in (None, 'null')),
+                             key=lambda entry: entry['seq'])
+            return [(entry['fdc_id'], json.loads(entry['nutrition_data'])) for entry in entries]
+
+    def last_event_id(self):
+        with self.lock:
+            return self.last_ids['event_outbox']
+
+    def events_after(self, last_id, limit):
+        with self.lock:
+            start = bisect.bisect_right(self.events, last_id, key=lambda event: event[0])
+            events = self.events[start:start + limit]
+            return ([(event[0], event[1], event[2], json.loads(event[3])) for event in events],
+                    events[-1][0] if events else last_id)
+
+    def user_events(self, user_id, after, upto):
+        with self.lock:
+            return [(event[0], event[2], json.loads(event[3])) for event in self.events
+                    if event[1] == user_id and after < event[0] <= upto]
+
+
+# --- Sharded SQLite -------------------------------------------------------
+
+class ShardedUsers(SQLiteUsers):
+    """users rows in the directory; stats_version in the user's shard, so meal writes never lock the directory"""
+
+    def __init__(self, session):
+        super().__init__(session.cursor(None))
+        self.session = session
+
+    def get(self, firebase_uid):
+        user = super().get(firebase_uid)
+        if user is not None:
+            row = SQLiteRepository(self.session.shard_cursor(user['id'])).one(
+                'select_user_stats', 'SELECT stats_version FROM user_stats WHERE user_id = ?', (user['id'],))
+            user['stats_version'] = row['stats_version'] if row else 0
+        return user
+
+    def bump_stats_version(self, user_id):
+        SQLiteRepository(self.session.shard_cursor(user_id)).execute('bump_stats_version', '''
+            INSERT INTO user_stats (user_id, stats_version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET stats_version = stats_version + 1
+        ''', (user_id,))
+
+
+class ShardRouter:
+    """Calls a repository method on the shard owning its first argument, user_id"""
+
+    def __init__(self, session, repository):
+        self.session = session
+        self.repository = repository
+
+    def __getattr__(self, method):
+        def call(user_id, *args, **kwargs):
+            repository = self.repository(self.session.shard_cursor(user_id))
+            return getattr(repository, method)(user_id, *args, **kwargs)
+        return call
+
+
+class ShardedSession:
+    """One transaction per database the session touches, committed together when it ends"""
+
+    def __init__(self, storage, immediate=False):
+        self.storage = storage
+        self.immediate = immediate  # BEGIN IMMEDIATE on each shard when first used
+        self.cursors = {}  # None (the directory) or a shard index -> cursor
+        self.savepoints = []  # (ExitStack, shards already in it) per open savepoint() block
+        self.users = ShardedUsers(self)
+        self.foods = SQLiteFoods(self.cursor(None))
+        self.goals = ShardRouter(self, SQLiteGoals)
+        self.meals = ShardRouter(self, SQLiteMeals)
+        self.saved_meals = ShardRouter(self, SQLiteSavedMeals)
+        self.alerts = ShardRouter(self, SQLiteAlerts)
+        self.history = ShardRouter(self, SQLiteHistory)
+        self.events = ShardRouter(self, SQLiteEvents)
+        self.idempotency = ShardRouter(self, SQLiteIdempotency)
+
+    def cursor(self, index):
+        cursor = self.cursors.get(index)
+        if cursor is None:
+            database = self.storage.directory if index is None else self.storage.shards[index]
+            cursor = self.cursors[index] = database.connection().cursor()
+            if self.immediate and index is not None:
+                cursor.execute('BEGIN IMMEDIATE')
+        if index is not None:
+            for stack, entered in self.savepoints:
+                if index not in entered:
+                    stack.enter_context(sqlite_savepoint(cursor))
+                    entered.add(index)
+        return cursor
+
+    def shard_cursor(self, user_id):
+        return self.cursor(self.storage.partition(user_id))
+
+    @contextmanager
+    def savepoint(self):
+        """Nested transaction on every shard the block touches. The directory is not
+        covered; group-committed writes only read it."""
+        with ExitStack() as stack:
+            self.savepoints.append((stack, set()))
+            try:
+                yield self
+            finally:
+                self.savepoints.pop()
+
+
+class ShardedStorage:
+    """Users and foods in a directory database at database_path, and everything else that
+    belongs to a user in one of `shards` SQLite files (user_id % shards), each with its own
+    write lock. A session that writes to several databases commits them one after another,
+    so it is atomic per database only; request handlers write to one shard plus, for sign-in
+    and profile changes, the directory.
+
+    Outbox event ids are local_id * shards + shard, so they stay unique and increase per user.
+    The shard count can't change once there is data (init() refuses; see claim_layout).
+    """
+
+    def __init__(self, database_path, shards):
+        if shards < 1:
+            raise ValueError('At least one shard is needed')
+        root, ext = os.path.splitext(database_path)
+        self.directory = SQLiteStorage(database_path)
+        self.shards = [SQLiteStorage(f'{root}.shard{index}{ext}') for index in range(shards)]
+        self.partitions = shards
+
+    def partition(self, user_id):
+        """Shard index for a user; also its group-commit partition"""
+        return int(user_id) % len(self.shards)
+
+    @contextmanager
+    def session(self, immediate=False):
+        """immediate applies to the shards; the directory stays deferred, since writers only read it"""
+        session = ShardedSession(self, immediate)
+        try:
+            yield session
+            for cursor in session.cursors.values():
+                cursor.connection.commit()
+        except BaseException:
+            for cursor in session.cursors.values():
+                cursor.connection.rollback()
+            raise
+
+    def food_rows(self):
+        return self.directory.food_rows()
+
+    def popular_foods(self, recent_meals):
+        per_shard = -(-recent_meals // len(self.shards))
+        return [row for shard in self.shards for row in shard.popular_foods(per_shard)]
+
+    def history_payloads(self, fdc_ids):
+        return [payload for shard in self.shards for payload in shard.history_payloads(fdc_ids)]
+
+    def last_event_id(self):
+        # The poll cursor is one local outbox id per shard
+        return tuple(shard.last_event_id() for shard in self.shards)
+
+    def events_after(self, cursor, limit):
+        count = len(self.shards)
+        events, next_cursor = [], []
+        for index, shard in enumerate(self.shards):
+            rows, last_id = shard.events_after(cursor[index], limit)
+            events += [(row[0] * count + index,) + row[1:] for row in rows]
+            next_cursor.append(last_id)
+        return events, tuple(next_cursor)
+
+    def user_events(self, user_id, after, upto):
+        count = len(self.shards)
+        index = self.partition(user_id)
+        rows = self.shards[index].user_events(user_id, after // count, upto[index])
+        return [(row[0] * count + index,) + row[1:] for row in rows]
+
+    def archive_meals(self, before, batch):
+        return sum(shard.archive_meals(before, batch) for shard in self.shards)
+
+    def claim_maintenance(self, task, interval):
+        return self.directory.claim_maintenance(task, interval)
+
+    def claim_budget(self, task, interval, limit):
+        return self.directory.claim_budget(task, interval, limit)
+
+    def optimize(self, vacuum_pages):
+        return sum(database.optimize(vacuum_pages) for database in [self.directory] + self.shards)
+
+    def init(self):
+        """Create and migrate the directory and shard schemas. Refuses a directory that a
+        single-file SQLiteStorage has used, since its per-user rows would no longer be read."""
+        directory = sqlite3.connect(self.directory.database_path, timeout=BUSY_TIMEOUT)
+        shards = []
+        try:
+            directory.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor = directory.cursor()
+            create_directory_schema(cursor)
+            if not os.path.exists(self.shards[0].database_path) and cursor.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+                # From before storage_layout: users but no shard files is single-file data, so record
+                # it as that and let the claim below refuse it (nothing here is committed)
+                claim_layout(cursor, 'sqlite', 1)
+            claim_layout(cursor, 'sharded', len(self.shards))
+            for shard in self.shards:
+                conn = sqlite3.connect(shard.database_path, timeout=BUSY_TIMEOUT)
+                shards.append(conn)
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                create_user_schema(conn.cursor(), shard=True)
+            migrate_legacy_history(cursor, shards[self.partition(ANONYMOUS_HISTORY_USER)].cursor())
+            backfill_foods(cursor, [conn.cursor() for conn in shards])
+            for conn in shards + [directory]:
+                conn.commit()
+        finally:
+            for conn in shards + [directory]:
+                conn.close()
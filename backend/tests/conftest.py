@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.harness import load_app  # noqa: E402
+from benchmarks.usda_stub import USDAStubServer  # noqa: E402
+
+# No background USDA traffic or archival while a test runs
+TEST_CONFIG = {'PREFETCH_BUDGET': 0, 'SEARCH_PREFETCH_PAGES': 0, 'ARCHIVE_AFTER_DAYS': 0}
+
+
+@pytest.fixture(scope='session')
+def usda():
+    with USDAStubServer() as stub:
+        yield stub
+
+
+@pytest.fixture
+def make_client(tmp_path, usda):
+    """make_client(uid='alice', **config): a test client of a new app on tmp_path's database, signed in as uid"""
+    def make(uid='alice', **config):
+        config = {**TEST_CONFIG, 'SEARCH_QUERY_DIR': str(tmp_path / 'search-queries'), **config}
+        module = load_app(str(tmp_path / 'nutrivault.db'), usda.base_url, config=config)
+        client = module.app.test_client()
+        client.post('/api/auth/verify', json={'idToken': uid})
+        client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {uid}'
+        return client
+    return make
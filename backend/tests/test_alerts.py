@@ -0,0 +1,45 @@
+DAY = '2026-01-05'
+GOALS = {'goal_type': 'maintenance', 'current_weight': 70, 'target_weight': 70, 'activity_level': 'moderate'}
+
+
+def log(client, **amounts):
+    response = client.post('/api/meals', json={'fdc_id': '171477', 'food_name': 'Meal', 'serving_size': 100,
+                                               'serving_unit': 'g', 'calories': 100, 'logged_date': DAY, **amounts})
+    return response.get_json()
+
+
+def alerts(client):
+    return client.get('/api/alerts?days=10000').get_json()['alerts']
+
+
+def test_only_the_meal_that_crosses_a_limit_raises_an_alert(make_client):
+    client = make_client()
+
+    assert log(client, sodium=1500)['alerts'] == []
+    crossing = log(client, sodium=1000, sugar=20)['alerts']
+    assert log(client, sodium=500)['alerts'] == []  # Already over: no second alert that day
+
+    assert [(alert['nutrient'], alert['amount'], alert['threshold']) for alert in crossing] == [('sodium', 2500, 2300)]
+    assert [(alert['nutrient'], alert['day_total']) for alert in alerts(client)] == [('sodium', 3000)]
+
+
+def test_calorie_alert_follows_the_users_target(make_client):
+    client = make_client()
+    client.post('/api/dietary-goals', json=GOALS)  # 2387 kcal, so the alert threshold is 2626
+
+    assert log(client, calories=2600)['alerts'] == []
+    assert [(alert['nutrient'], alert['threshold']) for alert in log(client, calories=30)['alerts']] == [('calories', 2626)]
+
+
+def test_an_alert_goes_away_when_its_day_drops_under_the_limit(make_client):
+    client = make_client()
+    log(client, sodium=1500)
+    meal_id = log(client, sodium=1000)['meal_id']
+
+    client.put(f'/api/meals/{meal_id}', json={'sodium': 500})
+    assert alerts(client) == []
+
+    client.put(f'/api/meals/{meal_id}', json={'sodium': 900})
+    assert [alert['nutrient'] for alert in alerts(client)] == ['sodium']
+    client.delete(f'/api/meals/{meal_id}')
+    assert alerts(client) == []
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+import pytest
+
+import metrics
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+@pytest.fixture
+def client(make_client):
+    client = make_client()
+    for days in (400, 400, 300, 200, 40, 1, 0):
+        client.post('/api/meals', json={'fdc_id': '171477', 'food_name': f'Meal {days}', 'serving_size': 100,
+                                        'serving_unit': 'g', 'calories': days + 1, 'logged_date': days_ago(days)})
+    meal_id = client.get(f'/api/meals?date={days_ago(200)}').get_json()['meals'][0]['id']
+    client.put(f'/api/meals/{meal_id}', json={'calories': 50})
+    meal_id = client.get(f'/api/meals?date={days_ago(300)}').get_json()['meals'][0]['id']
+    client.delete(f'/api/meals/{meal_id}')
+    return client
+
+
+def meal_logs_rows(client):
+    storage = client.application.extensions['storage']
+    return storage.connection().execute('SELECT COUNT(*) FROM meal_logs').fetchone()[0]
+
+
+def reads(client):
+    return {
+        'recent': client.get('/api/meals?days=500').get_json(),
+        'day': client.get(f'/api/meals?date={days_ago(400)}').get_json(),
+        'changes': client.get('/api/meals/changes?since=0').get_json(),
+        'changes_page': client.get('/api/meals/changes?since=2&limit=3').get_json(),
+        'trends': client.get('/api/analytics/trends?days=30').get_json()
+    }
+
+
+def test_archived_meals_read_the_same(client):
+    before = reads(client)
+    assert len(before['recent']['meals']) == 6 and before['trends']['success']
+
+    moved = client.application.extensions['storage'].archive_meals(days_ago(180), batch=2)
+
+    assert moved == 3  # 400, 400 and the edited 200-day-old meal; the 300-day-old one was deleted
+    assert meal_logs_rows(client) == 3
+    assert reads(client) == before
+
+
+def test_archiving_again_moves_nothing(client):
+    storage = client.application.extensions['storage']
+    storage.archive_meals(days_ago(180), batch=100)
+
+    assert storage.archive_meals(days_ago(180), batch=100) == 0
+    assert meal_logs_rows(client) == 3
+
+
+def test_malformed_dates_stay_in_meal_logs(client):
+    client.post('/api/meals', json={'fdc_id': '171477', 'food_name': 'Odd date', 'serving_size': 1,
+                                    'serving_unit': 'g', 'calories': 1, 'logged_date': '01/02/2020'})
+
+    assert client.application.extensions['storage'].archive_meals(days_ago(180), batch=1) == 3
+    assert meal_logs_rows(client) == 4
+
+
+def test_archived_meals_can_be_edited_and_deleted(client):
+    storage = client.application.extensions['storage']
+    storage.archive_meals(days_ago(180), batch=100)
+    edited, deleted = client.get(f'/api/meals?date={days_ago(400)}').get_json()['meals']
+    cursor = client.get('/api/meals/changes?since=0').get_json()['cursor']
+
+    assert client.put(f"/api/meals/{edited['id']}", json={'calories': 10}).status_code == 200
+    assert client.delete(f"/api/meals/{deleted['id']}").status_code == 200
+
+    assert [meal['calories'] for meal in client.get(f'/api/meals?date={days_ago(400)}').get_json()['meals']] == [10]
+    changes = client.get(f'/api/meals/changes?since={cursor}').get_json()
+    assert [meal['id'] for meal in changes['meals']] == [edited['id']]
+    assert [tombstone['id'] for tombstone in changes['deleted']] == [deleted['id']]
+    totals = storage.connection().execute('SELECT calories, meal_count FROM daily_totals WHERE logged_date = ?',
+                                          (days_ago(400),)).fetchone()
+    assert tuple(totals) == (10, 1)
+    assert storage.archive_meals(days_ago(180), batch=100) == 1  # The edited meal goes back to its archive
+
+
+def test_archive_statements_are_timed(client, monkeypatch):
+    labels = []
+    monkeypatch.setattr(metrics, 'observe_query', lambda statement, seconds: labels.append(statement))
+
+    client.application.extensions['storage'].archive_meals(days_ago(180), batch=100)
+
+    assert {'select_archive_candidates', 'insert_archived_meals', 'delete_archived_meals'} <= set(labels)
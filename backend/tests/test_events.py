@@ -0,0 +1,19 @@
+def test_streams_past_the_cap_get_503_until_one_closes(make_client):
+    client = make_client(STREAM_MAX_PER_WORKER=1)
+
+    first = client.get('/api/stream', buffered=False)
+    second = client.get('/api/stream', buffered=False)
+    first.close()
+    third = client.get('/api/stream', buffered=False)
+    third.close()
+
+    assert (first.status_code, second.status_code, third.status_code) == (200, 503, 200)
+    assert second.headers['Retry-After'] == '5'
+
+
+def test_profiles_leave_out_the_query_string(make_client):
+    client = make_client(ADMIN_TOKEN='admin')
+
+    response = client.get('/api/meals?token=secret', headers={'X-Admin-Token': 'admin', 'X-Profile': '1'})
+
+    assert response.get_data(as_text=True).startswith('GET /api/meals -> 200\n')
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from group_commit import GroupCommitWriter, WriteTimeout
+from storage import MemoryStorage, SQLiteStorage
+
+
+def test_concurrent_writes_get_their_own_results():
+    storage = MemoryStorage()
+    writer = GroupCommitWriter(storage, max_delay=0.01)
+    results = {}
+
+    def log(n):
+        results[n] = writer.submit(lambda db: n)
+
+    threads = [threading.Thread(target=log, args=(n,)) for n in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {n: n for n in range(50)}
+
+
+def test_write_that_times_out_in_the_queue_is_never_run():
+    writer = GroupCommitWriter(MemoryStorage(), timeout=0.05)
+    running, release = threading.Event(), threading.Event()
+    blocker = threading.Thread(target=writer.submit, args=(lambda db: running.set() or release.wait(),))
+    blocker.start()
+    running.wait()  # The writer thread is busy, so the next write stays queued
+    ran = []
+
+    with pytest.raises(WriteTimeout):
+        writer.submit(lambda db: ran.append(True))
+    release.set()
+    blocker.join()
+    writer.submit(lambda db: None)  # The next batch has passed the dropped write
+    assert ran == []
+
+
+def test_read_then_write_batches_from_separate_connections_do_not_deadlock(tmp_path):
+    # Two storages on one file stand in for two gunicorn workers: each has its own connections
+    path = str(tmp_path / 'nutrivault.db')
+    SQLiteStorage(path).init()
+    writers = [GroupCommitWriter(SQLiteStorage(path), max_delay=0) for _ in range(2)]
+    errors = []
+
+    def log(writer, n):
+        def write(db):
+            db.idempotency.get(1, f'key-{n}', 60)  # Read first, like POST /api/meals
+            db.idempotency.add(1, f'key-{n}', 'hash', {'n': n}, 60)
+        try:
+            writer.submit(write)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=log, args=(writers[n % 2], n)) for n in range(200)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with SQLiteStorage(path).session() as db:
+        assert all(db.idempotency.get(1, f'key-{n}', 60) for n in range(200))
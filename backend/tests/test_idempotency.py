@@ -0,0 +1,100 @@
+import multiprocessing
+import threading
+import uuid
+
+from benchmarks.harness import load_app
+
+MEAL = {'fdc_id': '171477', 'food_name': 'Chicken breast', 'serving_size': 100, 'serving_unit': 'g',
+        'calories': 165, 'protein': 31, 'carbs': 0, 'fat': 3.6, 'meal_type': 'lunch', 'logged_date': '2026-01-05'}
+
+
+def meal_count(client):
+    return len(client.get('/api/meals?date=2026-01-05').get_json()['meals'])
+
+
+def test_retry_with_the_same_key_replays_the_first_response(make_client):
+    client = make_client()
+    headers = {'Idempotency-Key': 'meal-1'}
+
+    first = client.post('/api/meals', json=MEAL, headers=headers)
+    retry = client.post('/api/meals', json=MEAL, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert retry.get_json()['meal_id'] == first.get_json()['meal_id']
+    assert meal_count(client) == 1
+
+
+def test_same_key_with_a_different_body_is_rejected(make_client):
+    client = make_client()
+    headers = {'Idempotency-Key': 'meal-1'}
+    client.post('/api/meals', json=MEAL, headers=headers)
+
+    response = client.post('/api/meals', json={**MEAL, 'calories': 300}, headers=headers)
+
+    assert response.status_code == 422
+    assert meal_count(client) == 1
+
+
+def test_keys_are_scoped_per_user(make_client):
+    alice, bob = make_client('alice'), make_client('bob')
+    headers = {'Idempotency-Key': 'meal-1'}
+
+    assert alice.post('/api/meals', json=MEAL, headers=headers).status_code == 200
+    assert 'Idempotent-Replayed' not in bob.post('/api/meals', json=MEAL, headers=headers).headers
+    assert meal_count(bob) == 1
+
+
+def log_meals(database_path, threads, meals):
+    """Run in a separate process, like a gunicorn worker: POST meals with fresh keys; returns the error statuses"""
+    module = load_app(database_path, 'http://127.0.0.1:9',
+                      config={'PREFETCH_BUDGET': 0, 'SEARCH_PREFETCH_PAGES': 0, 'ARCHIVE_AFTER_DAYS': 0})
+    errors = []
+
+    def post():
+        client = module.app.test_client()
+        for _ in range(meals):
+            response = client.post('/api/meals', json=MEAL, headers={
+                'Authorization': 'Bearer alice', 'Idempotency-Key': str(uuid.uuid4())})
+            if response.status_code != 200:
+                errors.append((response.status_code, response.get_json()))
+
+    workers = [threading.Thread(target=post) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return errors
+
+
+def test_workers_logging_with_keys_on_one_database_do_not_fail(make_client, tmp_path):
+    client = make_client()
+    processes, threads, meals = 4, 4, 15
+
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.starmap(log_meals, [(str(tmp_path / 'nutrivault.db'), threads, meals)] * processes)
+
+    assert [error for errors in results for error in errors] == []
+    assert meal_count(client) == processes * threads * meals
+
+
+def test_saved_meal_log_replays_with_the_same_key(make_client):
+    client = make_client()
+    client.post('/api/saved-meals', json={'name': 'Lunch', 'components': [
+        {'fdc_id': '171477', 'serving_size': 100, 'serving_unit': 'g'},
+        {'fdc_id': '171287', 'serving_size': 2, 'serving_unit': 'large'}
+    ]})
+    saved_id = client.get('/api/saved-meals').get_json()['saved_meals'][0]['id']
+    body, headers = {'logged_date': '2026-01-05'}, {'Idempotency-Key': 'lunch-1'}
+
+    first = client.post(f'/api/saved-meals/{saved_id}/log', json=body, headers=headers)
+    retry = client.post(f'/api/saved-meals/{saved_id}/log', json=body, headers=headers)
+    other_date = client.post(f'/api/saved-meals/{saved_id}/log', json={'logged_date': '2026-01-06'}, headers=headers)
+    meal_endpoint = client.post('/api/meals', json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['meal_ids'] == first.get_json()['meal_ids']
+    assert other_date.status_code == meal_endpoint.status_code == 422
+    assert meal_count(client) == 2
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+DAY = '2026-01-05'
+
+
+@pytest.fixture
+def client(make_client):
+    client = make_client()
+    for calories in (100, 200, 300):
+        client.post('/api/meals', json={'fdc_id': '171477', 'food_name': f'Meal {calories}', 'serving_size': 100,
+                                        'serving_unit': 'g', 'calories': calories, 'logged_date': DAY})
+    return client
+
+
+def meal_ids(client):
+    return sorted(meal['id'] for meal in client.get(f'/api/meals?date={DAY}').get_json()['meals'])
+
+
+def day_totals(client):
+    storage = client.application.extensions['storage']
+    row = storage.connection().execute('SELECT calories, meal_count FROM daily_totals WHERE logged_date = ?',
+                                       (DAY,)).fetchone()
+    return tuple(row)
+
+
+def at_once(client, request, count=8):
+    """count threads, each with its own client (and so its own connection), sending request(client) together"""
+    start = threading.Barrier(count)
+    statuses = []
+
+    def run():
+        thread_client = client.application.test_client()
+        thread_client.environ_base.update(client.environ_base)
+        start.wait()
+        statuses.append(request(thread_client).status_code)
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(statuses)
+
+
+def test_concurrent_deletes_of_one_meal_apply_once(client):
+    meal_id = meal_ids(client)[0]
+
+    statuses = at_once(client, lambda c: c.delete(f'/api/meals/{meal_id}'))
+
+    assert statuses == [200] + [404] * 7
+    assert day_totals(client) == (500, 2)
+    assert client.get('/api/meals/changes?since=0').get_json()['deleted'] == [{'id': meal_id, 'change_seq': 4}]
+
+
+def test_concurrent_edits_keep_totals_equal_to_the_meals(client):
+    meal_id = meal_ids(client)[0]
+
+    statuses = at_once(client, lambda c: c.put(f'/api/meals/{meal_id}', json={'calories': 150}))
+
+    assert statuses == [200] * 8
+    assert day_totals(client) == (650, 3)
+
+
+def test_changes_page_through_edits_and_tombstones(client):
+    first, second, third = meal_ids(client)
+    client.put(f'/api/meals/{first}', json={'calories': 150})
+    client.delete(f'/api/meals/{second}')
+
+    page = client.get('/api/meals/changes?since=0&limit=2').get_json()
+    rest = client.get(f"/api/meals/changes?since={page['cursor']}").get_json()
+    done = client.get(f"/api/meals/changes?since={rest['cursor']}").get_json()
+
+    # Sequence: 1-3 inserts, 4 the edit of the first meal, 5 the delete of the second (1 and 2 were superseded)
+    assert [meal['id'] for meal in page['meals']] == [third, first] and page['deleted'] == []
+    assert (page['cursor'], page['has_more']) == (4, True)
+    assert rest['meals'] == [] and rest['deleted'] == [{'id': second, 'change_seq': 5}]
+    assert (rest['cursor'], rest['has_more']) == (5, False)
+    assert (done['meals'], done['deleted'], done['cursor']) == ([], [], 5)
+
+
+def test_deleting_a_missing_meal_leaves_no_tombstone(client):
+    assert client.delete('/api/meals/999').status_code == 404
+    assert client.get('/api/meals/changes?since=0').get_json()['deleted'] == []
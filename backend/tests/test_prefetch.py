@@ -0,0 +1,13 @@
+from storage import SQLiteStorage
+
+
+def test_the_budget_is_shared_by_workers(tmp_path):
+    path = str(tmp_path / 'nutrivault.db')
+    SQLiteStorage(path).init()
+    # Two storages on one file stand in for two gunicorn workers
+    workers = [SQLiteStorage(path), SQLiteStorage(path)]
+
+    claims = [workers[n % 2].claim_budget('prefetch_usda', 60, 5) for n in range(8)]
+
+    assert claims == [True] * 5 + [False] * 3
+    assert workers[0].claim_budget('prefetch_usda', 0, 5)  # A new interval refills it
@@ -0,0 +1,31 @@
+FOODS = ('171477', '171287', '168878', '173944', '171688', '170379', '175168', '173904')
+GOALS = {'goal_type': 'maintenance', 'current_weight': 70, 'target_weight': 70, 'activity_level': 'moderate'}
+
+
+def client_with_foods(make_client):
+    client = make_client()
+    for fdc_id in FOODS:
+        client.get(f'/api/food/{fdc_id}')  # Stores the food's per-100 g macros
+    return client
+
+
+def test_goals_are_required(make_client):
+    client = client_with_foods(make_client)
+
+    assert client.get('/api/recommendations').status_code == 400
+
+
+def test_recommendations_fill_the_remaining_budget_without_repeating_meals(make_client):
+    client = client_with_foods(make_client)
+    client.post('/api/dietary-goals', json=GOALS)
+    client.post('/api/meals', json={'fdc_id': '171477', 'serving_size': 200, 'serving_unit': 'g',
+                                    'logged_date': '2026-01-05'})
+
+    result = client.get('/api/recommendations?date=2026-01-05&k=3').get_json()
+
+    assert result['candidates'] == len(FOODS)
+    assert result['remaining']['calories'] == 2387 - 330  # 200 g of chicken breast at 165 kcal per 100 g
+    recommendations = result['recommendations']
+    assert len(recommendations) == 3 and '171477' not in [food['fdcId'] for food in recommendations]
+    assert [food['score'] for food in recommendations] == sorted(food['score'] for food in recommendations)
+    assert all(food['servingGrams'] > 0 for food in recommendations)
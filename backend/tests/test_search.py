@@ -0,0 +1,27 @@
+import pytest
+
+# The stub answers an unrecorded query with all 12 fixture foods
+
+
+@pytest.mark.parametrize('args, page, page_size, count, has_more', [
+    ('', 1, 10, 10, True),
+    ('?page=2&pageSize=5', 2, 5, 5, True),
+    ('?page=3&pageSize=5', 3, 5, 2, False),
+    ('?page=9&pageSize=5', 9, 5, 0, False),
+    ('?page=0&pageSize=0', 1, 1, 1, True),
+    ('?pageSize=1000', 1, 200, 12, False),
+])
+def test_pages_are_bounded(make_client, args, page, page_size, count, has_more):
+    result = make_client().get(f'/api/search/zzz{args}').get_json()
+
+    assert (result['page'], result['pageSize'], len(result['foods']), result['hasMore']) == (page, page_size, count, has_more)
+    assert result['totalHits'] == 12
+
+
+def test_pages_are_cached_separately(make_client, usda):
+    client = make_client()
+    first = client.get('/api/search/zzz?page=1&pageSize=5').get_json()
+    second = client.get('/api/search/zzz?page=2&pageSize=5').get_json()
+
+    assert client.get('/api/search/ZZZ?page=2&pageSize=5').get_json() == second
+    assert {food['fdcId'] for food in first['foods']}.isdisjoint(food['fdcId'] for food in second['foods'])
@@ -0,0 +1,38 @@
+import multiprocessing
+
+from search_queries import QueryStats
+
+
+def search(storage_dir, queries):
+    """Run in a separate process, like a gunicorn worker: count the queries and write them out"""
+    stats = QueryStats(storage_dir=storage_dir)
+    for raw, key in queries:
+        stats.record(raw, key)
+    stats.top()  # Writes this process' file
+
+
+def test_counts_are_merged_across_workers(tmp_path):
+    storage_dir = str(tmp_path / 'search-queries')
+    workers = [
+        [('Chicken Breast', 'breast chicken'), ('chicken breast', 'breast chicken'), ('eggs', 'egg')],
+        [('breast, chicken', 'breast chicken'), ('chicken breast', 'breast chicken')],
+    ]
+
+    with multiprocessing.get_context('spawn').Pool(len(workers)) as pool:
+        pool.starmap(search, [(storage_dir, queries) for queries in workers])
+
+    stats = QueryStats(storage_dir=storage_dir).top()
+    assert (stats['keys'], stats['requests'], stats['raw_queries']) == (2, 5, 4)
+    assert stats['top'][0] == {'key': 'breast chicken', 'requests': 4, 'variants': 3,
+                               'examples': ['Chicken Breast', 'breast, chicken', 'chicken breast']}
+
+
+def test_reset_clears_every_worker(tmp_path):
+    storage_dir = str(tmp_path / 'search-queries')
+    search(storage_dir, [('eggs', 'egg')])
+    other = QueryStats(storage_dir=storage_dir)
+    other.record('egg', 'egg')
+
+    QueryStats(storage_dir=storage_dir).reset()
+
+    assert other.top()['requests'] == 0
@@ -0,0 +1,37 @@
+import pytest
+
+import servings
+from nutrients import classify_nutrient
+
+
+def test_saturated_fat_is_not_total_fat():
+    assert classify_nutrient('Fatty acids, total saturated') == ('other', 'Fatty acids, total saturated')
+    assert classify_nutrient('Total lipid (fat)') == ('macro', 'fat')
+
+
+def test_fat_comes_only_from_total_lipid():
+    food = {'macronutrients': {'calories': {'name': 'Energy', 'amount': 100, 'unit': 'KCAL'},
+                               'fat': {'name': 'Fatty acids, total saturated', 'amount': 1.2, 'unit': 'G'}}}
+
+    assert servings.per_100g(food)['fat'] is None
+    food['macronutrients']['fat'] = {'name': 'Total lipid (fat)', 'amount': 3.6, 'unit': 'G'}
+    assert servings.per_100g(food)['fat'] == 3.6
+
+
+def test_missing_nutrients_are_none_not_zero():
+    food = {'fdc_id': '1', 'portions': {}, 'calories': 200, 'protein': 10, 'carbs': None, 'fat': None,
+            'sodium': None, 'sugar': None}
+
+    assert servings.serving_nutrients(food, 50, 'g') == {'calories': 100, 'protein': 5, 'carbs': None, 'fat': None,
+                                                         'sodium': None, 'sugar': None}
+    with pytest.raises(ValueError):
+        servings.serving_nutrients({**food, 'calories': None}, 50, 'g')
+
+
+def test_meal_without_calories_or_fdc_id_is_a_bad_request(make_client):
+    client = make_client()
+
+    response = client.post('/api/meals', json={'food_name': 'Mystery', 'serving_size': 1, 'serving_unit': 'g'})
+
+    assert response.status_code == 400
+    assert client.get('/api/meals').get_json()['meals'] == []
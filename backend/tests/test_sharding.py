@@ -0,0 +1,108 @@
+from datetime import date
+
+import pytest
+
+from storage import ShardedStorage, SQLiteStorage
+
+TODAY = date.today().isoformat()
+VOLATILE = {'id', 'meal_id', 'meal_ids', 'logged_at', 'created_at', 'updated_at', 'searchedAt', 'timestamp'}
+
+
+def stable(value):
+    """A response with ids and timestamps removed, which legitimately differ between backends"""
+    if isinstance(value, dict):
+        return {key: stable(item) for key, item in value.items() if key not in VOLATILE}
+    if isinstance(value, list):
+        return [stable(item) for item in value]
+    return value
+
+
+def session(client, uid, meals):
+    responses = [
+        client.post('/api/dietary-goals', json={'goal_type': 'maintenance', 'current_weight': 70,
+                                                'target_weight': 70, 'activity_level': 'moderate'}),
+        client.post('/api/profile/update', json={'age': 30, 'weight': 70, 'height': 175,
+                                                 'activity_level': 'moderate', 'dietary_goal': 'maintenance'}),
+    ]
+    for n in range(meals):
+        responses.append(client.post('/api/meals', json={
+            'fdc_id': '171477', 'food_name': f'{uid} meal {n}', 'serving_size': 100, 'serving_unit': 'g',
+            'calories': 400 + n, 'protein': 30, 'carbs': 20, 'fat': 10, 'sodium': 900, 'logged_date': TODAY
+        }, headers={'Idempotency-Key': f'{uid}-{n}'}))
+    ids = [meal['id'] for meal in client.get('/api/meals').get_json()['meals']]
+    responses += [
+        client.put(f'/api/meals/{ids[0]}', json={'calories': 700}),
+        client.delete(f'/api/meals/{ids[-1]}'),
+        client.post('/api/saved-meals', json={'name': 'Breakfast', 'components': [
+            {'fdc_id': '171287', 'serving_size': 2, 'serving_unit': 'large'},
+            {'fdc_id': '173944', 'serving_size': 150, 'serving_unit': 'g'}
+        ]}),
+    ]
+    saved_id = client.get('/api/saved-meals').get_json()['saved_meals'][0]['id']
+    responses += [
+        client.post(f'/api/saved-meals/{saved_id}/log', json={'logged_date': TODAY, 'meal_type': 'breakfast'}),
+        client.post('/api/history', json={'fdcId': '171477', 'foodName': 'Chicken', 'nutritionData': {'fdcId': 171477}}),
+    ]
+    for path in ('/api/profile', '/api/meals', '/api/meals/changes?since=0', '/api/nutrition-summary', '/api/alerts',
+                 '/api/analytics/trends?days=7', '/api/saved-meals', '/api/history', '/api/dashboard'):
+        responses.append(client.get(path))
+    return [(response.status_code, stable(response.get_json())) for response in responses]
+
+
+def run(make_client, tmp_path, backend):
+    config = {'STORAGE_BACKEND': backend, 'SHARD_COUNT': 3, 'DATABASE_PATH': str(tmp_path / backend / 'nutrivault.db')}
+    (tmp_path / backend).mkdir()
+    alice, bob, carol = (make_client(uid, **config) for uid in ('alice', 'bob', 'carol'))
+    # Interleaved, so the single file mixes the users' rows while each shard gets its own user
+    return [session(alice, 'alice', 3), session(bob, 'bob', 5), session(carol, 'carol', 1), session(alice, 'alice', 2)]
+
+
+def test_sharded_storage_answers_like_a_single_file(make_client, tmp_path):
+    single = run(make_client, tmp_path, 'sqlite')
+    sharded = run(make_client, tmp_path, 'sharded')
+
+    assert all(status == 200 for responses in single for status, _ in responses)
+    assert sharded == single
+
+
+def test_directory_holds_only_shared_tables(tmp_path):
+    storage = ShardedStorage(str(tmp_path / 'nutrivault.db'), 2)
+    storage.init()
+
+    tables = {row[0] for row in storage.directory.connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'users', 'foods'} <= tables
+    assert not tables & {'meal_logs', 'history_slots', 'event_outbox', 'idempotency_keys', 'saved_meals'}
+
+
+def test_sharded_refuses_a_single_file_database_with_users(tmp_path):
+    path = str(tmp_path / 'nutrivault.db')
+    storage = SQLiteStorage(path)
+    storage.init()
+    with storage.session() as db:
+        db.users.login('alice', 'alice@example.com')
+
+    with pytest.raises(RuntimeError, match="STORAGE_BACKEND='sqlite'"):
+        ShardedStorage(path, 2).init()
+
+
+def test_shard_count_cannot_change(tmp_path):
+    path = str(tmp_path / 'nutrivault.db')
+    ShardedStorage(path, 2).init()
+
+    with pytest.raises(RuntimeError, match='SHARD_COUNT=2'):
+        ShardedStorage(path, 4).init()
+    with pytest.raises(RuntimeError):
+        SQLiteStorage(path).init()
+
+
+def test_sharded_refuses_a_single_file_database_from_before_layouts(tmp_path):
+    path = str(tmp_path / 'nutrivault.db')
+    storage = SQLiteStorage(path)
+    storage.init()
+    with storage.session() as db:
+        db.users.login('alice', 'alice@example.com')
+        db.cursor.execute('DELETE FROM storage_layout')
+
+    with pytest.raises(RuntimeError, match="STORAGE_BACKEND='sqlite'"):
+        ShardedStorage(path, 2).init()
+    assert not (tmp_path / 'nutrivault.shard0.db').exists()
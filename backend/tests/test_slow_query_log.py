@@ -0,0 +1,18 @@
+import sqlite3
+
+from slow_query_log import SlowQueryLog
+
+
+def test_aggregates_survive_a_new_instance_and_reset_clears_them(tmp_path):
+    connection = sqlite3.connect(':memory:')
+    log = SlowQueryLog(threshold_ms=0, storage_dir=str(tmp_path))
+    for seconds in (0.01, 0.03):
+        log.record('select_one', 'SELECT  1', (), seconds, connection)
+
+    top = log.top()
+    # Another instance stands in for another worker reading the same directory
+    assert SlowQueryLog(storage_dir=str(tmp_path)).top() == top
+    assert (top[0]['label'], top[0]['sql'], top[0]['count'], top[0]['max_ms']) == ('select_one', 'SELECT N', 2, 30.0)
+
+    SlowQueryLog(storage_dir=str(tmp_path)).reset()
+    assert log.top() == []
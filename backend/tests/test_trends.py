@@ -0,0 +1,44 @@
+from datetime import date
+
+import storage
+
+TODAY = date.today().isoformat()
+
+
+def log(client, calories):
+    client.post('/api/meals', json={'fdc_id': '171477', 'food_name': 'Meal', 'serving_size': 100,
+                                    'serving_unit': 'g', 'calories': calories, 'logged_date': TODAY})
+
+
+def today(client):
+    return client.get('/api/analytics/trends?days=7').get_json()['series'][-1]
+
+
+def test_a_write_in_another_worker_invalidates_cached_trends(make_client):
+    # Two apps on one database stand in for two gunicorn workers with their own caches
+    worker, other = make_client(), make_client()
+    log(worker, 500)
+    assert today(worker)['calories'] == 500
+    assert len(worker.application.extensions['trends_cache']) == 1
+
+    log(other, 300)
+    meal_id = other.get('/api/meals').get_json()['meals'][0]['id']
+    assert today(worker)['calories'] == 800
+
+    other.delete(f'/api/meals/{meal_id}')
+    assert today(worker)['calories'] == 500
+
+
+def test_trends_are_computed_once_until_the_user_writes(make_client, monkeypatch):
+    client = make_client()
+    log(client, 500)
+    calls = []
+    trend_rows = storage.SQLiteMeals.trend_rows
+    monkeypatch.setattr(storage.SQLiteMeals, 'trend_rows', lambda *args: calls.append(1) or trend_rows(*args))
+
+    first, again = today(client), today(client)
+    log(client, 100)
+    after_write = today(client)
+
+    assert first == again and after_write['calories'] == 600
+    assert len(calls) == 2
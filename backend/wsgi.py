@@ -0,0 +1,12 @@
+# Production WSGI entrypoint: `gunicorn wsgi:app` (gunicorn.conf.py preloads it)
+import gc
+
+from app import create_app, warm_caches
+
+app = create_app()
+warm_caches(app)
+
+# With --preload this module runs once in the gunicorn master. Moving everything
+# allocated so far into the permanent generation keeps the garbage collector from
+# touching (and thereby un-sharing) those pages in the forked workers.
+gc.freeze()
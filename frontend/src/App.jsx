@@ -15,8 +15,9 @@ import { AuthProvider, useAuth } from './contexts/AuthContext';
 import { nutritionAPI } from './services/api';
 
 function MainApp() {
-  const { user, loading } = useAuth();
+  const { user, loading, dashboard } = useAuth();
   const [searchResults, setSearchResults] = useState([]);
+  const [searchPage, setSearchPage] = useState({ query: '', page: 0, hasMore: false });
   const [selectedFood, setSelectedFood] = useState(null);
   const [nutritionData, setNutritionData] = useState(null);
   const [searchHistory, setSearchHistory] = useState([]);
@@ -34,9 +35,19 @@ function MainApp() {
   // Check backend health on mount
   useEffect(() => {
     checkBackendHealth();
-    loadSearchHistory();
   }, []);
 
+  // Reload history whenever the signed-in user changes (history is per-user)
+  useEffect(() => {
+    if (loading) return;
+    // Signed-in users got their history with the sign-in dashboard request
+    if (user && dashboard?.history) {
+      setSearchHistory(dashboard.history);
+    } else {
+      loadSearchHistory();
+    }
+  }, [user, loading]);
+
   const checkBackendHealth = async () => {
     try {
       await nutritionAPI.healthCheck();
@@ -57,7 +68,8 @@ function MainApp() {
 
   const loadSearchHistory = async () => {
     try {
-      const response = await nutritionAPI.getHistory();
+      const idToken = user ? await user.getIdToken() : null;
+      const response = await nutritionAPI.getHistory(idToken);
       if (response.success) {
         setSearchHistory(response.history);
       }
@@ -75,6 +87,7 @@ function MainApp() {
       
       if (response.success) {
         setSearchResults(response.foods || []);
+        setSearchPage({ query, page: response.page || 1, hasMore: Boolean(response.hasMore) });
         
         if (response.foods && response.foods.length === 0) {
           showToast('No foods found for your search query', 'warning');
@@ -98,8 +111,25 @@ function MainApp() {
     }
   };
 
+  const handleLoadMore = async () => {
+    const { query, page } = searchPage;
+    setIsLoading(true);
+    try {
+      const response = await nutritionAPI.searchFoods(query, page + 1);
+      if (response.success) {
+        setSearchResults((results) => [...results, ...(response.foods || [])]);
+        setSearchPage({ query, page: response.page || page + 1, hasMore: Boolean(response.hasMore) });
+      }
+    } catch (error) {
+      showToast('Could not load more results. Please try again.', 'error');
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
   const handleClearSearch = () => {
     setSearchResults([]);
+    setSearchPage({ query: '', page: 0, hasMore: false });
     setError(null);
   };
 
@@ -115,11 +145,12 @@ function MainApp() {
         showToast(`Loaded nutrition data for ${food.description}`, 'success');
         
         // Add to history
+        const idToken = user ? await user.getIdToken() : null;
         await nutritionAPI.addToHistory({
           fdcId: food.fdcId,
           foodName: food.description,
           nutritionData: response.food
-        });
+        }, idToken);
         
         // Refresh history
         loadSearchHistory();
@@ -333,6 +364,17 @@ function MainApp() {
                 />
               ))}
             </div>
+            {searchPage.hasMore && (
+              <div className="flex justify-center mt-6">
+                <button
+                  onClick={handleLoadMore}
+                  disabled={isLoading}
+                  className="px-6 py-2 bg-primary-600 text-white rounded-md hover:bg-primary-700 disabled:opacity-50 transition-colors"
+                >
+                  Load more
+                </button>
+              </div>
+            )}
           </div>
         )}
 
@@ -374,6 +416,7 @@ function MainApp() {
         isOpen={isModalOpen}
         onClose={handleCloseModal}
         onLogMeal={handleOpenMealLog}
+        onSelectFood={handleFoodClick}
         user={user}
       />
 
@@ -401,6 +444,10 @@ function MainApp() {
           onClose={handleCloseMealLog}
           food={selectedFood}
           nutritionData={nutritionData}
+          onAlerts={(alerts) => showToast(
+            `Daily limit passed: ${alerts.map((a) => `${a.nutrient} ${a.amount}${a.unit} / ${a.threshold}${a.unit}`).join(', ')}`,
+            'warning'
+          )}
         />
       )}
 
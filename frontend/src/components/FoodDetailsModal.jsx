@@ -1,8 +1,33 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
 import { X, Apple, Zap, Activity, Info, Plus } from 'lucide-react';
 import NutritionChart from './NutritionChart';
+import { nutritionAPI } from '../services/api';
+
+const SIMILAR_OPTIONS = [
+  { label: 'Similar', adjust: [] },
+  { label: 'More protein', adjust: ['more_protein'] },
+  { label: 'Less fat', adjust: ['less_fat'] },
+  { label: 'Fewer calories', adjust: ['less_calories'] },
+];
+
+const FoodDetailsModal = ({ food, nutritionData, isOpen, onClose, onLogMeal, onSelectFood, user }) => {
+  const [similarOption, setSimilarOption] = useState(0);
+  const [similarFoods, setSimilarFoods] = useState(null);
+
+  useEffect(() => {
+    setSimilarOption(0);
+  }, [food?.fdcId]);
+
+  useEffect(() => {
+    if (!isOpen || !food || !nutritionData) return;
+    let cancelled = false;
+    setSimilarFoods(null);
+    nutritionAPI.getSimilarFoods(food.fdcId, SIMILAR_OPTIONS[similarOption].adjust)
+      .then((response) => { if (!cancelled) setSimilarFoods(response.similar || []); })
+      .catch(() => { if (!cancelled) setSimilarFoods([]); });
+    return () => { cancelled = true; };
+  }, [isOpen, food?.fdcId, nutritionData, similarOption]);
 
-const FoodDetailsModal = ({ food, nutritionData, isOpen, onClose, onLogMeal, user }) => {
   if (!isOpen || !food) return null;
 
   const renderNutrientValue = (nutrient) => {
@@ -138,6 +163,48 @@ const FoodDetailsModal = ({ food, nutritionData, isOpen, onClose, onLogMeal, use
     );
   };
 
+  const renderSimilarFoods = () => (
+    <div className="mt-6">
+      <div className="flex items-center justify-between mb-4">
+        <h4 className="text-lg font-semibold text-gray-900">Foods Like This</h4>
+        <div className="flex space-x-2">
+          {SIMILAR_OPTIONS.map((option, index) => (
+            <button
+              key={option.label}
+              onClick={() => setSimilarOption(index)}
+              className={`px-3 py-1 text-sm rounded-full transition-colors ${
+                index === similarOption ? 'bg-green-600 text-white' : 'bg-gray-100 text-gray-700 hover:bg-gray-200'
+              }`}
+            >
+              {option.label}
+            </button>
+          ))}
+        </div>
+      </div>
+      {similarFoods === null ? (
+        <p className="text-sm text-gray-500">Finding similar foods...</p>
+      ) : similarFoods.length === 0 ? (
+        <p className="text-sm text-gray-500">No matching foods yet.</p>
+      ) : (
+        <div className="grid grid-cols-1 md:grid-cols-2 gap-3">
+          {similarFoods.map((item) => (
+            <button
+              key={item.fdcId}
+              onClick={() => onSelectFood?.({ fdcId: item.fdcId, description: item.description })}
+              className="text-left py-2 px-3 bg-gray-50 rounded hover:bg-gray-100 transition-colors"
+            >
+              <div className="text-sm font-medium text-gray-900 truncate">{item.description}</div>
+              <div className="text-xs text-gray-600">
+                per 100 g: {item.per100g.calories} kcal, {item.per100g.protein} g protein,{' '}
+                {item.per100g.carbs} g carbs, {item.per100g.fat} g fat
+              </div>
+            </button>
+          ))}
+        </div>
+      )}
+    </div>
+  );
+
   return (
     <div className="fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center p-4 z-50">
       <div className="bg-white rounded-2xl max-w-4xl w-full max-h-[90vh] overflow-hidden flex flex-col">
@@ -198,6 +265,9 @@ const FoodDetailsModal = ({ food, nutritionData, isOpen, onClose, onLogMeal, use
               
               {/* Other Important Nutrients */}
               {renderOtherNutrients()}
+
+              {/* Nearest foods by macros (GET /api/food/<fdc_id>/similar) */}
+              {renderSimilarFoods()}
             </div>
           )}
         </div>
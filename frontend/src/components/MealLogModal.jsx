@@ -3,23 +3,27 @@ import { X, Plus, Utensils, Calendar } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
 import { nutritionAPI } from '../services/api';
 
-const MealLogModal = ({ isOpen, onClose, food, nutritionData }) => {
+const MealLogModal = ({ isOpen, onClose, food, nutritionData, onAlerts }) => {
   const { user } = useAuth();
   const [servingSize, setServingSize] = useState(100);
+  const [servingUnit, setServingUnit] = useState('g');
   const [mealDate, setMealDate] = useState(new Date().toISOString().split('T')[0]);
   const [isLogging, setIsLogging] = useState(false);
   const [error, setError] = useState('');
 
-  // Calculate nutrition values based on serving size
+  // Grams, ounces, and the food's own portions (cup, slice, ...) as grams per unit
+  const unitGrams = { g: 1, oz: 28.3495, ...(nutritionData?.portions || {}) };
+
+  // Preview only: the backend computes the logged nutrients from fdc_id and the serving
   const getMacro = (key) => nutritionData?.macronutrients?.[key]?.amount ?? 0;
   const calculateNutrition = (macroKey, baseAmount = 100) => {
     const value = getMacro(macroKey);
     if (!nutritionData || value === undefined || value === null) return 0;
-    return (value * servingSize) / baseAmount;
+    return (value * servingSize * (unitGrams[servingUnit] ?? 1)) / baseAmount;
   };
 
   const handleLogMeal = async () => {
-    if (!user || !food || !nutritionData) {
+    if (!user || !food) {
       setError('Missing required information');
       return;
     }
@@ -30,16 +34,12 @@ const MealLogModal = ({ isOpen, onClose, food, nutritionData }) => {
     try {
       const token = await user.getIdToken();
       
-      // Prepare meal data
+      // Prepare meal data; nutrients are computed server-side from the serving
       const mealData = {
         fdc_id: food.fdcId,
         food_name: food.description,
         serving_size: parseFloat(servingSize),
-        serving_unit: 'g',  // Default to grams
-        calories: calculateNutrition('calories'),
-        protein: calculateNutrition('protein'),
-        carbs: calculateNutrition('carbohydrates'),
-        fat: calculateNutrition('fat'),
+        serving_unit: servingUnit,
         meal_type: 'other',  // Default meal type
         logged_date: mealDate
       };
@@ -47,6 +47,7 @@ const MealLogModal = ({ isOpen, onClose, food, nutritionData }) => {
       const response = await nutritionAPI.logMeal(token, mealData);
 
       if (response.success) {
+        if (response.alerts?.length) onAlerts?.(response.alerts);
         onClose();
         // You could emit an event or call a callback to refresh nutrition summary
       } else {
@@ -105,17 +106,28 @@ const MealLogModal = ({ isOpen, onClose, food, nutritionData }) => {
           {/* Serving Size Input */}
           <div>
             <label htmlFor="servingSize" className="block text-sm font-medium text-gray-700 mb-1">
-              Serving Size (grams)
+              Serving Size
             </label>
-            <input
-              type="number"
-              id="servingSize"
-              value={servingSize}
-              onChange={(e) => setServingSize(Math.max(1, parseFloat(e.target.value) || 1))}
-              className="w-full px-3 py-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-green-500 focus:border-green-500"
-              min="1"
-              step="0.1"
-            />
+            <div className="flex space-x-2">
+              <input
+                type="number"
+                id="servingSize"
+                value={servingSize}
+                onChange={(e) => setServingSize(Math.max(0.1, parseFloat(e.target.value) || 1))}
+                className="flex-1 px-3 py-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-green-500 focus:border-green-500"
+                min="0.1"
+                step="0.1"
+              />
+              <select
+                value={servingUnit}
+                onChange={(e) => setServingUnit(e.target.value)}
+                className="px-3 py-2 border border-gray-300 rounded-md focus:ring-2 focus:ring-green-500 focus:border-green-500"
+              >
+                {Object.keys(unitGrams).map((unit) => (
+                  <option key={unit} value={unit}>{unit}</option>
+                ))}
+              </select>
+            </div>
           </div>
 
           {/* Date Input */}
@@ -137,7 +149,7 @@ const MealLogModal = ({ isOpen, onClose, food, nutritionData }) => {
 
           {/* Calculated Nutrition */}
           <div className="bg-gray-50 rounded-lg p-4">
-            <h4 className="font-medium text-gray-900 mb-3">Nutrition for {servingSize}g</h4>
+            <h4 className="font-medium text-gray-900 mb-3">Nutrition for {servingSize} {servingUnit}</h4>
             <div className="grid grid-cols-2 gap-3 text-sm">
               <div className="flex justify-between">
                 <span className="text-gray-600">Calories:</span>
@@ -4,7 +4,7 @@ import { useAuth } from '../contexts/AuthContext';
 import { nutritionAPI } from '../services/api';
 
 const UserDashboard = ({ isOpen, onClose }) => {
-  const { user, userProfile, logout, refreshUserProfile } = useAuth();
+  const { user, userProfile, dashboard, loading, logout, refreshUserProfile } = useAuth();
   const [activeTab, setActiveTab] = useState('profile');
   const [isEditing, setIsEditing] = useState(false);
   const [editProfile, setEditProfile] = useState({
@@ -15,6 +15,9 @@ const UserDashboard = ({ isOpen, onClose }) => {
     dietary_goal: 'maintain'
   });
   const [nutritionSummary, setNutritionSummary] = useState(null);
+  const [alerts, setAlerts] = useState([]);
+  const [recentMeals, setRecentMeals] = useState([]);
+  const [trends, setTrends] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
   const [toast, setToast] = useState({ message: '', type: '', visible: false });
 
@@ -28,16 +31,110 @@ const UserDashboard = ({ isOpen, onClose }) => {
         dietary_goal: userProfile.dietary_goal || 'maintain'
       });
     }
-    loadNutritionSummary();
   }, [userProfile]);
 
+  // Load once per signed-in user (after AuthContext's sign-in dashboard request, which it reuses);
+  // after that the event stream below keeps the dashboard current
+  useEffect(() => {
+    if (!loading) {
+      loadNutritionSummary();
+    }
+  }, [user, loading]);
+
+  // Changes from this and other tabs/devices arrive over /api/stream instead of being refetched
+  useEffect(() => {
+    if (!user) return undefined;
+    let source = null;
+    let lastEventId = null;
+    let retryTimer = null;
+    let stopped = false;
+
+    const connect = async () => {
+      try {
+        const token = await user.getIdToken();
+        if (stopped) return;
+        source = nutritionAPI.openEventStream(token, lastEventId);
+      } catch (error) {
+        retryTimer = setTimeout(connect, 5000);
+        return;
+      }
+      const listen = (type, handler) => {
+        source.addEventListener(type, (event) => {
+          lastEventId = event.lastEventId || lastEventId;
+          handler(JSON.parse(event.data));
+        });
+      };
+      listen('summary', applySummaryEvent);
+      listen('goals', applyGoalsEvent);
+      listen('profile', () => refreshUserProfile());
+      source.onerror = () => {
+        // The browser reconnects dropped streams itself; a rejected (e.g. expired) token
+        // closes the stream, so reopen it with a fresh one
+        if (source.readyState === EventSource.CLOSED && !stopped) {
+          retryTimer = setTimeout(connect, 5000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      source?.close();
+    };
+  }, [user]);
+
+  const withProgress = (summary) => ({
+    ...summary,
+    progress: Object.fromEntries(['calories', 'protein', 'carbs', 'fat'].map((key) => [
+      key,
+      summary.goals?.[key] ? Math.round((summary.totals[key] / summary.goals[key]) * 1000) / 10 : 0
+    ]))
+  });
+
+  const applySummaryEvent = (data) => {
+    setNutritionSummary((summary) => (
+      summary && summary.date === data.date ? withProgress({ ...summary, totals: data.totals }) : summary
+    ));
+    if (data.alerts?.length) {
+      setAlerts((current) => [...data.alerts.map((alert) => ({ ...alert, day_total: alert.amount })), ...current]);
+    }
+    loadTrends();
+  };
+
+  const applyGoalsEvent = (data) => {
+    setNutritionSummary((summary) => (summary ? withProgress({ ...summary, goals: data.goals }) : summary));
+    loadTrends();
+  };
+
+  const loadTrends = async () => {
+    try {
+      const token = await user.getIdToken();
+      const response = await nutritionAPI.getTrends(token, 30);
+      if (response.success) {
+        setTrends(response.summary);
+      }
+    } catch (error) {
+      console.error('Failed to load trends:', error);
+    }
+  };
+
   const loadNutritionSummary = async () => {
     try {
       if (user) {
         const token = await user.getIdToken();
-        const response = await nutritionAPI.getNutritionSummary(token);
+        // The sign-in dashboard request (AuthContext) already has today's data
+        const [response, trendsResponse] = await Promise.all([
+          dashboard?.summary ? dashboard : nutritionAPI.getDashboard(token, ['summary', 'meals', 'alerts']),
+          nutritionAPI.getTrends(token, 30).catch(() => null)
+        ]);
         if (response.success) {
           setNutritionSummary(response.summary);
+          setAlerts(response.alerts);
+          setRecentMeals(response.meals.slice(0, 5));
+        }
+        if (trendsResponse?.success) {
+          setTrends(trendsResponse.summary);
         }
       }
     } catch (error) {
@@ -45,6 +142,7 @@ const UserDashboard = ({ isOpen, onClose }) => {
     }
   };
 
+
   const showToast = (message, type = 'info') => {
     setToast({ message, type, visible: true });
     setTimeout(() => setToast({ message: '', type: '', visible: false }), 3000);
@@ -413,12 +511,52 @@ const UserDashboard = ({ isOpen, onClose }) => {
                     </div>
                   </div>
 
+                  {/* Trends (rolling averages and streaks computed server-side) */}
+                  {trends && (
+                    <div className="bg-gray-50 rounded-lg p-6">
+                      <h3 className="text-lg font-semibold text-gray-900 mb-4">Trends</h3>
+                      <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
+                        {['7d', '30d', '90d'].map((window) => (
+                          <div key={window} className="bg-white rounded-lg p-4">
+                            <div className="text-sm font-medium text-gray-700 mb-1">{window} average</div>
+                            <div className="text-lg font-semibold text-gray-900">
+                              {trends.averages[window]?.calories ?? '-'} cal
+                            </div>
+                            <div className="text-xs text-gray-600">
+                              On target {trends.adherence[window]?.adherent_days || 0} of {trends.adherence[window]?.logged_days || 0} logged days
+                            </div>
+                          </div>
+                        ))}
+                      </div>
+                      <p className="text-sm text-gray-600 mt-4">
+                        Logging streak: {trends.streaks.current_logging} days · On-target streak: {trends.streaks.current_adherence} days
+                      </p>
+                    </div>
+                  )}
+
+                  {/* Intake Alerts (recorded when meals are logged) */}
+                  {alerts.length > 0 && (
+                    <div className="bg-yellow-50 border border-yellow-200 rounded-lg p-6">
+                      <h3 className="text-lg font-semibold text-gray-900 mb-4">Intake Alerts</h3>
+                      <div className="space-y-2">
+                        {alerts.map((alert) => (
+                          <div key={`${alert.date}-${alert.nutrient}`} className="flex justify-between text-sm">
+                            <span className="text-gray-700 capitalize">{alert.date}: {alert.nutrient}</span>
+                            <span className="font-medium text-yellow-800">
+                              {alert.day_total}{alert.unit} (limit {alert.threshold}{alert.unit})
+                            </span>
+                          </div>
+                        ))}
+                      </div>
+                    </div>
+                  )}
+
                   {/* Recent Meals */}
-                  {nutritionSummary.recent_meals && nutritionSummary.recent_meals.length > 0 && (
+                  {recentMeals.length > 0 && (
                     <div className="bg-gray-50 rounded-lg p-6">
                       <h3 className="text-lg font-semibold text-gray-900 mb-4">Recent Meals</h3>
                       <div className="space-y-3">
-                        {nutritionSummary.recent_meals.map((meal, index) => (
+                        {recentMeals.map((meal, index) => (
                           <div key={index} className="bg-white rounded-lg p-4 flex justify-between items-center">
                             <div>
                               <h4 className="font-medium text-gray-900">{meal.food_name}</h4>
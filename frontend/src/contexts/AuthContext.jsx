@@ -24,6 +24,8 @@ export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
   const [userProfile, setUserProfile] = useState(null);
+  // Everything else /api/dashboard returned at sign-in (summary, meals, alerts, history)
+  const [dashboard, setDashboard] = useState(null);
 
   const refreshUserProfile = async () => {
     if (user) {
@@ -51,10 +53,11 @@ export const AuthProvider = ({ children }) => {
           const response = await nutritionAPI.verifyUser(idToken);
           
           if (response.success) {
-            // Get user profile from backend
-            const profileResponse = await nutritionAPI.getUserProfile(idToken);
-            if (profileResponse.success) {
-              setUserProfile(profileResponse.profile);
+            // Profile and first-paint dashboard data in a single request
+            const dashboardResponse = await nutritionAPI.getDashboard(idToken);
+            if (dashboardResponse.success) {
+              setUserProfile(dashboardResponse.profile);
+              setDashboard(dashboardResponse);
             }
           }
         } catch (error) {
@@ -64,6 +67,7 @@ export const AuthProvider = ({ children }) => {
         // User is signed out
         setUser(null);
         setUserProfile(null);
+        setDashboard(null);
       }
       setLoading(false);
     });
@@ -123,6 +127,7 @@ export const AuthProvider = ({ children }) => {
   const value = {
     user,
     userProfile,
+    dashboard,
     loading,
     login,
     signup,
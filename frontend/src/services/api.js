@@ -49,10 +49,12 @@ api.interceptors.response.use(
 );
 
 export const nutritionAPI = {
-  // Search for foods
-  searchFoods: async (query) => {
+  // Search for foods; the backend prefetches the next page, so asking for page + 1 is fast
+  searchFoods: async (query, page = 1, pageSize = 10) => {
     try {
-      const response = await api.get(`/api/search/${encodeURIComponent(query)}`);
+      const response = await api.get(`/api/search/${encodeURIComponent(query)}`, {
+        params: { page, pageSize }
+      });
       return response.data;
     } catch (error) {
       throw new Error(error.response?.data?.error || 'Failed to search foods');
@@ -69,20 +71,34 @@ export const nutritionAPI = {
     }
   },
 
-  // Get search history
-  getHistory: async () => {
+  // Get foods with similar macros; adjust e.g. ['more_protein', 'less_fat']
+  getSimilarFoods: async (fdcId, adjust = [], k = 6) => {
+    try {
+      const params = { k };
+      if (adjust.length) params.adjust = adjust.join(',');
+      const response = await api.get(`/api/food/${fdcId}/similar`, { params });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to get similar foods');
+    }
+  },
+
+  // Get search history (per-user when an ID token is passed)
+  getHistory: async (idToken = null) => {
     try {
-      const response = await api.get('/api/history');
+      const headers = idToken ? { Authorization: `Bearer ${idToken}` } : {};
+      const response = await api.get('/api/history', { headers });
       return response.data;
     } catch (error) {
       throw new Error(error.response?.data?.error || 'Failed to get history');
     }
   },
 
-  // Add to search history
-  addToHistory: async (foodData) => {
+  // Add to search history (per-user when an ID token is passed)
+  addToHistory: async (foodData, idToken = null) => {
     try {
-      const response = await api.post('/api/history', foodData);
+      const headers = idToken ? { Authorization: `Bearer ${idToken}` } : {};
+      const response = await api.post('/api/history', foodData, { headers });
       return response.data;
     } catch (error) {
       throw new Error(error.response?.data?.error || 'Failed to add to history');
@@ -151,15 +167,23 @@ export const nutritionAPI = {
 
   // === MEAL LOGGING ENDPOINTS ===
   
-  // Log a meal (protected)
-  logMeal: async (idToken, mealData) => {
-    try {
-      const response = await api.post('/api/meals', mealData, {
-        headers: { Authorization: `Bearer ${idToken}` }
-      });
-      return response.data;
-    } catch (error) {
-      throw new Error(error.response?.data?.error || 'Failed to log meal');
+  // Log a meal (protected). Every attempt sends the same Idempotency-Key, so retrying
+  // after a timeout or 503 never logs the meal twice.
+  logMeal: async (idToken, mealData, attempts = 3) => {
+    const idempotencyKey = crypto.randomUUID();
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await api.post('/api/meals', mealData, {
+          headers: { Authorization: `Bearer ${idToken}`, 'Idempotency-Key': idempotencyKey }
+        });
+        return response.data;
+      } catch (error) {
+        const retryable = !error.response || error.response.status === 503;
+        if (!retryable || attempt >= attempts) {
+          throw new Error(error.response?.data?.error || 'Failed to log meal');
+        }
+        await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+      }
     }
   },
 
@@ -176,6 +200,132 @@ export const nutritionAPI = {
     }
   },
 
+  // Meals logged, edited or deleted since a cursor (protected). Start with since = 0, keep the
+  // returned cursor, and fetch again while has_more is true.
+  getMealChanges: async (idToken, since = 0) => {
+    try {
+      const response = await api.get('/api/meals/changes', {
+        headers: { Authorization: `Bearer ${idToken}` },
+        params: { since }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to sync meals');
+    }
+  },
+
+  // Edit a logged meal (protected)
+  updateMeal: async (idToken, mealId, changes) => {
+    try {
+      const response = await api.put(`/api/meals/${mealId}`, changes, {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to update meal');
+    }
+  },
+
+  // Delete a logged meal (protected)
+  deleteMeal: async (idToken, mealId) => {
+    try {
+      const response = await api.delete(`/api/meals/${mealId}`, {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to delete meal');
+    }
+  },
+
+  // Save a meal of several foods, e.g. { name: 'Breakfast', components: [{ fdc_id, serving_size, serving_unit }] }
+  // (protected). Nutrients are computed by the backend when it is saved.
+  saveMeal: async (idToken, savedMeal) => {
+    try {
+      const response = await api.post('/api/saved-meals', savedMeal, {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to save meal');
+    }
+  },
+
+  // Get saved meals (protected)
+  getSavedMeals: async (idToken) => {
+    try {
+      const response = await api.get('/api/saved-meals', {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to get saved meals');
+    }
+  },
+
+  // Log every food of a saved meal in one request (protected)
+  logSavedMeal: async (idToken, savedMealId, { loggedDate = null, mealType = 'other' } = {}) => {
+    try {
+      const body = { meal_type: mealType };
+      if (loggedDate) body.logged_date = loggedDate;
+      const response = await api.post(`/api/saved-meals/${savedMealId}/log`, body, {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to log saved meal');
+    }
+  },
+
+  // Delete a saved meal (protected)
+  deleteSavedMeal: async (idToken, savedMealId) => {
+    try {
+      const response = await api.delete(`/api/saved-meals/${savedMealId}`, {
+        headers: { Authorization: `Bearer ${idToken}` }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to delete saved meal');
+    }
+  },
+
+  // Get excessive-intake alerts for the last N days (protected)
+  getAlerts: async (idToken, days = 7) => {
+    try {
+      const response = await api.get('/api/alerts', {
+        headers: { Authorization: `Bearer ${idToken}` },
+        params: { days }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to get alerts');
+    }
+  },
+
+  // Get rolling averages, goal adherence and streaks (protected)
+  getTrends: async (idToken, days = 30) => {
+    try {
+      const response = await api.get('/api/analytics/trends', {
+        headers: { Authorization: `Bearer ${idToken}` },
+        params: { days }
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to get trends');
+    }
+  },
+
+  // Open the server-sent event stream of summary/goals/profile changes (protected).
+  // EventSource can't send headers, so the token goes in the query string
+  // (the backend's access log and profiles record the path without it).
+  openEventStream: (idToken, lastEventId = null) => {
+    const params = new URLSearchParams({ token: idToken });
+    if (lastEventId) {
+      params.set('last_event_id', lastEventId);
+    }
+    return new EventSource(`${API_BASE_URL}/api/stream?${params}`);
+  },
+
   // Get nutrition summary (protected)
   getNutritionSummary: async (idToken, date = null) => {
     try {
@@ -190,6 +340,21 @@ export const nutritionAPI = {
     }
   },
 
+  // Get profile, summary, meals, alerts and history in one request (protected).
+  // sections limits the response, e.g. ['summary', 'alerts']
+  getDashboard: async (idToken, sections = null) => {
+    try {
+      const params = sections ? { sections: sections.join(',') } : {};
+      const response = await api.get('/api/dashboard', {
+        headers: { Authorization: `Bearer ${idToken}` },
+        params
+      });
+      return response.data;
+    } catch (error) {
+      throw new Error(error.response?.data?.error || 'Failed to get dashboard');
+    }
+  },
+
   // === PDF EXPORT ENDPOINT ===
   
   // Export nutrition report as PDF (protected)